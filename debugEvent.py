@@ -21,19 +21,45 @@
 # along with pyOBD; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 ###########################################################################
+from obd_trace import TraceLog, format_message
+
+DISPLAY_DEBUG = 1
+DISPLAY_WARNING = 2
+DISPLAY_ERROR = 3
+
+# Messages of all modules; pyobd's Trace tab shows them
+TRACE = TraceLog()
+
+# Messages at this level or above are also printed, None prints none
+_echo_level = DISPLAY_DEBUG
+
+
+def trace_enabled(level):
+    """False if messages of the level are dropped, so a caller can skip
+    building them"""
+    return TRACE.enabled(level)
+
+
+def set_echo(level):
+    """Sets the lowest level of the messages printed to the console, None
+    for none (they are formatted for the console as they are logged)"""
+    global _echo_level
+    _echo_level = level
+
+
+def debug_display(window, position, message, *args):
+    """Logs "message % args" at level position (formatted only if the
+    level is enabled) and prints it if the echo level is reached"""
+    if TRACE.add(position, message, args) and _echo_level is not None and \
+            position >= _echo_level:
+        print(format_message(message, args))
+
+
 try:
     import wx
-    
+
     EVT_DEBUG_ID = 1010
-    DISPLAY_DEBUG = 1
-    DISPLAY_WARNING = 2
-    DISPLAY_ERROR = 3
-
-    def debug_display(window, position, message):
-        print(message)
-        if window:
-            wx.PostEvent(window, DebugEvent([position, message]))
-       
+
     class DebugEvent(wx.PyEvent):
         DISPLAY_DEBUG = 1
         DISPLAY_WARNING = 2
@@ -46,6 +72,8 @@ try:
             self.SetEventType(EVT_DEBUG_ID)
             self.data = data
 except ImportError as e:
-    def debug_display(window, position, message):
-        print(message)
-    
+    # Headless (no wx): messages only go to the trace log and the console
+    class DebugEvent:
+        DISPLAY_DEBUG = 1
+        DISPLAY_WARNING = 2
+        DISPLAY_ERROR = 3
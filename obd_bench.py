@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_bench.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Microbenchmarks of the per-sample hot path.
+
+Each case times the previous implementation (kept here as a reference)
+against the current one on the same input:
+
+    ./obd_bench.py [-n iterations]
+
+With --port, the same PIDs are also read from a live adapter with the
+default and the compact (ATS0/ATL0) response format, reporting the bytes
+and transmission time per request for both, and with and without the
+addressing/count hints learned at connect (OBDPort.discover_ecus),
+reporting the latency per PID, as one sweep over the PIDs and the car's
+Mode 22 channels, read one by one and then packed into dynamically
+defined DIDs (OBDPort.enable_dynamic), and finally shown as one page by
+the SensorPoller, polled and then with the periodic messages the ECUs
+send (with the rest polled in between):
+
+    ./obd_bench.py --port /dev/ttyUSB0 [--pids 0C,0D,05] [--samples 20]
+"""
+
+import time
+import timeit
+
+import obd_io
+import obd_sensors
+from obd_poller import SensorPoller
+from obd_response import parse_response
+
+
+#__________________________________________________________________________
+# Reference implementations (hex string based)
+
+
+def _legacy_hex_to_int(str):
+    return int(str, 16)
+
+
+def _legacy_rpm(code):
+    code = _legacy_hex_to_int(code)
+    return code / 4
+
+
+def _legacy_temp(code):
+    code = _legacy_hex_to_int(code)
+    c = code - 40
+    return 32 + (9 * c / 5)
+
+
+def _legacy_hex_to_bitstring(str):
+    bitstring = ''
+    for i in str:
+        v = eval("0x%s" % i)
+        bitstring += v & 8 and '1' or '0'
+        bitstring += v & 4 and '1' or '0'
+        bitstring += v & 2 and '1' or '0'
+        bitstring += v & 1 and '1' or '0'
+    return bitstring
+
+
+def _legacy_get_sensor(id):
+    for sensor in obd_sensors.SENSORS:
+        if sensor.id == id:
+            return sensor
+    return None
+
+
+def _legacy_sensor_response(buffer, sensor):
+    """recv_result + is_hex_string + interpret_result + decode, as in
+    get_sensor_value before responses were parsed as bytes"""
+    data = buffer.decode()
+    end = data.find('\r\r>')
+    if end < 0:
+        end = data.find('>')
+    data = data[0:end].replace('\r', '')
+    if not obd_io.is_hex_string(data):
+        return data
+    data = obd_io.OBDPort.interpret_result(None, data, sensor.length)
+    return sensor.value(bytes.fromhex(data))
+
+
+def _sensor_response(buffer, sensor):
+    res = parse_response(buffer)
+    if not res.ok():
+        return res.describe()
+    payload = res.find(0x41, sensor.id)
+    return sensor.value(memoryview(payload)[2:2 + sensor.length])
+
+
+def _legacy_binary_response(buffer):
+    """recv_result + is_hex_string + bytearray.fromhex (send_command_binary)"""
+    data = buffer.decode()
+    end = data.find('\r\r>')
+    data = data[0:end].replace('\r', '')
+    if not obd_io.is_hex_string(data):
+        raise IOError(data)
+    return bytearray.fromhex(data)
+
+
+RPM_RESPONSE = bytearray(b"41 0C 1A F8 \r\r>")
+NODATA_RESPONSE = bytearray(b"NO DATA\r\r>")
+DTC_RESPONSE = bytearray(b"43 01 33 00 00 00 00 \r\r>")
+
+
+#__________________________________________________________________________
+
+
+# (name, reference, current), both called without arguments
+CASES = [
+    ("decode rpm",
+     lambda: _legacy_rpm("1AF8"),
+     lambda: obd_sensors.rpm(b"\x1a\xf8")),
+    ("decode coolant temp",
+     lambda: _legacy_temp("7B"),
+     lambda: obd_sensors.temp(b"\x7b")),
+    ("decode supported PIDs",
+     lambda: _legacy_hex_to_bitstring("BE1FA813"),
+     lambda: obd_sensors.bitstring(b"\xbe\x1f\xa8\x13")),
+    ("lookup PID 0x4D",
+     lambda: _legacy_get_sensor(0x4D),
+     lambda: obd_sensors.get_sensor(0x4D)),
+    ("parse + decode rpm response",
+     lambda: _legacy_sensor_response(RPM_RESPONSE, obd_sensors.get_sensor(0x0C)),
+     lambda: _sensor_response(RPM_RESPONSE, obd_sensors.get_sensor(0x0C))),
+    ("parse NO DATA response",
+     # the old path returned the adapter text ("NO DATA"), not "NODATA"
+     lambda: _legacy_sensor_response(NODATA_RESPONSE, obd_sensors.get_sensor(0x0C)).replace(' ', ''),
+     lambda: _sensor_response(NODATA_RESPONSE, obd_sensors.get_sensor(0x0C))),
+    ("parse binary DTC response",
+     lambda: bytes(_legacy_binary_response(DTC_RESPONSE)),
+     lambda: parse_response(DTC_RESPONSE).payloads[0][1]),
+]
+
+
+def run(number=100000, cases=None):
+    """Times every case. Returns [(name, reference us, current us)]."""
+    results = []
+    for name, reference, current in cases or CASES:
+        if reference() != current():
+            print("warning: %s: results differ (%r != %r)" % (name, reference(), current()))
+        ref = min(timeit.repeat(reference, number=number, repeat=3)) / number * 1e6
+        cur = min(timeit.repeat(current, number=number, repeat=3)) / number * 1e6
+        results.append((name, ref, cur))
+    return results
+
+
+def compare_formats(port, pids, samples=20):
+    """Reads the same PIDs with the default and the compact response
+    format. Returns (default CommandStats, compact CommandStats)."""
+    results = []
+    compact = port.is_compact()
+    try:
+        for enable in (False, True):
+            port.enable_compact(enable)
+            port.stats = obd_io.CommandStats(port.stats.baud)
+            for i in range(samples):
+                for pid in pids:
+                    port.sensor(pid)
+            results.append(port.stats)
+    finally:
+        port.enable_compact(compact)
+    return results
+
+
+def compare_routing(port, pids, samples=20):
+    """Reads the same PIDs functionally addressed without count hints, then
+    routed as learned by discover_ecus. Returns (before, after) CommandStats."""
+    results = []
+    try:
+        for enable in (False, True):
+            port.enable_routing(enable)
+            port.stats = obd_io.CommandStats(port.stats.baud)
+            for i in range(samples):
+                for pid in pids:
+                    port.sensor(pid)
+            results.append(port.stats)
+    finally:
+        port.enable_routing(True)
+    return results
+
+
+def compare_dynamic(port, indexes, samples=20):
+    """Reads the same sensors with sensors(), then with them packed into
+    dynamic DIDs (defined before the measurement). Returns (before, after)
+    CommandStats, per sweep over all sensors."""
+    results = []
+    try:
+        for enable in (False, True):
+            port.enable_dynamic(enable)
+            if enable:
+                port.sensors(indexes)
+            stats = obd_io.CommandStats(port.stats.baud)
+            for i in range(samples):
+                port.stats = obd_io.CommandStats(port.stats.baud)
+                start = time.perf_counter()
+                port.sensors(indexes)
+                stats.add(port.stats.sent, port.stats.received, time.perf_counter() - start)
+            results.append(stats)
+    finally:
+        port.enable_dynamic(False)
+    return results
+
+
+def compare_periodic(port, visible, seconds=5.0, rates=None):
+    """Shows the same page with polling only, then with periodic messages
+    where the ECUs send them (a mixed page when only some are), measured
+    after the periodic messages are set up. Returns [(polled reads/s,
+    pushed values/s, adapter commands (AT commands included) per polled
+    read, sensors streamed)]."""
+    results = []
+    sent = [0]
+    send_raw = port.send_raw
+
+    def counting_send_raw(data):
+        sent[0] += 1
+        return send_raw(data)
+
+    port.send_raw = counting_send_raw
+    try:
+        for periodic in (False, True):
+            poller = SensorPoller(port, rates=rates, periodic=periodic)
+            poller.set_pages(visible)
+            poller.start()
+            time.sleep(min(seconds, 2.0))
+            start, polls, pushed, commands = time.time(), poller.polls, poller.pushed, sent[0]
+            time.sleep(seconds)
+            elapsed = time.time() - start
+            polls, pushed, commands = (poller.polls - polls, poller.pushed - pushed,
+                                       sent[0] - commands)
+            streamed = len(port.periodic_sensors())
+            poller.stop()
+            poller.join(seconds)
+            results.append((polls / elapsed, pushed / elapsed, commands / float(polls or 1),
+                            streamed))
+    finally:
+        del port.send_raw
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decoder/parser microbenchmarks")
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    parser.add_argument("--port", help="also compare response formats on this adapter")
+    parser.add_argument("--pids", default="0C,0D,05,11", help="PIDs read with --port")
+    parser.add_argument("--samples", type=int, default=20)
+    args = parser.parse_args()
+
+    print("%-28s %12s %12s %8s" % ("case", "before (us)", "after (us)", "speedup"))
+    for name, ref, cur in run(args.number):
+        print("%-28s %12.3f %12.3f %7.1fx" % (name, ref, cur, ref / cur))
+
+    if args.port:
+        port = obd_io.OBDPort(args.port, None, 2, 2)
+        if port.State == 0:
+            raise SystemExit("Could not connect to %s: %s" % (args.port, port.Error))
+        pids = [int(p, 16) for p in args.pids.split(',')]
+        before, after = compare_formats(port, pids, args.samples)
+        print("")
+        print("default format: " + before.summary())
+        print("compact format: " + after.summary())
+
+        before, after = compare_routing(port, pids, args.samples)
+        print("")
+        print("%-8s %16s %16s" % ("request", "functional (ms)", "routed (ms)"))
+        for request in sorted(before.requests):
+            print("%-8s %16.2f %16.2f" % (request, before.latency(request) * 1000,
+                                          (after.latency(request) or 0) * 1000))
+
+        indexes = pids + [s.id for s in port.enhanced_sensors()]
+        before, after = compare_dynamic(port, indexes, args.samples)
+        print("")
+        print("sweep of %d sensors, one by one:  %.2f ms" %
+              (len(indexes), before.total_time * 1000 / before.count))
+        print("sweep of %d sensors, dynamic DID: %.2f ms" %
+              (len(indexes), after.total_time * 1000 / after.count))
+
+        print("")
+        print("%-20s %10s %10s %14s %9s" % ("page of %d sensors" % len(indexes),
+                                            "polled/s", "pushed/s", "commands/poll", "streamed"))
+        for name, result in zip(("polled", "periodic"),
+                                compare_periodic(port, indexes, args.samples / 4.0)):
+            print("%-20s %10.1f %10.1f %14.1f %9d" % ((name,) + result))
+        port.close()
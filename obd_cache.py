@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_cache.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""What is known about the vehicles connected before.
+
+Supported PIDs, the ECUs answering them and the protocol don't change for
+a car, so they are kept on disk per vehicle (by VIN where the car has
+one), and a reconnect to a known car skips finding them out again. The
+protocol of the last car is tried first when connecting.
+"""
+
+import json
+import os
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.pyobd_vehicles.json')
+
+
+#__________________________________________________________________________
+
+
+class VehicleCache:
+    """ Stored vehicles: {"last": vehicle, "vehicles": {vehicle: {...}}} """
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self._stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._stored = {}
+        self._vehicles = self._stored.setdefault('vehicles', {})
+
+    def last_protocol(self):
+        """Protocol (ATDPN number) of the car connected last, or None"""
+        entry = self._vehicles.get(self._stored.get('last'))
+        return entry is not None and entry.get('protocol') or None
+
+    def get(self, vehicle):
+        """Returns (protocol, responders, supported PIDs) of a known
+        vehicle, or None. responders is {pid: (ecu ids)}."""
+        entry = self._vehicles.get(vehicle)
+        if entry is None:
+            return None
+        self._stored['last'] = vehicle
+        responders = dict((int(pid, 16), tuple(ids))
+                          for pid, ids in entry.get('responders', {}).items())
+        return entry.get('protocol'), responders, entry.get('supported', [])
+
+    def put(self, vehicle, protocol, responders, supported):
+        self._stored['last'] = vehicle
+        self._vehicles[vehicle] = {
+            'protocol': protocol,
+            'responders': dict(("%.2X" % pid, list(ids)) for pid, ids in responders.items()),
+            'supported': list(supported),
+        }
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self._stored, f, indent=1, sort_keys=True)
+        except (IOError, OSError):
+            return False
+        return True
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_canlog.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Reading and writing saved CAN bus captures.
+
+Three formats are understood:
+
+ * the CSV written by the pyobd Monitoring tab ("Time,ID,Data,")
+ * candump log files ("(1436509052.249713) can0 123#DEADBEEF")
+ * a fixed-size binary record format (.canbin), which can be memory mapped
+   and is the fastest to process for long captures.
+
+Frames are handed around as (timestamp, id, data) tuples, with the
+timestamp in seconds and data as bytes.
+"""
+
+import os
+import struct
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+# One binary record: timestamp, CAN id, dlc, 3 pad bytes, 8 data bytes.
+BINARY_RECORD = struct.Struct('<dIB3x8s')
+BINARY_EXT = '.canbin'
+
+if HAS_NUMPY:
+    BINARY_DTYPE = np.dtype([('t', '<f8'), ('id', '<u4'), ('dlc', 'u1'),
+                             ('pad', 'u1', 3), ('data', 'u1', 8)])
+
+DEFAULT_CHUNK_FRAMES = 1 << 18
+
+
+#__________________________________________________________________________
+
+
+def parse_time(text):
+    """Converts a capture timestamp to seconds.
+
+    Accepts plain seconds or the "%H:%M:%S.%f" format of the Monitoring tab."""
+    if ':' not in text:
+        return float(text)
+
+    h, m, s = text.split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def parse_csv_line(line):
+    """Parses one line of a Monitoring tab CSV. Returns None for the header."""
+    fields = line.replace('"', '').split(',')
+    if len(fields) < 3 or fields[0] == 'Time':
+        return None
+
+    return (parse_time(fields[0].strip()), int(fields[1], 16),
+            bytes.fromhex(fields[2]))
+
+
+def parse_candump_line(line):
+    """Parses one line of a candump log file. Returns None if unparseable."""
+    fields = line.split()
+    if len(fields) < 3 or fields[0][0] != '(':
+        return None
+
+    id, sep, data = fields[2].partition('#')
+    if not sep:
+        return None
+    if data[:1] == 'R':  # remote frame, no payload
+        data = ''
+
+    return (float(fields[0][1:-1]), int(id, 16), bytes.fromhex(data))
+
+
+def capture_format(filename):
+    """Guesses the capture format from the file name/contents."""
+    if filename.endswith(BINARY_EXT):
+        return 'binary'
+
+    with open(filename, 'r') as f:
+        line = f.readline()
+
+    if line.startswith('('):
+        return 'candump'
+
+    return 'csv'
+
+
+def read_capture(filename):
+    """Iterates over all frames of a capture as (timestamp, id, data)"""
+    fmt = capture_format(filename)
+    if fmt == 'binary':
+        with open(filename, 'rb') as f:
+            while True:
+                rec = f.read(BINARY_RECORD.size * 4096)
+                if not rec:
+                    break
+
+                for t, id, dlc, data in BINARY_RECORD.iter_unpack(rec):
+                    yield (t, id, data[:dlc])
+        return
+
+    parse = fmt == 'candump' and parse_candump_line or parse_csv_line
+    with open(filename, 'r') as f:
+        for line in f:
+            frame = parse(line)
+            if frame is not None:
+                yield frame
+
+
+def read_capture_chunks(filename, chunk_frames=DEFAULT_CHUNK_FRAMES):
+    """Iterates over a capture in chunks of at most chunk_frames frames.
+
+    Each chunk is a tuple of numpy arrays (t, id, dlc, data) where data is a
+    (n, 8) uint8 array zero padded past the dlc. Binary captures are memory
+    mapped, so only the current chunk is ever resident."""
+    if not HAS_NUMPY:
+        raise ImportError("numpy is required for chunked capture reading")
+
+    if capture_format(filename) == 'binary':
+        if os.path.getsize(filename) == 0:
+            return
+
+        recs = np.memmap(filename, dtype=BINARY_DTYPE, mode='r')
+        for start in range(0, len(recs), chunk_frames):
+            chunk = recs[start:start + chunk_frames]
+            yield (np.array(chunk['t']), np.array(chunk['id']),
+                   np.array(chunk['dlc']), np.array(chunk['data']))
+        return
+
+    def to_arrays(ts, ids, dlcs, payload):
+        data = np.frombuffer(b''.join(payload), dtype=np.uint8).reshape(-1, 8)
+        return (np.array(ts, dtype=np.float64), np.array(ids, dtype=np.uint32),
+                np.array(dlcs, dtype=np.uint8), data)
+
+    ts, ids, dlcs, payload = [], [], [], []
+    for t, id, data in read_capture(filename):
+        ts.append(t)
+        ids.append(id)
+        dlcs.append(len(data))
+        payload.append(data.ljust(8, b'\x00')[:8])
+        if len(ts) == chunk_frames:
+            yield to_arrays(ts, ids, dlcs, payload)
+            ts, ids, dlcs, payload = [], [], [], []
+
+    if ts:
+        yield to_arrays(ts, ids, dlcs, payload)
+
+
+#__________________________________________________________________________
+
+
+class CaptureWriter:
+    """ Writes frames to a capture file (candump or binary format) """
+
+    def __init__(self, filename, iface='can0'):
+        self.filename = filename
+        self.iface = iface
+        self.binary = filename.endswith(BINARY_EXT)
+        self.count = 0
+        self._file = open(filename, self.binary and 'wb' or 'w')
+
+    def write(self, t, id, data):
+        if self.binary:
+            self._file.write(BINARY_RECORD.pack(t, id, len(data), bytes(data)))
+        else:
+            self._file.write("(%.6f) %s %.3X#%s\n" %
+                             (t, self.iface, id, bytes(data).hex().upper()))
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def convert_capture(src, dst):
+    """Converts a capture between formats (e.g. a candump log to .canbin)"""
+    with CaptureWriter(dst) as w:
+        for t, id, data in read_capture(src):
+            w.write(t, id, data)
+
+    return w.count
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("usage: obd_canlog.py <capture> <output capture>")
+        sys.exit(1)
+
+    print("Converted %d frames" % convert_capture(sys.argv[1], sys.argv[2]))
@@ -15,14 +15,12 @@ class OBD_Capture():
         self.port = None
         localtime = time.localtime(time.time())
 
-    def connect(self, port):
-        self.port = obd_io.OBDPort(port, None, 2, 2)
+    def connect(self, port, compact=False, tune_timeouts=False):
+        self.port = obd_io.OBDPort(port, None, 2, 2, compact, tune_timeouts)
         if(self.port.State == 0):
             # Failed to connect.
             self.port.close()
             self.port = None
-        else:
-            break
 
         if(self.port):
             print(("Connected to " + self.port.PortName))
@@ -30,7 +28,7 @@ class OBD_Capture():
         
         return False
 
-    def scan_ports():
+    def scan_ports(self):
         ports = []
         ports.extend(scanSerial())
         ports.extend(scanBluetooth())
@@ -43,26 +41,32 @@ class OBD_Capture():
     def getSupportedSensorList(self):
         return self.supportedSensorList 
 
-    def capture_data(self):
-
-        text = ""
-        #Find supported sensors - by getting PIDs from OBD
-        # its a string of binary 01010101010101 
-        # 1 means the sensor is supported
-        self.supp = self.port.sensor(0)[1]
-        if self.supp == "NODATA":
+    def read_supported_sensors(self):
+        """Reads the supported PIDs. Returns the supported sensor list."""
+        # Read at connect, or known from an earlier connection to the car
+        self.supp = self.port.supported_pids()
+        if not self.supp:
             print("OBD_Capture::capture_data - No data returned for sensors!")
 
         self.supportedSensorList = []
         self.unsupportedSensorList = []
 
-        # loop through PIDs binary
-        for i in range(0, len(self.supp)):
-            if self.supp[i] == "1":
+        for i in range(1, max(self.supp + [0x20]) + 1):
+            sensor = obd_sensors.get_sensor(i)
+            if sensor is None:
+                continue
+            if i in self.supp:
                 # store index of sensor and sensor object
-                self.supportedSensorList.append([i+1, obd_sensors.SENSORS[i+1]])
+                self.supportedSensorList.append([i, sensor])
             else:
-                self.unsupportedSensorList.append([i+1, obd_sensors.SENSORS[i+1]])
+                self.unsupportedSensorList.append([i, sensor])
+
+        return self.supportedSensorList
+
+    def capture_data(self):
+
+        text = ""
+        self.read_supported_sensors()
         
         for supportedSensor in self.supportedSensorList:
             text += "supported sensor index = " + str(supportedSensor[0]) + " " + str(supportedSensor[1].shortname) + "\n"
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_dbc.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Offline decoding of saved CAN captures with a DBC file.
+
+Frames are grouped by ID and every signal of a message is extracted for
+the whole group at once with numpy bit operations on the 64 bit payload.
+Captures are processed in chunks, so memory use is bounded by the chunk
+size (and by the output when decoding into memory).
+"""
+
+import os
+import re
+import time
+
+import obd_canlog
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+if HAS_NUMPY:
+    # Record layout of the columnar .f8 series files
+    SERIES_DTYPE = np.dtype([('t', '<f8'), ('value', '<f8')])
+
+CAN_EFF_FLAG = 0x80000000
+CAN_EFF_MASK = 0x1FFFFFFF
+
+_RE_MESSAGE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)')
+_RE_SIGNAL = re.compile(r'^\s*SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])'
+                        r'\s*\(([^,]+),([^)]+)\)\s*\[([^|]*)\|([^\]]*)\]\s*"([^"]*)"')
+
+
+#__________________________________________________________________________
+
+
+class Signal:
+    def __init__(self, name, start, length, little_endian, signed,
+                 factor, offset, minimum, maximum, unit, mux=None):
+        self.name = name
+        self.start = start
+        self.length = length
+        self.little_endian = little_endian
+        self.signed = signed
+        self.factor = factor
+        self.offset = offset
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        # None for plain signals, 'M' for the multiplexer and the
+        # multiplexer value for multiplexed signals.
+        self.mux = mux
+
+    def shift(self):
+        """Right shift of the signal inside the 64 bit payload word.
+
+        Intel signals are taken from the little endian word, Motorola
+        signals (start bit = MSB, sawtooth numbering) from the big endian one."""
+        if self.little_endian:
+            return self.start
+
+        msb = (self.start // 8) * 8 + (7 - self.start % 8)
+        return 64 - (msb + self.length)
+
+    def decode(self, raw):
+        """Converts an array of raw (uint64) values to physical values"""
+        if self.signed and self.length < 64:
+            values = raw.astype(np.int64)
+            half = 1 << (self.length - 1)
+            values = np.where(values >= half, values - (half << 1), values)
+        elif self.signed:
+            values = raw.view(np.int64)
+        else:
+            values = raw
+
+        return values * self.factor + self.offset
+
+
+class Message:
+    def __init__(self, id, name, dlc):
+        self.id = id
+        self.name = name
+        self.dlc = dlc
+        self.signals = []
+
+    def multiplexer(self):
+        for sig in self.signals:
+            if sig.mux == 'M':
+                return sig
+
+        return None
+
+
+class DBC:
+    """ A (minimal) DBC database: messages and their signals """
+
+    def __init__(self, filename=None):
+        self.messages = {}
+        if filename is not None:
+            self.load(filename)
+
+    def load(self, filename):
+        msg = None
+        with open(filename, 'r', encoding='latin-1') as f:
+            for line in f:
+                m = _RE_MESSAGE.match(line)
+                if m:
+                    id = int(m.group(1))
+                    if id & CAN_EFF_FLAG:
+                        id &= CAN_EFF_MASK
+                    msg = Message(id, m.group(2), int(m.group(3)))
+                    self.messages[id] = msg
+                    continue
+
+                m = _RE_SIGNAL.match(line)
+                if m and msg is not None:
+                    mux = m.group(2)
+                    if mux and mux != 'M':
+                        mux = int(mux[1:])
+                    msg.signals.append(Signal(
+                        m.group(1), int(m.group(3)), int(m.group(4)),
+                        m.group(5) == '1', m.group(6) == '-',
+                        float(m.group(7)), float(m.group(8)),
+                        float(m.group(9) or 0), float(m.group(10) or 0),
+                        m.group(11), mux))
+                elif not line.strip():
+                    msg = None
+
+    def signal_names(self):
+        names = []
+        for msg in self.messages.values():
+            for sig in msg.signals:
+                names.append("%s.%s" % (msg.name, sig.name))
+        return names
+
+
+#__________________________________________________________________________
+
+
+def _extract(sig, le64, be64):
+    if sig.little_endian:
+        raw = le64 >> np.uint64(sig.shift())
+    else:
+        raw = be64 >> np.uint64(sig.shift())
+    if sig.length < 64:
+        raw = raw & np.uint64((1 << sig.length) - 1)
+    return raw
+
+
+def decode_frames(dbc, t, ids, data, wanted=None):
+    """Decodes one chunk of frames.
+
+    t, ids and data are the arrays produced by obd_canlog.read_capture_chunks.
+    Returns a dict of "Message.Signal" -> (timestamps, values). If wanted is
+    a set of signal names, only those are decoded."""
+    series = {}
+    if len(ids) == 0:
+        return series
+
+    # Group frames by id: one stable sort, then contiguous runs per id.
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    uniq, starts = np.unique(sorted_ids, return_index=True)
+    ends = np.append(starts[1:], len(sorted_ids))
+
+    data = np.ascontiguousarray(data)
+    for id, start, end in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+        msg = dbc.messages.get(id)
+        if msg is None:
+            continue
+
+        sel = order[start:end]
+        rows = data[sel]
+        stamps = t[sel]
+        le64 = rows.view('<u8').ravel().astype(np.uint64)
+        be64 = rows.view('>u8').ravel().astype(np.uint64)
+
+        mux_values = None
+        mux = msg.multiplexer()
+        if mux is not None:
+            mux_values = _extract(mux, le64, be64)
+
+        for sig in msg.signals:
+            name = "%s.%s" % (msg.name, sig.name)
+            if wanted is not None and name not in wanted:
+                continue
+
+            if isinstance(sig.mux, int):
+                if mux_values is None:
+                    continue  # multiplexed, but the message has no multiplexer
+                mask = mux_values == sig.mux
+                if not mask.any():
+                    continue
+                raw = _extract(sig, le64[mask], be64[mask])
+                series[name] = (stamps[mask], sig.decode(raw))
+            else:
+                series[name] = (stamps, sig.decode(_extract(sig, le64, be64)))
+
+    return series
+
+
+def decode_capture(dbc, filename, chunk_frames=obd_canlog.DEFAULT_CHUNK_FRAMES,
+                   wanted=None):
+    """Decodes a whole capture into memory.
+
+    Returns a dict of "Message.Signal" -> (timestamps, values) numpy arrays."""
+    parts = {}
+    for t, ids, dlc, data in obd_canlog.read_capture_chunks(filename, chunk_frames):
+        for name, (stamps, values) in decode_frames(dbc, t, ids, data, wanted).items():
+            parts.setdefault(name, []).append((stamps, values))
+
+    series = {}
+    for name, chunks in parts.items():
+        series[name] = (np.concatenate([c[0] for c in chunks]),
+                        np.concatenate([c[1] for c in chunks]))
+    return series
+
+
+def decode_capture_to_dir(dbc, filename, outdir, fmt='f8',
+                          chunk_frames=obd_canlog.DEFAULT_CHUNK_FRAMES, wanted=None):
+    """Decodes a capture into one columnar file per signal.
+
+    fmt 'f8' writes (t, value) float64 records (read back with
+    np.fromfile(path, dtype=SERIES_DTYPE)), 'csv' writes "t,value" text.
+    Output is appended chunk by chunk, so memory use stays bounded.
+    Returns a dict of signal name -> number of samples written."""
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    files = {}
+    counts = {}
+    try:
+        for t, ids, dlc, data in obd_canlog.read_capture_chunks(filename, chunk_frames):
+            for name, (stamps, values) in decode_frames(dbc, t, ids, data, wanted).items():
+                f = files.get(name)
+                if f is None:
+                    path = os.path.join(outdir, "%s.%s" % (name, fmt))
+                    f = files[name] = open(path, fmt == 'csv' and 'w' or 'wb')
+                    counts[name] = 0
+
+                if fmt == 'csv':
+                    np.savetxt(f, np.column_stack((stamps, values)),
+                               fmt='%.6f', delimiter=',')
+                else:
+                    rec = np.empty(len(stamps), dtype=SERIES_DTYPE)
+                    rec['t'] = stamps
+                    rec['value'] = values
+                    rec.tofile(f)
+                counts[name] += len(stamps)
+    finally:
+        for f in files.values():
+            f.close()
+
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        print("usage: obd_dbc.py <file.dbc> <capture> [output dir]")
+        sys.exit(1)
+
+    dbc = DBC(sys.argv[1])
+    start = time.time()
+    if len(sys.argv) == 4:
+        counts = decode_capture_to_dir(dbc, sys.argv[2], sys.argv[3])
+    else:
+        counts = dict((name, len(s[0])) for name, s in
+                      decode_capture(dbc, sys.argv[2]).items())
+
+    for name, n in sorted(counts.items()):
+        print("%-40s %d samples" % (name, n))
+    print("Decoded %d signals in %.2f s" % (len(counts), time.time() - start))
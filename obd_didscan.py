@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_didscan.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Scans the Mode 22 DID space (0000-FFFF) of ECUs for undocumented DIDs.
+
+A DID per round trip takes hours, so the scanner:
+
+- asks for up to MAX_BATCH DIDs per request (as many as fit in a single
+  frame request, the most an ELM327 sends), once a probe showed the ECU
+  answers a request with supported and unsupported DIDs mixed (most
+  ECUs drop the unsupported ones; some reject the whole request);
+- sends requests physically with a response count hint, so the adapter
+  returns as soon as the one answer is in instead of waiting out ATST;
+- skips the ranges ISO 14229-1 reserves (unless --all), stops on ECUs
+  that answer that they don't do the service, and records DIDs refused
+  with "conditions not correct" or "security access denied" as existing;
+- works through the ECUs in turns of BLOCK requests, so progress is
+  spread over all of them when the car is switched off, and changes the
+  header once per turn.
+
+Progress is saved to SCAN_FILE per vehicle every CHECKPOINT_INTERVAL
+seconds and when the ECUs stop answering (ignition off), and the next run
+continues from there:
+
+    ./obd_didscan.py --port /dev/ttyUSB0 [--ecus 7E0,7E1] [--range 0000-FFFF]
+    ./obd_didscan.py --port sim          # simulated car (obd_sim)
+
+--export writes the DIDs found in the obd_mode22 definition format.
+"""
+
+import json
+import os
+import sys
+import time
+
+import obd_io
+import obd_uds
+
+SCAN_FILE = os.path.join(os.path.expanduser('~'), '.pyobd_didscan.json')
+
+MAX_BATCH = obd_uds.MAX_DIDS  # DIDs per request for ECUs that take several
+BLOCK = 32  # requests per ECU turn
+OFFLINE_LIMIT = 8  # unanswered requests in a row: the ECU is gone
+CHECKPOINT_INTERVAL = 10.0  # s
+REPORT_INTERVAL = 5.0  # s
+
+PROBE_DID = 0xF190  # VIN, read by most UDS ECUs
+RESERVED_DID = 0xFFFF  # ISO/SAE reserved, never supported
+
+# DID ranges ISO 14229-1 reserves for legislative use or ISO/SAE
+RESERVED = ((0xA600, 0xA7FF), (0xAD00, 0xAFFF), (0xB200, 0xBFFF), (0xC300, 0xCEFF),
+            (0xFB00, 0xFCFF), (0xFF01, 0xFFFF))
+
+# NRCs: the DID exists but can't be read now / the ECU doesn't do Mode 22
+EXISTS = (0x22, 0x33)
+NO_SERVICE = (0x11, 0x7F)
+
+
+#__________________________________________________________________________
+
+
+class EcuScan:
+    """ Progress of the scan of one ECU (by its request header) """
+
+    def __init__(self, header, start, end):
+        self.header = header
+        self.start = start
+        self.end = end
+        self.next = start  # first DID not scanned yet
+        self.batch = None  # DIDs per request, None until probed
+        self.found = {}  # DID -> data
+        self.denied = {}  # DID -> NRC, for DIDs that exist but were refused
+        self.done = False
+        self.stopped = None  # why the ECU was given up on
+        self.offline = False  # stopped answering, retried on the next run
+        self.misses = 0  # unanswered requests in a row
+        self.requests = 0
+        self.scanned = 0
+
+    def progress(self):
+        if self.done:
+            return 1.0
+        return float(self.next - self.start) / (self.end - self.start + 1)
+
+    def state(self):
+        return {
+            'range': [self.start, self.end], 'next': self.next, 'batch': self.batch,
+            'found': dict(("%.4X" % did, data.hex()) for did, data in self.found.items()),
+            'denied': dict(("%.4X" % did, nrc) for did, nrc in self.denied.items()),
+            'done': self.done, 'stopped': self.stopped,
+        }
+
+    def restore(self, state):
+        if state.get('range') != [self.start, self.end]:
+            return False
+        self.next = state['next']
+        self.batch = state.get('batch')
+        self.found = dict((int(did, 16), bytes.fromhex(data))
+                          for did, data in state.get('found', {}).items())
+        self.denied = dict((int(did, 16), nrc) for did, nrc in state.get('denied', {}).items())
+        self.done = state.get('done', False)
+        self.stopped = state.get('stopped')
+        return True
+
+
+class DIDScanner:
+    """ Scans several ECUs in turns, see the module docstring """
+
+    def __init__(self, port, headers, start=0x0000, end=0xFFFF, skip=RESERVED,
+                 max_batch=MAX_BATCH, path=SCAN_FILE):
+        self.port = port
+        self.scans = [EcuScan(header, start, end) for header in headers]
+        self.skip = sorted(skip)
+        self.max_batch = max_batch
+        self.path = path
+        self.vehicle = port.vehicle or port.identify()
+        self.hints = True  # response count hints, off if the adapter refuses them
+        self.started = None
+        self.requests = 0
+        self.scanned = 0
+
+    def load(self):
+        """Continues an earlier scan of this vehicle. Returns the number of
+        ECUs resumed."""
+        try:
+            with open(self.path) as f:
+                stored = json.load(f).get(self.vehicle, {})
+        except (IOError, OSError, ValueError):
+            return 0
+        return len([scan for scan in self.scans
+                    if "%X" % scan.header in stored and scan.restore(stored["%X" % scan.header])])
+
+    def save(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            stored = {}
+        vehicle = stored.setdefault(self.vehicle, {})
+        for scan in self.scans:
+            vehicle["%X" % scan.header] = scan.state()
+        with open(self.path, 'w') as f:
+            json.dump(stored, f, indent=1, sort_keys=True)
+
+    def run(self, report=None):
+        """Scans until every ECU is done or stopped answering. report is
+        called with a status line every REPORT_INTERVAL seconds."""
+        self.started = time.time()
+        checkpoint = reported = self.started
+        try:
+            while True:
+                active = [scan for scan in self.scans
+                          if not scan.done and not scan.stopped and not scan.offline]
+                if not active:
+                    break
+                for scan in active:
+                    self.port.set_header(scan.header)
+                    if scan.batch is None:
+                        scan.batch = self.probe(scan)
+                    for i in range(BLOCK):
+                        if scan.done or scan.stopped or scan.offline:
+                            break
+                        self.step(scan)
+
+                    now = time.time()
+                    if now - checkpoint >= CHECKPOINT_INTERVAL:
+                        self.save()
+                        checkpoint = now
+                    if report is not None and now - reported >= REPORT_INTERVAL:
+                        report(self.summary())
+                        reported = now
+        finally:
+            self.save()
+        if report is not None:
+            report(self.summary())
+
+    #______________________________________________________________________
+
+    def _query(self, dids):
+        res = self.port.query(obd_uds.request(dids) + (self.hints and "1" or ""), retry=False)
+        if res.error == '?' and self.hints:
+            self.hints = False
+            return self._query(dids)
+        if self.hints and obd_uds.negative(res) == obd_uds.RESPONSE_PENDING:
+            # The adapter stopped at "response pending": ask again and wait
+            res = self.port.query(obd_uds.request(dids), retry=False)
+        self.requests += 1
+        return res
+
+    def probe(self, scan):
+        """Finds out if the ECU answers requests for several DIDs with the
+        supported ones when some are not (then MAX_BATCH DIDs are sent per
+        request), from the VIN DID and a reserved one"""
+        if self.max_batch <= 1 or self._query([PROBE_DID]).find(obd_uds.POSITIVE) is None:
+            return 1
+        payload = self._query([PROBE_DID, RESERVED_DID]).find(obd_uds.POSITIVE)
+        if payload is None or payload[1:3] != PROBE_DID.to_bytes(2, 'big'):
+            return 1
+        return self.max_batch
+
+    def _next_dids(self, scan, n):
+        """The next n DIDs to ask for, around the skipped ranges"""
+        dids = []
+        did = scan.next
+        while did <= scan.end and len(dids) < n:
+            for first, last in self.skip:
+                if first <= did <= last:
+                    did = last + 1
+                    break
+            else:
+                dids.append(did)
+                did += 1
+        return dids, did
+
+    def step(self, scan):
+        """One request to the ECU (the header must be set)"""
+        dids, following = self._next_dids(scan, scan.batch)
+        if not dids:
+            scan.next = following
+            scan.done = True
+            return
+
+        res = self._query(dids)
+        scan.requests += 1
+        payload = res.find(obd_uds.POSITIVE)
+        nrc = obd_uds.negative(res)
+        if payload is None and nrc is None:
+            scan.misses += 1
+            if scan.misses >= OFFLINE_LIMIT:
+                scan.offline = True
+            return  # ask again
+        scan.misses = 0
+
+        if nrc in obd_uds.NO_BATCH and len(dids) > 1:
+            scan.batch = 1
+            return
+        if nrc in NO_SERVICE:
+            scan.stopped = "no Mode 22 (%s)" % obd_uds.describe(nrc)
+            return
+
+        if payload is not None or nrc in EXISTS:
+            if len(dids) == 1:
+                if payload is not None:
+                    scan.found[dids[0]] = bytes(payload[3:])
+                else:
+                    scan.denied[dids[0]] = nrc
+            else:
+                # Rare: sort the batch out one DID at a time
+                for did in dids:
+                    sub = self._query([did])
+                    scan.requests += 1
+                    sub_payload = sub.find(obd_uds.POSITIVE)
+                    sub_nrc = obd_uds.negative(sub)
+                    if sub_payload is not None:
+                        scan.found[did] = bytes(sub_payload[3:])
+                    elif sub_nrc in EXISTS:
+                        scan.denied[did] = sub_nrc
+
+        scan.next = following
+        scan.scanned += len(dids)
+        self.scanned += len(dids)
+        if scan.next > scan.end:
+            scan.done = True
+
+    #______________________________________________________________________
+
+    def summary(self):
+        elapsed = max(time.time() - (self.started or time.time()), 1e-3)
+        lines = ["%d DIDs in %.1f s: %.0f DIDs/s, %.1f requests/s" %
+                 (self.scanned, elapsed, self.scanned / elapsed, self.requests / elapsed)]
+        for scan in self.scans:
+            lines.append("  %X: %5.1f%%, next %.4X, %d found, %d refused%s" % (
+                scan.header, scan.progress() * 100, min(scan.next, 0xFFFF), len(scan.found),
+                len(scan.denied),
+                scan.stopped and ", stopped: " + scan.stopped or
+                scan.offline and ", not answering (ignition off?)" or scan.done and ", done" or ""))
+        return "\n".join(lines)
+
+    def export(self, filename):
+        """Writes the DIDs found as an obd_mode22 definition file (raw hex
+        values, to be given names and formulas)"""
+        with open(filename, 'w') as f:
+            f.write("# DIDs found by obd_didscan on %s\n" % self.vehicle)
+            f.write("#\n# did|bytes|shortname|name|formula|unit|min|max\n")
+            for scan in self.scans:
+                if not scan.found:
+                    continue
+                f.write("!header %X\n!batch %d\n" % (scan.header, scan.batch or 1))
+                for did, data in sorted(scan.found.items()):
+                    f.write("%.4X|%d|did_%X_%.4X|DID %.4X|@raw|||\n" %
+                            (did, len(data), scan.header, did, did))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mode 22 DID scanner")
+    parser.add_argument("--port", required=True,
+                        help="serial port, bluetooth MAC, SocketCAN interface or 'sim'")
+    parser.add_argument("--ecus", help="request headers, e.g. 7E0,7E1 (default: ECUs found)")
+    parser.add_argument("--range", default="0000-FFFF", help="DIDs to scan")
+    parser.add_argument("--all", action="store_true", help="also scan the ISO reserved ranges")
+    parser.add_argument("--batch", type=int, default=MAX_BATCH,
+                        help="max DIDs per request (more than %d need an adapter that "
+                             "sends multi-frame requests)" % MAX_BATCH)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved progress")
+    parser.add_argument("--file", default=SCAN_FILE, help="progress file")
+    parser.add_argument("--export", help="write the DIDs found as a definition file")
+    parser.add_argument("--compact", action="store_true",
+                        help="responses without spaces/linefeeds (fewer bytes per read)")
+    parser.add_argument("--log", default=os.devnull,
+                        help="file for the adapter debug output (default: discarded)")
+    args = parser.parse_args()
+
+    # OBDPort prints its debug output; keep it off the screen
+    stdout = sys.stdout
+    sys.stdout = open(args.log, 'a')
+    try:
+        port = obd_io.OBDPort(args.port, None, 2, 2, args.compact)
+        if port.State == 0:
+            raise SystemExit("Could not connect to %s: %s" % (args.port, port.Error))
+
+        if args.ecus:
+            headers = [int(h, 16) for h in args.ecus.split(',')]
+        else:
+            headers = [obd_io.physical_header(ecu) for ecu in port.ecus() if ecu is not None]
+        first, last = [int(d, 16) for d in args.range.split('-')]
+
+        def report(text):
+            stdout.write(text + "\n")
+            stdout.flush()
+
+        scanner = DIDScanner(port, headers or [0x7E0], first, last,
+                             args.all and () or RESERVED, args.batch, args.file)
+        if not args.restart and scanner.load():
+            report("Resuming the scan of %s" % scanner.vehicle)
+        try:
+            scanner.run(report)
+        except KeyboardInterrupt:
+            report("Stopped, progress saved")
+        if args.export:
+            scanner.export(args.export)
+        port.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_freeze.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Freeze frames (Mode 02): the Mode 01 values an ECU stored when it set a
+trouble code.
+
+A Mode 02 request names the PID and the frame number ("02 0C 00"), the
+answer repeats both before the data ("42 0C 00 1A F8"). PID 02 of a frame
+is the DTC that caused it. On CAN several PID/frame pairs can be asked
+for in one request.
+"""
+
+import obd_sensors
+
+MODE = 0x02
+RESPONSE = 0x42
+DTC_PID = 0x02  # DTC that caused the freeze frame
+MAX_FRAMES = 8  # frames tried per ECU (most store only frame 0)
+MAX_BATCH = 3  # PID/frame pairs per request, fits one CAN frame
+
+
+#__________________________________________________________________________
+
+
+class FreezeFrame:
+    """ One stored freeze frame """
+
+    def __init__(self, ecu, frame, dtc):
+        self.ecu = ecu  # CAN id of the ECU, None if not known
+        self.frame = frame
+        self.dtc = dtc  # e.g. "P0133"
+        self.values = []  # [(pid, name, value, unit)]
+
+    def rows(self):
+        """(name, value, unit) text rows, e.g. for a list view"""
+        rows = []
+        for pid, name, value, unit in self.values:
+            if type(value) == float:
+                value = "%.2f" % round(value, 3)
+            rows.append((name, str(value), unit))
+        return rows
+
+
+def request(pids, frame):
+    """Mode 02 request for the given PIDs of one frame ("020C000D00")"""
+    return "%.2X" % MODE + "".join("%.2X%.2X" % (pid, frame) for pid in pids)
+
+
+def batches(pids, can):
+    """Splits the PIDs into requests: up to MAX_BATCH per request on CAN,
+    one per request on the other protocols"""
+    size = can and MAX_BATCH or 1
+    return [pids[i:i + size] for i in range(0, len(pids), size)]
+
+
+def split(payload, pids, frame):
+    """Splits a Mode 02 answer into {pid: data}. ECUs leave out PIDs they
+    don't store, so the answer is walked by the PIDs it contains."""
+    values = {}
+    i = 1
+    while i + 2 < len(payload):
+        pid = payload[i]
+        if pid not in pids or payload[i + 1] != frame:
+            break
+        sensor = obd_sensors.get_sensor(pid)
+        length = sensor is not None and sensor.length or len(payload) - i - 2
+        values[pid] = bytes(payload[i + 2:i + 2 + length])
+        i += 2 + length
+    return values
+
+
+def supported(bitmap, base):
+    """PIDs flagged in a 4 byte supported PID bitmap"""
+    bits = int.from_bytes(bitmap, 'big')
+    return [base + i + 1 for i in range(32) if bits & (0x80000000 >> i)]
@@ -9,10 +9,13 @@
 
 import os
 import wx
+import math
 import time
 from threading import Thread
 
 from obd_capture import OBD_Capture
+from obd_poller import SensorPoller
+from obd_values import ValueStore
 from obd_sensors import SENSORS
 from obd_sensors import *
 
@@ -24,15 +27,75 @@ LOGO_FILENAME 		= "cowfish.png"
 
 #-------------------------------------------------------------------------------
 
-def obd_connect(o):
+# Gauges shown per page
+GAUGES_PER_PAGE = 6
+
+# Frame rate of the gauge canvas
+GAUGE_FPS = 30
+
+# Poll rate (Hz) per sensor index, everything else uses obd_poller.DEFAULT_RATE
+GAUGE_RATES = {
+    0x04: 2.0,   # engine load
+    0x05: 0.2,   # coolant temperature
+    0x0C: 5.0,   # engine RPM
+    0x0D: 2.0,   # vehicle speed
+    0x0F: 0.2,   # intake air temperature
+    0x10: 2.0,   # MAF
+    0x11: 5.0,   # throttle position
+}
+
+# Gauge styles per sensor index: (style, minimum, maximum). Sensors not
+# listed get a digital readout.
+GAUGE_DIGITAL = 0
+GAUGE_DIAL = 1
+GAUGE_BAR = 2
+GAUGE_STYLES = {
+    0x04: (GAUGE_BAR, 0, 100),     # engine load
+    0x05: (GAUGE_BAR, -40, 250),   # coolant temperature
+    0x0C: (GAUGE_DIAL, 0, 8000),   # engine RPM
+    0x0D: (GAUGE_DIAL, 0, 160),    # vehicle speed
+    0x11: (GAUGE_BAR, 0, 100),     # throttle position
+}
+
+GAUGE_FRAME_COLOUR = wx.Colour(90, 90, 90)
+GAUGE_SCALE_COLOUR = wx.Colour(200, 200, 200)
+GAUGE_NEEDLE_COLOUR = wx.Colour(255, 90, 30)
+
+# Connection progress event, data is (state, text)
+EVT_CONNECT_ID = wx.NewId()
+CONNECT_PROGRESS = 0
+CONNECT_DONE = 1
+
+#-------------------------------------------------------------------------------
+
+class ConnectEvent(wx.PyEvent):
+    """Connection progress, posted by the connection thread."""
+
+    def __init__(self, data):
+        wx.PyEvent.__init__(self)
+        self.SetEventType(EVT_CONNECT_ID)
+        self.data = data
+
+def obd_connect(o, notify=None):
+    def progress(state, text):
+        print(text)
+        if notify:
+            wx.PostEvent(notify, ConnectEvent((state, text)))
+
     while True:
+        progress(CONNECT_PROGRESS, " Scanning ports...\n")
         ports = o.scan_ports()
-        print(("Found ports: " + str(ports)))
+        progress(CONNECT_PROGRESS, " Found ports: " + str(ports) + "\n")
 
-        if o.connect(ports[0]):
-            break
+        if ports:
+            progress(CONNECT_PROGRESS, " Trying to connect to %s...\n" % ports[0])
+            if o.connect(ports[0]):
+                break
         time.sleep(1)
 
+    progress(CONNECT_PROGRESS, " Connected, reading supported sensors...\n")
+    progress(CONNECT_DONE, str(o.capture_data()))
+
 class OBDConnection(object):
     """
     Class for OBD connection. Use a thread for connection.
@@ -44,8 +107,10 @@ class OBDConnection(object):
     def get_capture(self):
         return self.c
 
-    def connect(self):
-        self.t = Thread(target=obd_connect, args=(self.c,))
+    def connect(self, notify=None):
+        """Connects in the background. Progress is posted to notify as ConnectEvents."""
+        self.t = Thread(target=obd_connect, args=(self.c, notify))
+        self.t.daemon = True
         self.t.start()
 
     def is_connected(self):
@@ -100,42 +165,189 @@ class OBDText(wx.TextCtrl):
 
 #-------------------------------------------------------------------------------
 
-class OBDStaticBox(wx.StaticBox):
+def getBackground():
     """
-    OBD StaticBox.
+    Background image scaled to the display, shared by all frames and panels.
     """
+    global _background
+    if _background is None:
+        image = wx.Image(BACKGROUND_FILENAME)
+        width, height = wx.GetDisplaySize()
+        image = image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
+        _background = wx.BitmapFromImage(image)
+    return _background
 
-    def __init__(self, *args, **kwargs):
+_background = None
+
+#-------------------------------------------------------------------------------
+
+class Gauge(object):
+    """
+    One gauge on the canvas: a dial, a bar or a digital readout.
+
+    The face (frame, ticks, name) is drawn once into the page bitmap; only
+    the value part is drawn on every repaint of the gauge's rectangle.
+    """
+
+    # Fraction of the remaining distance the needle/bar moves per frame
+    EASING = 0.35
+
+    def __init__(self, index, sensor):
+        self.index = index
+        self.sensor = sensor
+        self.style, self.lo, self.hi = GAUGE_STYLES.get(index, (GAUGE_DIGITAL, 0, 0))
+        self.rect = wx.Rect(0, 0, 0, 0)
+        self.text = "--"
+        self.target = None  # numeric value, None if not numeric
+        self.shown = None   # value the needle/bar currently shows
+
+    def setValue(self, result):
         """
-        Constructor.
+        Take a (name, value, unit) result. Returns True if the gauge changed.
         """
-        wx.StaticBox.__init__(self, *args, **kwargs)
+        value = result[1]
+        if type(value)==float:
+            text = str("%.2f"%round(value, 3))
+        else:
+            text = str(value)
 
-    def OnPaint(self, event): 
-        self.Paint(wx.PaintDC(self)) 
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            target = float(value)
+        else:
+            target = None
+
+        changed = text != self.text or target != self.target
+        self.text = text
+        self.target = target
+        if target is None:
+            self.shown = None
+        elif self.shown is None:
+            self.shown = target
+        return changed
+
+    def step(self):
+        """
+        Move the needle/bar towards the value. Returns True while animating.
+        """
+        if self.target is None or self.shown is None or self.style == GAUGE_DIGITAL:
+            return False
 
-    def Paint(self, dc): 
-        dc.DrawBitmap(self.bitmap, 0, 0)     
+        delta = self.target - self.shown
+        if abs(delta) <= (self.hi - self.lo) * 0.002:
+            if delta:
+                self.shown = self.target
+                return True
+            return False
+
+        self.shown += delta * self.EASING
+        return True
+
+    def fraction(self):
+        if self.shown is None or self.hi <= self.lo:
+            return 0.0
+        return min(max((self.shown - self.lo) / (self.hi - self.lo), 0.0), 1.0)
+
+    def dialGeometry(self):
+        x, y, w, h = self.rect.Get()
+        radius = min(w, h) * 0.36
+        return x + w / 2.0, y + h * 0.45, radius
+
+    @staticmethod
+    def dialPoint(cx, cy, radius, f):
+        # 240 degree sweep, minimum at the bottom left
+        angle = math.radians(210 - 240 * f)
+        return cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+
+    def barRect(self):
+        x, y, w, h = self.rect.Get()
+        return x + w * 0.1, y + h * 0.55, w * 0.8, h * 0.1
+
+    def drawFace(self, gc, fonts):
+        x, y, w, h = self.rect.Get()
+        gc.SetPen(wx.Pen(GAUGE_FRAME_COLOUR, 2))
+        gc.SetBrush(wx.TRANSPARENT_BRUSH)
+        gc.DrawRoundedRectangle(x, y, w, h, 8)
+
+        # Unit and name at the bottom
+        gc.SetFont(fonts['label'], wx.WHITE)
+        lines = [self.sensor.unit, self.sensor.name]
+        ty = y + h - 10
+        for line in reversed(lines):
+            tw, th = gc.GetTextExtent(line)[:2]
+            ty -= th
+            gc.DrawText(line, x + (w - tw) / 2.0, ty)
+
+        if self.style == GAUGE_DIAL:
+            cx, cy, radius = self.dialGeometry()
+            gc.SetPen(wx.Pen(GAUGE_SCALE_COLOUR, 2))
+            arc = [self.dialPoint(cx, cy, radius, i / 48.0) for i in range(49)]
+            gc.StrokeLines(arc)
+            for i in range(11):
+                outer = self.dialPoint(cx, cy, radius, i / 10.0)
+                inner = self.dialPoint(cx, cy, radius * (i % 5 and 0.92 or 0.85), i / 10.0)
+                gc.StrokeLine(inner[0], inner[1], outer[0], outer[1])
+
+            gc.SetFont(fonts['scale'], GAUGE_SCALE_COLOUR)
+            for f, value in ((0.0, self.lo), (1.0, self.hi)):
+                label = "%g" % value
+                tx, ty = self.dialPoint(cx, cy, radius * 1.15, f)
+                tw, th = gc.GetTextExtent(label)[:2]
+                gc.DrawText(label, tx - tw / 2.0, ty)
+
+        elif self.style == GAUGE_BAR:
+            bx, by, bw, bh = self.barRect()
+            gc.SetPen(wx.Pen(GAUGE_SCALE_COLOUR, 1))
+            gc.DrawRectangle(bx, by, bw, bh)
+
+    def drawValue(self, gc, fonts):
+        x, y, w, h = self.rect.Get()
+
+        if self.style == GAUGE_DIAL:
+            cx, cy, radius = self.dialGeometry()
+            if self.shown is not None:
+                tip = self.dialPoint(cx, cy, radius * 0.9, self.fraction())
+                gc.SetPen(wx.Pen(GAUGE_NEEDLE_COLOUR, 3))
+                gc.StrokeLine(cx, cy, tip[0], tip[1])
+            gc.SetFont(fonts['small'], wx.WHITE)
+            tw, th = gc.GetTextExtent(self.text)[:2]
+            gc.DrawText(self.text, cx - tw / 2.0, cy + radius * 0.3)
+
+        elif self.style == GAUGE_BAR:
+            bx, by, bw, bh = self.barRect()
+            if self.shown is not None:
+                gc.SetPen(wx.TRANSPARENT_PEN)
+                gc.SetBrush(wx.Brush(GAUGE_NEEDLE_COLOUR))
+                gc.DrawRectangle(bx + 1, by + 1, max((bw - 2) * self.fraction(), 0), bh - 2)
+            gc.SetFont(fonts['value'], wx.WHITE)
+            tw, th = gc.GetTextExtent(self.text)[:2]
+            gc.DrawText(self.text, x + (w - tw) / 2.0, by - th - 10)
+
+        else:
+            gc.SetFont(fonts['value'], wx.WHITE)
+            tw, th = gc.GetTextExtent(self.text)[:2]
+            gc.DrawText(self.text, x + (w - tw) / 2.0, y + 20)
 
 #-------------------------------------------------------------------------------
 
 class OBDPanelGauges(wx.Panel):
     """
     Panel for gauges.
+
+    A single custom drawn canvas: the background and the gauge faces of the
+    current page are rendered once into a bitmap, and each frame only the
+    rectangles of gauges whose value changed are repainted.
     """
-    
+
     def __init__(self, *args, **kwargs):
         """
         Constructor.
         """
         super(OBDPanelGauges, self).__init__(*args, **kwargs)
 
-        # Background image
-        image = wx.Image(BACKGROUND_FILENAME) 
-        width, height = wx.GetDisplaySize() 
-        image = image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
-        self.bitmap = wx.BitmapFromImage(image) 
+        # We paint every pixel ourselves, double buffered
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_SIZE, self.OnSize)
 
         # Create an accelerator table
         lid = wx.NewId()
@@ -144,137 +356,151 @@ class OBDPanelGauges(wx.Panel):
         self.Bind(wx.EVT_MENU, self.onCtrlC, id=cid)
         self.Bind(wx.EVT_MENU, self.onLeft, id=lid)
         self.Bind(wx.EVT_MENU, self.onRight, id=rid)
-        self.accel_tbl = wx.AcceleratorTable([ 
-                (wx.ACCEL_CTRL, ord('C'), cid), 
-                (wx.ACCEL_NORMAL, wx.WXK_LEFT, lid), 
-                (wx.ACCEL_NORMAL, wx.WXK_RIGHT, rid), 
+        self.accel_tbl = wx.AcceleratorTable([
+                (wx.ACCEL_CTRL, ord('C'), cid),
+                (wx.ACCEL_NORMAL, wx.WXK_LEFT, lid),
+                (wx.ACCEL_NORMAL, wx.WXK_RIGHT, rid),
                 ])
         self.SetAcceleratorTable(self.accel_tbl)
 
         # Handle events for mouse clicks
         self.Bind(wx.EVT_LEFT_DOWN, self.onLeft)
         self.Bind(wx.EVT_RIGHT_DOWN, self.onRight)
-        
+
         # Connection
         self.connection = None
 
-        # Sensors 
+        # Sensors
         self.istart = 0
         self.sensors = []
-        
-        # Port 
-        self.port = None
+        self.direction = 1  # page flip direction, for prefetching
+
+        # Values are read in the background, the panel only reads the cache
+        self.poller = None
+        self.values = None
 
-        # List to hold children widgets
-        self.boxes = []
-        self.texts = []
+        # Gauges by sensor index (kept across pages) and those on screen
+        self.allGauges = {}
+        self.gauges = []
+        self.pageBitmap = None  # background + faces of the current page
+
+        self.fonts = {
+            'value': wx.Font(32, wx.ROMAN, wx.NORMAL, wx.NORMAL, faceName="Monaco"),
+            'small': wx.Font(20, wx.ROMAN, wx.NORMAL, wx.NORMAL, faceName="Monaco"),
+            'label': wx.Font(13, wx.ROMAN, wx.NORMAL, wx.BOLD, faceName="Monaco"),
+            'scale': wx.Font(10, wx.ROMAN, wx.NORMAL, wx.NORMAL, faceName="Monaco"),
+        }
+
+        # One timer for the life of the panel
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.refresh, self.timer)
 
 
     def setConnection(self, connection):
         self.connection = connection
-    
+
     def setSensors(self, sensors):
         self.sensors = sensors
-        
-    def setPort(self, port):
-        self.port = port
+
+    def setPoller(self, poller):
+        self.poller = poller
+        self.values = poller.values
+
+    def setRate(self, index, rate):
+        """
+        Set the refresh rate (Hz) of one gauge.
+        """
+        if self.poller:
+            self.poller.set_rate(index, rate)
 
     def getSensorsToDisplay(self, istart):
         """
         Get at most 6 sensors to be display on screen.
         """
         sensors_display = []
-        if istart<len(self.sensors):
-            iend = istart + 6
+        if 0 <= istart < len(self.sensors):
+            iend = istart + GAUGES_PER_PAGE
             sensors_display = self.sensors[istart:iend]
         return sensors_display
 
+    def updatePolling(self):
+        """
+        Poll the sensors on screen and prefetch the page we are heading to.
+        """
+        if not self.poller:
+            return
+        visible = [index for index, sensor in self.getSensorsToDisplay(self.istart)]
+        adjacent = self.getSensorsToDisplay(self.istart + self.direction * GAUGES_PER_PAGE)
+        self.poller.set_pages(visible, [index for index, sensor in adjacent])
+
     def ShowSensors(self):
         """
         Display the sensors.
         """
-        
-        sensors = self.getSensorsToDisplay(self.istart)
-
-        # Destroy previous widgets
-        for b in self.boxes: b.Destroy()
-        for t in self.texts: t.Destroy()
-        self.boxes = []
-        self.texts = []
-
-        # Main sizer
-        boxSizerMain = wx.BoxSizer(wx.VERTICAL)
-
-        # Grid sizer
+        self.gauges = []
+        for index, sensor in self.getSensorsToDisplay(self.istart):
+            gauge = self.allGauges.get(index)
+            if gauge is None:
+                gauge = self.allGauges[index] = Gauge(index, sensor)
+                if self.values is not None and self.values.get(index) is not None:
+                    gauge.setValue(self.values.get(index))
+            self.gauges.append(gauge)
+
+        self.updatePolling()
+        self.layoutGauges()
+        self.pageBitmap = None
+        self.Refresh(False)
+
+        if not self.timer.IsRunning():
+            self.timer.Start(1000 // GAUGE_FPS)
+
+    def layoutGauges(self):
+        """
+        Place the gauges on a 2x3 grid.
+        """
         nrows, ncols = 2, 3
-        vgap, hgap = 50, 50
-        gridSizer = wx.GridSizer(nrows, ncols, vgap, hgap)
-
-        # Create a box for each sensor
-        for index, sensor in sensors:
-            
-            (name, value, unit) = self.port.sensor(index)
-
-            box = OBDStaticBox(self, wx.ID_ANY)
-            self.boxes.append(box)
-            boxSizer = wx.StaticBoxSizer(box, wx.VERTICAL)
-
-            # Text for sensor value 
-            if type(value)==float:  
-                value = str("%.2f"%round(value, 3))                    
-            t1 = wx.StaticText(parent=self, label=str(value), style=wx.ALIGN_CENTER)
-            t1.SetForegroundColour('WHITE')
-            font1 = wx.Font(32, wx.ROMAN, wx.NORMAL, wx.NORMAL, faceName="Monaco")
-            t1.SetFont(font1)
-            boxSizer.Add(t1, 0, wx.ALIGN_CENTER | wx.ALL, 20)
-            boxSizer.AddStretchSpacer()
-            self.texts.append(t1)
-
-            # Text for sensor name
-            t2 = wx.StaticText(parent=self, label=unit+"\n"+name, style=wx.ALIGN_CENTER)
-            t2.SetForegroundColour('WHITE')
-            font2 = wx.Font(13, wx.ROMAN, wx.NORMAL, wx.BOLD, faceName="Monaco")
-            t2.SetFont(font2)
-            boxSizer.Add(t2, 0, wx.ALIGN_CENTER | wx.ALL, 5)
-            self.texts.append(t2)
-            gridSizer.Add(boxSizer, 1, wx.EXPAND | wx.ALL)
-
-        # Add invisible boxes if necessary
-        nsensors = len(sensors)
-        for i in range(6-nsensors):
-            box = OBDStaticBox(self)
-            boxSizer = wx.StaticBoxSizer(box, wx.VERTICAL)
-            self.boxes.append(box)
-            box.Show(False)
-            gridSizer.Add(boxSizer, 1, wx.EXPAND | wx.ALL)
-           
-        # Layout
-        boxSizerMain.Add(gridSizer, 1, wx.EXPAND | wx.ALL, 10)
-        self.SetSizer(boxSizerMain)
-        self.Refresh()
-        self.Layout() 
-
-        # Timer for update
-        self.timer = wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.refresh, self.timer)
-        self.timer.Start(2000)
-
+        vgap, hgap, border = 50, 50, 10
+        width, height = self.GetClientSize()
+        w = (width - 2 * border - (ncols - 1) * hgap) // ncols
+        h = (height - 2 * border - (nrows - 1) * vgap) // nrows
+        for i, gauge in enumerate(self.gauges):
+            row, col = divmod(i, ncols)
+            gauge.rect = wx.Rect(border + col * (w + hgap),
+                                 border + row * (h + vgap), w, h)
+
+    def buildPage(self):
+        """
+        Render the static part of the page (background and gauge faces).
+        """
+        width, height = self.GetClientSize()
+        bitmap = wx.EmptyBitmap(max(width, 1), max(height, 1))
+        dc = wx.MemoryDC(bitmap)
+        dc.DrawBitmap(getBackground(), 0, 0)
+        gc = wx.GraphicsContext.Create(dc)
+        for gauge in self.gauges:
+            gauge.drawFace(gc, self.fonts)
+        del gc
+        dc.SelectObject(wx.NullBitmap)
+        self.pageBitmap = bitmap
 
     def refresh(self, event):
-        sensors = self.getSensorsToDisplay(self.istart)   
-        
-        itext = 0
-        for index, sensor in sensors:
-
-            (name, value, unit) = self.port.sensor(index)
-            if type(value)==float:  
-                value = str("%.2f"%round(value, 3))                    
+        """
+        Frame tick: pick up new values and repaint the gauges that changed.
+        """
+        dirty = set()
+        if self.values is not None:
+            for index, result in self.values.changed():
+                gauge = self.allGauges.get(index)
+                if gauge is not None and gauge.setValue(result):
+                    dirty.add(gauge)
 
-            if itext<len(self.texts):
-                self.texts[itext*2].SetLabel(str(value))
-            
-            itext += 1
+        for gauge in self.gauges:
+            if gauge.step():
+                dirty.add(gauge)
 
+        for gauge in dirty:
+            if gauge in self.gauges:
+                self.RefreshRect(gauge.rect, False)
 
     def onCtrlC(self, event):
         self.GetParent().Close()
@@ -283,25 +509,39 @@ class OBDPanelGauges(wx.Panel):
         """
         Get data from 6 previous sensors in the list.
         """
-        istart = self.istart-6 
+        istart = self.istart-GAUGES_PER_PAGE
         if istart<0: istart = 0
         self.istart = istart
+        self.direction = -1
         self.ShowSensors()
 
     def onRight(self, event):
         """
         Get data from 6 next sensors in the list.
         """
-        istart = self.istart+6
+        istart = self.istart+GAUGES_PER_PAGE
         if istart<len(self.sensors):
             self.istart = istart
+            self.direction = 1
             self.ShowSensors()
 
-    def OnPaint(self, event): 
-        self.Paint(wx.PaintDC(self)) 
+    def OnSize(self, event):
+        self.layoutGauges()
+        self.pageBitmap = None
+        self.Refresh(False)
+        event.Skip()
 
-    def Paint(self, dc): 
-        dc.DrawBitmap(self.bitmap, 0, 0)     
+    def OnPaint(self, event):
+        dc = wx.AutoBufferedPaintDC(self)
+        if self.pageBitmap is None:
+            self.buildPage()
+        dc.DrawBitmap(self.pageBitmap, 0, 0)
+
+        region = self.GetUpdateRegion()
+        gc = wx.GraphicsContext.Create(dc)
+        for gauge in self.gauges:
+            if region.ContainsRect(gauge.rect) != wx.OutRegion:
+                gauge.drawValue(gc, self.fonts)
 
 #-------------------------------------------------------------------------------
 
@@ -319,10 +559,7 @@ class OBDLoadingPanel(wx.Panel):
         super(OBDLoadingPanel, self).__init__(*args, **kwargs)
 
         # Background image
-        image = wx.Image(BACKGROUND_FILENAME) 
-        width, height = wx.GetDisplaySize() 
-        image = image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
-        self.bitmap = wx.BitmapFromImage(image) 
+        self.bitmap = getBackground()
         self.Bind(wx.EVT_PAINT, self.OnPaint)
 
         # Logo
@@ -351,6 +588,8 @@ class OBDLoadingPanel(wx.Panel):
         # Port
         self.port = None
 
+        self.Connect(-1, -1, EVT_CONNECT_ID, self.OnConnectEvent)
+
     def getConnection(self):
         return self.c
 
@@ -376,31 +615,27 @@ class OBDLoadingPanel(wx.Panel):
         if self.timer0:
             self.timer0.Stop()
 
-        # Connection
+        # Connection, progress comes back as ConnectEvents
         self.c = OBDConnection()
         self.textCtrl.Clear()
-        self.textCtrl.AddText(" Trying to connect ..." + time.asctime())
-        self.c.connect()
-        connected = False
-        while not connected:
-            connected = self.c.is_connected()
-
-        if not connected:
-            self.textCtrl.AddText(" Not connected\n")
-            return False
-        else:
-            self.textCtrl.Clear()
-            #self.textCtrl.AddText(" Connected\n")
-            port_name = self.c.get_port_name()
-            if port_name:
-                self.textCtrl.AddText(" Failed Connection: " + port_name +"\n")
-                self.textCtrl.AddText(" Please hold alt & esc to view terminal.")
-            self.textCtrl.AddText(str(self.c.get_output()))
-            self.sensors = self.c.get_sensors()
-            self.port = self.c.get_port()
+        self.textCtrl.AddText(" Trying to connect ..." + time.asctime() + "\n")
+        self.c.connect(self)
 
-            self.GetParent().update(None)
+    def OnConnectEvent(self, event):
+        state, text = event.data
+        if state == CONNECT_PROGRESS:
+            self.textCtrl.AddText(text)
+            return
 
+        self.textCtrl.Clear()
+        port_name = self.c.get_port_name()
+        if port_name:
+            self.textCtrl.AddText(" Connected: " + port_name + "\n")
+        self.textCtrl.AddText(text)
+        self.sensors = self.c.get_sensors()
+        self.port = self.c.get_port()
+
+        self.GetParent().update(None)
 
     def getSensors(self):
         return self.sensors
@@ -481,10 +716,7 @@ class OBDFrame(wx.Frame):
         """
         wx.Frame.__init__(self, None, wx.ID_ANY, "OBD-Pi")
 
-        image = wx.Image(BACKGROUND_FILENAME) 
-        width, height = wx.GetDisplaySize() 
-        image = image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
-        self.bitmap = wx.BitmapFromImage(image) 
+        self.bitmap = getBackground()
         self.Bind(wx.EVT_PAINT, self.OnPaint)
 
         self.panelLoading = OBDLoadingPanel(self)
@@ -509,7 +741,10 @@ class OBDFrame(wx.Frame):
 
         if sensors:
             self.panelGauges.setSensors(sensors)
-            self.panelGauges.setPort(port)
+        if port:
+            self.poller = SensorPoller(port, ValueStore(), GAUGE_RATES)
+            self.panelGauges.setPoller(self.poller)
+            self.poller.start()
         self.sizer = wx.BoxSizer(wx.VERTICAL)
         self.sizer.Add(self.panelGauges, 1, wx.EXPAND)
         self.SetSizer(self.sizer)
@@ -536,10 +771,7 @@ class OBDFrame0(wx.Frame):
         """
         wx.Frame.__init__(self, None, wx.ID_ANY, "")
 
-        image = wx.Image(BACKGROUND_FILENAME) 
-        width, height = wx.GetDisplaySize() 
-        image = image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
-        self.bitmap = wx.BitmapFromImage(image) 
+        self.bitmap = getBackground()
         self.Bind(wx.EVT_PAINT, self.OnPaint)
 
     def OnPaint(self, event): 
@@ -28,13 +28,23 @@ import time
 from datetime import datetime
 from math import ceil
 
-import bluetooth as bt
 import serial
 
 import obd_sensors
-from debugEvent import DebugEvent, debug_display
+from obd_replay import DeadlineScheduler
+import obd_freeze
+import obd_isotp
+import obd_mode06
+import obd_mode09
+import obd_uds
+import obd_response
+from obd_response import parse_response, is_bus_error
+from obd_timing import TimeoutTuner, TIMING_FILE, DEFAULT_ST, request_key
+from obd_cache import VehicleCache, CACHE_FILE
+from debugEvent import DebugEvent, debug_display, trace_enabled
+from obd_trace import AdapterText
 from obd_sensors import hex_to_int
-from obd_transport import CreateTransport, TransportType
+from obd_transport import CreateTransport, TransportType, is_socketcan_interface, is_simulator
 
 HAS_PYBLUEZ = True
 try:
@@ -50,6 +60,14 @@ GET_DTC_COMMAND = b"\x03"  # Mode 03 (no PID)
 CLEAR_DTC_COMMAND = b"\x04"  # Mode 04 (no PID)
 GET_PENDING_DTC_COMMAND = b"\x07"  # Mode 07 (no PID)
 
+MAX_INJECT_PAYLOAD = 8  # raw frame data with CAN auto formatting off
+BITS_PER_BYTE = 10  # start + 8 data + stop bits on the adapter's serial link
+CAN_PROTOCOLS = ('6', '7', '8', '9')  # ATDPN numbers of the ISO 15765-4 protocols
+CAN_29BIT_PROTOCOLS = ('7', '9')
+IGNITION_CHECK_INTERVAL = 30  # s between checks for a new ignition cycle
+TESTER_PRESENT_INTERVAL = 2.0  # s, keeps the diagnostic session open while streaming
+PERIODIC_TIMEOUT = 3.0  # s without periodic messages before an ECU is dropped
+
 
 #__________________________________________________________________________
 
@@ -121,12 +139,152 @@ def is_hex_string(s):
 
 #__________________________________________________________________________
 
+def parse_monitor_line(line):
+    """Parses a monitor mode line ("7E8 03 41 0D 00 ...") into (id, data)
+
+    Returns None for lines which are not frames."""
+    fields = line.strip().lstrip('>').split()
+    if len(fields) < 1:
+        return None
+
+    try:
+        if len(fields[0]) == 3:
+            return (int(fields[0], 16), bytes.fromhex(''.join(fields[1:])))
+        if len(fields) >= 4 and len(fields[0]) == 2:
+            # 29 bit header printed as four bytes
+            return (int(''.join(fields[0:4]), 16), bytes.fromhex(''.join(fields[4:])))
+    except ValueError:
+        pass
+
+    return None
+
+def functional_header(protocol):
+    """Returns the functional (broadcast) request id of a protocol (ATDPN
+    number): 18DB33F1 on 29 bit CAN, 7DF otherwise"""
+    if protocol in CAN_29BIT_PROTOCOLS:
+        return 0x18DB33F1
+    return 0x7DF
+
+def physical_header(ecu):
+    """Returns the request id that addresses one ECU physically, given the
+    id it answers with (7E8 -> 7E0, 18DAF110 -> 18DA10F1), or None"""
+    if 0x7E8 <= ecu <= 0x7EF:
+        return ecu - 8
+    if (ecu & 0xFFFFFF00) == 0x18DAF100:
+        return 0x18DA00F1 | ((ecu & 0xFF) << 8)
+    return None
+
+def response_id(header):
+    """Returns the id an ECU addressed with a physical header answers
+    with (7E0 -> 7E8, 18DA10F1 -> 18DAF110), or None"""
+    if 0x7E0 <= header <= 0x7E7:
+        return header + 8
+    if (header & 0xFFFF00FF) == 0x18DA00F1:
+        return 0x18DAF100 | ((header >> 8) & 0xFF)
+    return None
+
+def id_filter(ids):
+    """ATCRA filter matching all the given CAN ids, X for the digits in
+    which they differ ([7E8, 7E9] -> "7EX")"""
+    texts = [id > 0x7FF and "%.8X" % id or "%.3X" % id for id in ids]
+    return "".join(len(set(c)) == 1 and c[0] or "X" for c in zip(*texts))
+
+#__________________________________________________________________________
+
+
+class InjectionStats:
+    """ Adapter send latency and achieved rate of an injection run """
+
+    def __init__(self):
+        self.count = 0
+        self.header_switches = 0
+        self.skipped = 0  # frames the adapter can't send, e.g. remote frames
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.lateness = None  # obd_replay.JitterStats of the send deadlines
+        self._start = time.perf_counter()
+        self._end = self._start
+
+    def add(self, latency):
+        self.count += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self._end = time.perf_counter()
+
+    def mean_latency(self):
+        return self.count and self.total_latency / self.count or 0.0
+
+    def rate(self):
+        """Achieved frames per second"""
+        elapsed = self._end - self._start
+        return elapsed > 0 and self.count / elapsed or 0.0
+
+    def summary(self):
+        return ("%d frames, %d skipped, %d header switches, %.1f frames/s, "
+                "latency mean %.2f ms, max %.2f ms" %
+                (self.count, self.skipped, self.header_switches, self.rate(),
+                 self.mean_latency() * 1000, self.max_latency * 1000))
+
+class CommandStats:
+    """ Bytes and time spent per request: on the wire (at the adapter's
+    baud rate) and in total (round trip) """
+
+    def __init__(self, baud):
+        self.baud = baud
+        self.count = 0
+        self.sent = 0
+        self.received = 0
+        self.total_time = 0.0
+        self.requests = {}  # request (e.g. "010C") -> [count, total time]
+
+    def add(self, sent, received, elapsed, request=None):
+        self.count += 1
+        self.sent += sent
+        self.received += received
+        self.total_time += elapsed
+        if request is not None:
+            entry = self.requests.get(request)
+            if entry is None:
+                self.requests[request] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def latency(self, request):
+        """Mean round trip of one request in seconds, None if never sent"""
+        entry = self.requests.get(request)
+        return entry and entry[1] / entry[0] or None
+
+    def wire_time(self):
+        """Seconds spent transmitting requests and responses"""
+        return (self.sent + self.received) * BITS_PER_BYTE / float(self.baud)
+
+    def summary(self):
+        n = self.count or 1
+        return ("%d requests, %.1f bytes/response, transmission %.2f ms/request, "
+                "round trip %.2f ms/request" %
+                (self.count, self.received / float(n), self.wire_time() * 1000 / n,
+                 self.total_time * 1000 / n))
+
+    def request_summary(self):
+        return ["%-8s %5d x %8.2f ms" % (request, count, total * 1000 / count)
+                for request, (count, total) in sorted(self.requests.items())]
+
+#__________________________________________________________________________
+
 
 class OBDPort:
     """ OBDPort abstracts all communication with OBD-II device."""
 
-    def __init__(self, portnum, _notify_window, SERTIMEOUT, RECONNATTEMPTS):
-        """Initializes port by resetting device and gettings supported PIDs. """
+    def __init__(self, portnum, _notify_window, SERTIMEOUT, RECONNATTEMPTS, compact=False,
+                 tune_timeouts=False, cache_path=CACHE_FILE):
+        """Initializes port by resetting device and gettings supported PIDs.
+
+        With compact set, responses are sent without spaces and linefeeds
+        (see enable_compact); with tune_timeouts, the response timeout is
+        tuned per request (see tune_timeouts). Supported PIDs, ECUs and
+        protocol of known vehicles are taken from cache_path (None to
+        always find them out, see restore_vehicle)."""
         # These should really be set by the user.
         baud = 38400
         databits = 8
@@ -140,8 +298,41 @@ class OBDPort:
         self.State = 0
         self.Error = None
         self._echo_enabled = True  # enabled by default
+        self._headers_enabled = False
+        self._compact = False  # spaces and linefeeds off
         self._monitor_mode = False  # flagged if we're in monitor mode
-        self._recv_buf = ''
+        self._inject_mode = False  # flagged while sending raw frames
+        self._header = None  # current ATSH header, None is the adapter default
+        self._priority = None  # current ATCP priority byte (29 bit headers)
+        self._timeout = None  # current ATST, None is adaptive timing (ATAT1)
+        self._tuner = None  # obd_timing.TimeoutTuner
+        self._last_data = None  # when the last reply before the prompt arrived
+        self._responders = {}  # Mode 01 PID -> ids of the ECUs answering it
+        self._routing = True  # use _responders for addressing and count hints
+        self._hints = True  # adapter takes response count hints ("010C1")
+        self._can = False  # ISO 15765-4 (CAN) protocol, set by discover_ecus
+        self.protocol = None  # ATDPN number, e.g. "6"
+        self.vehicle = None  # VIN, or protocol and PID 00 bitmap without one
+        self._vin = None  # "" when the car doesn't report one
+        self._supported = None  # supported Mode 01 PIDs
+        self._did_batch = {}  # header -> DIDs per request, once an ECU refused batches
+        self._did_unsupported = set()  # ids of Mode 22 sensors the ECU rejected
+        self._dynamic = False  # pack polled sensors into dynamic DIDs (UDS 0x2C)
+        self._dynamic_dids = {}  # header -> obd_uds.DynamicDID of the poll set
+        self._dynamic_set = None  # sensor ids the dynamic DIDs were defined for
+        self._dynamic_refused = set()  # headers of ECUs that refused 0x2C
+        self._periodic = {}  # response id -> {DID low byte: obd_uds.DynamicDID} sent by 0x2A
+        self._periodic_seen = {}  # response id -> time of its last periodic message
+        self._periodic_refused = set()  # headers of ECUs without periodic data
+        self._tester_present = 0.0  # when the streaming ECUs were last sent 0x3E
+        self._cache = cache_path is not None and VehicleCache(cache_path) or None
+        self._freeze_frames = None  # [FreezeFrame] read for _freeze_dtcs
+        self._freeze_dtcs = None
+        self._monitor_tests = None  # [TestResult] of this ignition cycle
+        self._run_time = None  # engine run time (PID 1F) when last checked
+        self._run_time_checked = 0
+        self._recv_buf = b''
+        self.stats = CommandStats(baud)
 
         self._notify_window = _notify_window
 
@@ -149,13 +340,22 @@ class OBDPort:
             debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
                           "Opening interface (bluetooth RFCOMM)")
             self._transport = CreateTransport(TransportType.BLUETOOTH)
+        elif is_socketcan_interface(portnum):
+            debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                          "Opening interface (SocketCAN)")
+            self._transport = CreateTransport(TransportType.SOCKETCAN)
+        elif is_simulator(portnum):
+            debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                          "Opening interface (simulator)")
+            self._transport = CreateTransport(TransportType.SIMULATOR)
         else:
             debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
                           "Opening interface (serial port)")
             self._transport = CreateTransport(TransportType.SERIAL)
 
         for i in range(0, RECONNATTEMPTS):
-            if self._transport.Connect(portnum):
+            if self._transport.Connect(portnum, baud=baud, bytesize=databits,
+                                       parity=par, stopbits=sb, timeout=to):
                 break
         
         if not self._transport.IsConnected():
@@ -173,7 +373,7 @@ class OBDPort:
             self.send_command("ATZ")  # initialize
         except IOError as e:
             debug_display(self._notify_window, 2,
-                          "failed to send atz (%s)" % e)
+                          "failed to send atz (%s)", e)
             return None
 
         # Disable command echo - we don't need it.
@@ -183,13 +383,16 @@ class OBDPort:
         self.ELMver = self.send_command("ATI")
         if self.ELMver[0:6] != 'ELM327':
             debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
-                          "Invalid ELM327 version \"%s\" returned" % self.ELMver)
+                          "Invalid ELM327 version \"%s\" returned", self.ELMver)
             self.Error = "Invalid ELM327 version \"%s\" returned" % self.ELMver
             return None
 
         initial_protocol = 0  # Automatic search
+        if self._cache is not None and self._cache.last_protocol():
+            # Probably the same car as last time: skip the search
+            initial_protocol = int(self._cache.last_protocol(), 16)
         debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
-                      "ELM Version: " + self.ELMver)
+                      "ELM Version: %s", self.ELMver)
         res = self.send_command("ATSP%.1X" % initial_protocol)
         if res != 'OK':
             debug_display(self._notify_window, DebugEvent.DISPLAY_ERROR,
@@ -202,7 +405,7 @@ class OBDPort:
         proto = initial_protocol
         if 'UNABLE TO CONNECT' in res or 'ERROR' in res or 'NO DATA' in res:
             debug_display(self._notify_window, DebugEvent.DISPLAY_ERROR,
-                          "Protocol %d: error %s" % (initial_protocol, res))
+                          "Protocol %d: error %s", initial_protocol, res)
 
             # Loop through all possible protocols
             for i in range(0x1, 0xB):
@@ -214,7 +417,7 @@ class OBDPort:
                 res = self.send_command("0100")
                 if 'UNABLE TO CONNECT' in res or 'NO DATA' in res or 'ERROR' in res:
                     debug_display(
-                        self._notify_window, DebugEvent.DISPLAY_ERROR, "Protocol %d: error %s" % (i, res))
+                        self._notify_window, DebugEvent.DISPLAY_ERROR, "Protocol %d: error %s", i, res)
                     ready = False
                     continue
                 else:
@@ -227,7 +430,7 @@ class OBDPort:
                 res = self.send_command("ATSP%.1X" % proto)
                 if res != 'OK':
                     debug_display(self._notify_window, DebugEvent.DISPLAY_ERROR,
-                                  "Failed to select protocol %.1X" % proto)
+                                  "Failed to select protocol %.1X", proto)
                     self.State = 0
                     return None
 
@@ -240,15 +443,34 @@ class OBDPort:
         # Now connected
         self.State = 1
 
+        if compact:
+            self.enable_compact(True)
+        self.protocol = self.send_command("ATDPN").lstrip('A')
+        self._can = self.protocol in CAN_PROTOCOLS
+        if not self.restore_vehicle():
+            self.discover_ecus()
+            self.supported_pids()
+            self.store_vehicle()
+        if tune_timeouts:
+            self.tune_timeouts()
+
         debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
-                      "Connected to ECU on protocol 0x%.1X" % proto)
+                      "Connected to ECU on protocol 0x%.1X", proto)
         debug_display(self._notify_window,
-                      DebugEvent.DISPLAY_DEBUG, "0100 response: " + res)
+                      DebugEvent.DISPLAY_DEBUG, "0100 response: %s", res)
         return None
 
     def close(self, reset=True):
         """ Resets device and closes all associated filehandles"""
 
+        if self._tuner is not None:
+            self._tuner.save()
+
+        if self._periodic and self.State == 1:
+            self.stop_periodic()
+        if self._dynamic_dids and self.State == 1:
+            self.clear_dynamic()
+
         # Reset device
         if reset and self.State == 1:
             self.send_command("ATZ")
@@ -264,30 +486,63 @@ class OBDPort:
         self.send_raw(cmd + "\r\n")
         if wait_response:
             res = self.recv_result()
-            debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
-                          "cmd: \"%s\" -> \"%s\"" % (cmd, res.replace('\r', '\\r')))
+            if trace_enabled(DebugEvent.DISPLAY_DEBUG):
+                debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                              "cmd: \"%s\" -> \"%s\"", cmd, AdapterText(res))
             if res == "CAN ERROR":
                 raise IOError("Disconnected from CAN bus")
 
             return res
 
         debug_display(self._notify_window,
-                      DebugEvent.DISPLAY_DEBUG, "cmd: \"%s\"" % cmd)
+                      DebugEvent.DISPLAY_DEBUG, "cmd: \"%s\"", cmd)
         return None
     
     def send_command_binary(self, cmd, wait_response=True):
         if type(cmd) != bytearray and type(cmd) != bytes:
             raise TypeError('cmd must be convertable to bytearray')
 
-        res = self.send_command(' '.join('%02X' % i for i in bytearray(cmd)), wait_response)
-        if wait_response:
-            # Convert the response to binary.
-            if not is_hex_string(res):
-                raise IOError("CAN bus nonbinary response: '%s'" % res)
-            
-            return bytearray.fromhex(res)
-        
-        return None
+        command = ''.join('%02X' % i for i in bytearray(cmd))
+        if not wait_response:
+            return self.send_command(command, False)
+
+        res = self.query(command)
+        if not res.ok():
+            raise IOError("CAN bus nonbinary response: '%s'" % res.describe())
+
+        return bytearray(res.payloads[0][1])
+
+    def query(self, cmd, retry=True):
+        """Sends a request and returns the parsed response (obd_response.Response)
+
+        The receive buffer is parsed as bytes in one pass; nothing is
+        converted to str except the debug output."""
+        tuner = self._tuner
+        if tuner is not None:
+            key = request_key(self._header, cmd)
+            self.set_timeout(tuner.timeout(key))
+
+        start = time.perf_counter()
+        self.send_raw(cmd + "\r")
+        buf = self.recv_response()
+        # odd length: strip the response count hint
+        self.stats.add(len(cmd) + 1, len(buf), time.perf_counter() - start, cmd[:len(cmd) & ~1])
+        res = parse_response(buf, self._headers_enabled)
+        if trace_enabled(DebugEvent.DISPLAY_DEBUG):
+            debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                          "cmd: \"%s\" -> \"%s\"", cmd, AdapterText(buf))
+        if is_bus_error(res):
+            raise IOError("Disconnected from CAN bus")
+
+        if tuner is not None:
+            if res.status == obd_response.OK:
+                if self._last_data is not None:
+                    tuner.record(key, self._last_data - start)
+            elif res.status == obd_response.NO_DATA and retry and tuner.missed(key):
+                # It answered before: the timeout was probably too short
+                return self.query(cmd, False)
+
+        return res
 
     def send_raw(self, data):
         """Internal use only: not a public interface"""
@@ -302,13 +557,17 @@ class OBDPort:
 
         return self._transport.Recv(len)
 
-    def recv_data(self):
-        """Receives at least line of data
+    def recv_data(self, timeout=None):
+        """Receives at least line of data, or none if timeout (seconds)
+        passes first
 
         raises an IOError if connection is lost"""
         lines = []
+        deadline = timeout is not None and time.time() + timeout or None
         # Continously receive until we accumulate a line
         while b'\r' not in self._recv_buf:
+            if deadline is not None and time.time() >= deadline:
+                return lines
             self._recv_buf += self.recv_raw(1024)
 
         while b'\r' in self._recv_buf:
@@ -321,10 +580,56 @@ class OBDPort:
             if len(self._recv_buf) > end:
                 self._recv_buf = self._recv_buf[end + 1:]
             else:
-                self._recv_buf = ''
+                self._recv_buf = b''
 
         return lines
 
+    def recv_frames(self, timeout=None):
+        """Receives CAN frames in monitor mode as a list of (timestamp, id, data)
+
+        Transports with raw CAN access skip the ELM text entirely."""
+        if self._transport.HasRawFrames():
+            return self._transport.RecvFrames(timeout)
+
+        frames = []
+        lines = self.recv_data(timeout)
+        now = time.time()
+        for line in lines:
+            if line == 'BUFFER FULL':
+                # If you poke it, it'll keep dumping data
+                self.send_raw('\r')
+                continue
+
+            frame = parse_monitor_line(line)
+            if frame is not None:
+                frames.append((now, frame[0], frame[1]))
+
+        return frames
+
+    def recv_response(self):
+        """Internal use only: not a public interface
+
+        Receives the raw bytes of a response, up to the prompt"""
+        buffer = bytearray()
+        self._last_data = None
+        while True:
+            data = self._transport.Recv(4096)
+            if len(data) == 0:
+                print("Socket closed.")
+                return buffer
+
+            buffer += data
+
+            # Chevron marks end of response
+            if b'>' in data:
+                if data.strip(b'\r\n> '):
+                    # replies came with the prompt: their time is unknown
+                    self._last_data = None
+                return buffer
+
+            # The prompt follows after the adapter's idle wait
+            self._last_data = time.perf_counter()
+
     def recv_result(self, strip_newlines=True):
         """Internal use only: not a public interface
         
@@ -345,9 +650,15 @@ class OBDPort:
                 break
 
         data = buffer.decode()
+        if '\n' in data:
+            # linefeeds on (ATL1)
+            data = data.replace('\n', '')
 
         # Strip off the ending
         end = data.find('\r\r>')
+        if end < 0:
+            # e.g. with responses off (ATR0) there is no blank line
+            end = data.find('>')
         data = data[0:end]
         if strip_newlines:
             data = data.replace('\r', '')
@@ -361,6 +672,20 @@ class OBDPort:
         if 'OK' in result:
             self._headers_enabled = enable
 
+    def enable_compact(self, enable):
+        """Turns spaces between bytes (ATS0) and linefeeds (ATL0) in responses
+        off, or back on. Cuts a third or more of the bytes of a typical
+        response; query() parses both formats."""
+        on = not enable and 1 or 0
+        if self.send_command("ATS%d" % on) != 'OK':
+            return False
+        self.send_command("ATL%d" % on)
+        self._compact = enable
+        return True
+
+    def is_compact(self):
+        return self._compact
+
     def enable_echo(self, enable):
         """Internal use only: not a public interface"""
         result = self.send_command("ATE%d" % (
@@ -376,6 +701,8 @@ class OBDPort:
 
         When in monitor mode, attempting to use any other functionality is undefined."""
         if enable and not self._monitor_mode:
+            if self._compact:
+                self.send_command("ATS1")  # parse_monitor_line splits on spaces
             self.enable_headers(True)  # Enable headers
             self.send_command("ATAL")  # Allow long messages
             self.send_command("ATCAF0")  # Disable CAN Automatic Formatting
@@ -387,6 +714,8 @@ class OBDPort:
                 pass
             self.send_command("ATCAF1")  # Enable CAN Automatic Formatting
             self.enable_headers(False)  # Disable headers
+            if self._compact:
+                self.send_command("ATS0")
             self._monitor_mode = False
 
     def monitor_set_filter(self, id):
@@ -407,6 +736,319 @@ class OBDPort:
         if monitor_enabled:
             self.enable_monitor(True)
 
+    def set_header(self, header):
+        """Sets the CAN header (id) used for following requests.
+
+        The current header is cached, so setting the same header twice does
+        not cost a round trip. Pass None to go back to the functional
+        header of the protocol (see functional_header)."""
+        if header == self._header:
+            return False
+
+        id = header is None and functional_header(self.protocol) or header
+        if id <= 0x7FF:
+            res = self.send_command("ATSH%.3X" % id)
+        else:
+            priority = (id >> 24) & 0x1F
+            if priority != self._priority:
+                if self.send_command("ATCP%.2X" % priority) != 'OK':
+                    raise IOError("Failed to set CAN priority %.2X" % priority)
+                self._priority = priority
+            res = self.send_command("ATSH%.6X" % (id & 0xFFFFFF))
+
+        if res != 'OK':
+            raise IOError("Failed to set header %s: %s" % (header, res))
+
+        self._header = header
+        return True
+
+    def discover_ecus(self):
+        """Finds out which ECUs answer each Mode 01 PID, from the supported
+        PID bitmaps every ECU returns with headers on (CAN only).
+
+        Mode 01 requests then go to the ECU physically when only one answers,
+        and carry a response count hint, so the adapter returns as soon as
+        the last expected answer arrives. Returns {pid: (ecu ids)}."""
+        self._responders = {}
+        # set_header(None) below picks the functional id of this protocol
+        self.protocol = self.send_command("ATDPN").lstrip('A')
+        self._can = self.protocol in CAN_PROTOCOLS
+        if not self._can:
+            return self._responders
+
+        headers = self._headers_enabled
+        self.set_header(None)
+        self.enable_headers(True)
+        responders = {}
+        try:
+            ecus = None  # ECUs that support the next range
+            for base in range(0x00, 0xE0, 0x20):
+                next_ecus = set()
+                for ecu, payload in self.query("01%.2X" % base).payloads:
+                    if len(payload) < 6 or payload[0] != 0x41 or payload[1] != base:
+                        continue
+                    if ecus is not None and ecu not in ecus:
+                        continue
+                    responders.setdefault(base, set()).add(ecu)
+                    bits = int.from_bytes(payload[2:6], 'big')
+                    for i in range(32):
+                        if bits & (0x80000000 >> i):
+                            responders.setdefault(base + i + 1, set()).add(ecu)
+                    if bits & 1:
+                        next_ecus.add(ecu)
+                if not next_ecus:
+                    break
+                ecus = next_ecus
+        finally:
+            self.enable_headers(headers)
+
+        self._responders = dict((pid, tuple(sorted(ids))) for pid, ids in responders.items())
+        if trace_enabled(DebugEvent.DISPLAY_DEBUG):
+            debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG, "ECUs: %s",
+                          ", ".join("%X" % ecu for ecu in
+                                    sorted(set(sum(self._responders.values(), ())))))
+        return self._responders
+
+    def supported_pids(self):
+        """Returns the Mode 01 PIDs the car supports (any ECU), from the
+        PID 00, 20, .. bitmaps. Read once, or taken from the vehicle cache."""
+        if self._supported is not None:
+            return self._supported
+
+        if self._responders:
+            # discover_ecus has read the bitmaps already
+            pids = sorted(pid for pid in self._responders if pid)
+        else:
+            pids = []
+            self.set_header(None)
+            for base in range(0x00, 0xE0, 0x20):
+                payload = self.query("01%.2X" % base).find(0x41, base)
+                if payload is None or len(payload) < 6:
+                    break
+                pids.extend(obd_freeze.supported(payload[2:6], base))
+                if base + 0x20 not in pids:
+                    break
+        self._supported = pids
+        return pids
+
+    def identify(self):
+        """Returns the key the vehicle is known by: its VIN, or for cars
+        without Mode 09 the protocol and the PID 00 answer"""
+        vin = self.get_vin()
+        if vin:
+            self.vehicle = vin
+        else:
+            payload = self.query("0100").find(0x41, 0x00)
+            self.vehicle = "%s:%s" % (self.protocol,
+                                      payload and payload[2:].hex().upper() or "-")
+        return self.vehicle
+
+    def restore_vehicle(self):
+        """Takes responding ECUs and supported PIDs from the vehicle cache,
+        if the car is known and still talks the same protocol. Returns
+        False if they have to be found out (discover_ecus)."""
+        self.identify()
+        if self._cache is None:
+            return False
+        known = self._cache.get(self.vehicle)
+        if known is None or known[0] != self.protocol:
+            return False
+
+        self._responders = known[1]
+        self._supported = known[2]
+        self._cache.save()  # now the last vehicle
+        debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                      "Known vehicle %s", self.vehicle)
+        return True
+
+    def store_vehicle(self):
+        """Stores what was found out about the car in the vehicle cache"""
+        if self._cache is None or self.vehicle is None:
+            return False
+        self._cache.put(self.vehicle, self.protocol, self._responders, self.supported_pids())
+        return self._cache.save()
+
+    #______________________________________________________________________
+    # Vehicle information (Mode 09)
+
+    def vehicle_info(self, pid):
+        """Reads a Mode 09 item from all ECUs. Returns {ecu: data bytes},
+        ecu is None on non-CAN protocols."""
+        headers = self._headers_enabled
+        previous_header = self._header
+        self.set_header(None)
+        if self._can:
+            self.enable_headers(True)
+        try:
+            res = self.query("%.2X%.2X" % (obd_mode09.MODE, pid))
+        finally:
+            self.enable_headers(headers)
+            self.set_header(previous_header)
+
+        info = {}
+        for ecu, payloads in res.by_ecu().items():
+            data = obd_mode09.join(payloads, pid)
+            if data is not None:
+                info[ecu] = data
+        return info
+
+    def get_vin(self):
+        """Returns the VIN, or None if the car doesn't report one. Read
+        once per connection."""
+        if self._vin is None:
+            self._vin = ""
+            for ecu, data in self.vehicle_info(obd_mode09.VIN).items():
+                self._vin = obd_mode09.vin(data)
+                if self._vin:
+                    break
+        return self._vin or None
+
+    def get_calibration_ids(self):
+        """Returns {ecu: [calibration id]}"""
+        return dict((ecu, obd_mode09.calibration_ids(data))
+                    for ecu, data in self.vehicle_info(obd_mode09.CALID).items())
+
+    def get_cvns(self):
+        """Returns {ecu: [calibration verification number (hex)]}"""
+        return dict((ecu, obd_mode09.cvns(data))
+                    for ecu, data in self.vehicle_info(obd_mode09.CVN).items())
+
+    def get_ecu_names(self):
+        """Returns {ecu: name}"""
+        return dict((ecu, obd_mode09.ecu_name(data))
+                    for ecu, data in self.vehicle_info(obd_mode09.ECU_NAME).items())
+
+    def enable_routing(self, enable):
+        """Turns the addressing/count hints learned by discover_ecus on or off"""
+        self._routing = enable
+        if not enable and self._responders:
+            self.set_header(None)
+
+    def route_mode01(self, pid):
+        """Returns the request for a Mode 01 PID, and sets the header for it,
+        according to the ECUs found by discover_ecus: physical when one ECU
+        answers, else the functional header of the protocol (7DF, or
+        18DB33F1 on 29 bit CAN)"""
+        cmd = "01%.2X" % pid
+        if not self._routing or not self._responders:
+            self.set_header(None)  # e.g. after Mode 22 requests
+            return cmd
+
+        ecus = self._responders.get(pid)
+        if not ecus:
+            self.set_header(None)
+            return cmd
+
+        self.set_header(len(ecus) == 1 and physical_header(ecus[0]) or None)
+        # While ECUs stream periodic data, one of their messages could be
+        # taken for the answer
+        if self._hints and not self._periodic and len(ecus) <= 0xF:
+            cmd += "%X" % len(ecus)
+        return cmd
+
+    def set_timeout(self, timeout):
+        """Sets the response timeout (ATST, 4 ms units) with adaptive timing
+        off, or with None goes back to adaptive timing (ATAT1) and the
+        default timeout. Cached like set_header."""
+        if timeout == self._timeout:
+            return False
+
+        if timeout is None:
+            self.send_command("ATAT1")
+            self.send_command("ATST%.2X" % DEFAULT_ST)
+        else:
+            if self._timeout is None:
+                self.send_command("ATAT0")
+            if self.send_command("ATST%.2X" % timeout) != 'OK':
+                raise IOError("Failed to set timeout %.2X" % timeout)
+
+        self._timeout = timeout
+        return True
+
+    def tune_timeouts(self, path=TIMING_FILE):
+        """Learns the response time of each request and sets ATST to match
+        (see obd_timing). Values are kept in path per vehicle (see
+        identify). Returns the tuner."""
+        self._tuner = None
+        if self.vehicle is None:
+            self.identify()
+
+        self._tuner = TimeoutTuner(self.vehicle, path)
+        self._tuner.load()
+        return self._tuner
+
+    def enable_inject(self, enable):
+        """Puts the ELM327 into raw send mode (or takes it out).
+
+        While enabled, payloads are sent as the complete frame data (no ISO-TP
+        PCI byte) and the adapter does not wait for responses."""
+        if enable and not self._inject_mode:
+            if self._monitor_mode:
+                self.enable_monitor(False)
+            self.send_command("ATCAF0")  # Disable CAN Automatic Formatting
+            self.send_command("ATR0")  # Responses off: prompt right after sending
+            self._inject_mode = True
+        elif not enable and self._inject_mode:
+            self.send_command("ATR1")
+            self.send_command("ATCAF1")
+            self._inject_mode = False
+
+    def send_frame(self, header, data):
+        """Sends one raw CAN frame. Returns the round trip time in seconds."""
+        if len(data) == 0 or len(data) > MAX_INJECT_PAYLOAD:
+            raise ValueError("CAN payload must be 1-%d bytes" % MAX_INJECT_PAYLOAD)
+
+        if not self._inject_mode:
+            self.enable_inject(True)
+
+        self.set_header(header)
+        start = time.perf_counter()
+        self.send_command(''.join('%02X' % b for b in bytearray(data)))
+        return time.perf_counter() - start
+
+    def inject(self, frames, speed=1.0):
+        """Plays back a sequence of (timestamp, id, data) frames, e.g. from
+        obd_canlog.read_capture. Returns InjectionStats.
+
+        Sends are paced against absolute deadlines (speed 1.0 is the captured
+        timing, 0 as fast as the adapter allows). Frames go out in capture
+        order; ATSH is only sent when the header changes, so a run of
+        consecutive frames with one id costs a single header switch.
+        Frames without data or longer than MAX_INJECT_PAYLOAD (e.g. remote
+        frames in a candump capture) are skipped and counted."""
+        frames = list(frames)
+
+        stats = InjectionStats()
+        scheduler = DeadlineScheduler()
+        scale = speed and 1.0 / speed or 0.0
+        previous_header = self._header
+        self.enable_inject(True)
+        try:
+            t0 = frames and frames[0][0] or 0
+            start = time.perf_counter()
+            for t, id, data in frames:
+                if len(data) == 0 or len(data) > MAX_INJECT_PAYLOAD:
+                    stats.skipped += 1
+                    debug_display(self._notify_window, DebugEvent.DISPLAY_WARNING,
+                                  "Skipped frame %X with %d bytes", id, len(data))
+                    continue
+                deadline = start + (t - t0) * scale
+                if scale:
+                    now = scheduler.wait_until(deadline)
+                else:
+                    now = deadline = time.perf_counter()
+                scheduler.record(deadline, now)
+
+                if self.set_header(id):
+                    stats.header_switches += 1
+                stats.add(self.send_frame(id, data))
+        finally:
+            self.enable_inject(False)
+            self.set_header(previous_header)
+
+        stats.lateness = scheduler.stats
+        return stats
+
     def interpret_result(self, code, data_len, arrayed=False):
         """Internal use only: not a public interface"""
         # Code will be the string returned from the device.
@@ -453,18 +1095,26 @@ class OBDPort:
     # get sensor value from command
     def get_sensor_value(self, sensor):
         """Internal use only: not a public interface"""
-        command = "01%.2X" % (sensor.id & 0xFF)
-        data = self.send_command(command)
-        if not is_hex_string(data):
-            return data
-
-        if data:
-            data = self.interpret_result(data, sensor.length)
-            data = sensor.value(data)
-        else:
+        if isinstance(sensor, obd_uds.EnhancedSensor):
+            return self.read_dids([sensor])[sensor.id]
+
+        pid = sensor.id & 0xFF
+        res = self.query(self.route_mode01(pid))
+        if not res.ok() and self._routing and pid in self._responders:
+            if res.error == '?':
+                self._hints = False  # adapter without response count hints
+            else:
+                del self._responders[pid]  # ask everyone from now on
+            res = self.query(self.route_mode01(pid))
+
+        if not res.ok():
+            return res.describe()
+
+        payload = res.find(0x41, pid)
+        if payload is None:
             return "NORESPONSE"
 
-        return data
+        return sensor.value(memoryview(payload)[2:2 + sensor.length])
 
     # return string of sensor name and value from sensor index
     def sensor(self, sensor_index):
@@ -477,6 +1127,375 @@ class OBDPort:
         r = self.get_sensor_value(sensor)
         return (sensor.name, r, sensor.unit)
 
+    def sensors(self, sensor_indexes):
+        """Like sensor() for several sensors. The Mode 22 ones among them
+        are read together, see read_dids; with enable_dynamic, all of them
+        are read in one request per ECU where the ECU allows."""
+        found = [obd_sensors.get_sensor(i) for i in sensor_indexes]
+        values = {}
+        if self._dynamic:
+            values = self.read_dynamic([s for s in found if s is not None])
+        enhanced = [s for s in found
+                    if isinstance(s, obd_uds.EnhancedSensor) and s.id not in values]
+        if enhanced:
+            values.update(self.read_dids(enhanced))
+
+        results = []
+        for sensor in found:
+            if sensor is None:
+                results.append(None)
+            elif sensor.id in values:
+                results.append((sensor.name, values[sensor.id], sensor.unit))
+            else:
+                results.append((sensor.name, self.get_sensor_value(sensor), sensor.unit))
+        return results
+
+    def enhanced_sensors(self):
+        """Mode 22 sensors defined for this car (by the VIN's make)"""
+        vin = self.get_vin()
+        return [s for s in obd_sensors.ENHANCED if s.applies_to(vin)]
+
+    def read_dids(self, sensors):
+        """Reads Mode 22 sensors (obd_uds.EnhancedSensor). Sensors of one
+        ECU are read in a row, so the header changes once per ECU, with as
+        many DIDs per request as the definition allows. Returns {sensor id:
+        value}, or the failure text like get_sensor_value."""
+        values = {}
+        for header, group in obd_uds.by_header(sensors):
+            self.set_header(header)
+            todo = []
+            for sensor in group:
+                if sensor.id in self._did_unsupported:
+                    values[sensor.id] = "NODATA"
+                else:
+                    todo.append(sensor)
+            size = self._did_batch.get(header, group[0].batch)
+            for i in range(0, len(todo), size):
+                values.update(self._read_did_batch(header, todo[i:i + size]))
+        return values
+
+    #______________________________________________________________________
+    # Dynamically defined DIDs (UDS 0x2C)
+
+    def enable_dynamic(self, enable):
+        """Reads the sensors passed to sensors() through one dynamically
+        defined DID per ECU, defined for that set of sensors and defined
+        again whenever the set changes. Sensors of ECUs without 0x2C are
+        read as before."""
+        self._dynamic = enable
+        if not enable:
+            self.clear_dynamic()
+
+    def _sensor_header(self, sensor):
+        """Request header of the ECU a sensor is read from, None if not
+        known (Mode 01 PIDs: the first ECU found answering it)"""
+        if isinstance(sensor, obd_uds.EnhancedSensor):
+            return sensor.header
+        ecus = self._responders.get(sensor.id & 0xFF)
+        return ecus and physical_header(ecus[0]) or None
+
+    def define_dynamic(self, sensors):
+        """Defines a dynamic DID on each ECU for its sensors among the given
+        ones. Returns {header: obd_uds.DynamicDID} of the ECUs that took it."""
+        self.clear_dynamic()
+        self._dynamic_set = sorted(s.id for s in sensors)
+        groups = {}
+        for sensor in sensors:
+            header = self._sensor_header(sensor)
+            if header is not None and header not in self._dynamic_refused:
+                groups.setdefault(header, []).append(sensor)
+
+        for header, group in sorted(groups.items()):
+            if len(group) < 2:
+                continue  # nothing to gain
+            self.set_header(header)
+            dynamic = obd_uds.DynamicDID(header, obd_uds.DYNAMIC_DID, group)
+            nrc = self._define(dynamic)
+            if nrc == obd_uds.REQUEST_OUT_OF_RANGE:
+                # Maybe no F4xx DIDs for the Mode 01 PIDs: try the others
+                enhanced = [s for s in group if isinstance(s, obd_uds.EnhancedSensor)]
+                if 1 < len(enhanced) < len(group):
+                    dynamic = obd_uds.DynamicDID(header, obd_uds.DYNAMIC_DID, enhanced)
+                    nrc = self._define(dynamic)
+            if nrc is None:
+                self._dynamic_dids[header] = dynamic
+            else:
+                self._dynamic_refused.add(header)
+                debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                              "ECU %X: no dynamic DID (%s)", header, obd_uds.describe(nrc))
+        return self._dynamic_dids
+
+    def _define(self, dynamic, session=True):
+        """Sends a define request, again in the extended session if the ECU
+        asks for it. Returns None if accepted, else the negative response
+        code (0 for no answer)."""
+        res = self.request_multiframe(dynamic.define_request())
+        if res.find(obd_uds.DYNAMIC_DEFINE + 0x40, obd_uds.DEFINE_BY_ID) is not None:
+            return None
+        nrc = obd_uds.negative(res, obd_uds.DYNAMIC_DEFINE) or 0
+        if session and nrc in obd_uds.SESSION_NRCS:
+            self.query("%.2X%.2X" % (obd_uds.SESSION, obd_uds.EXTENDED_SESSION))
+            return self._define(dynamic, False)
+        return nrc
+
+    def clear_dynamic(self):
+        """Clears the dynamic DIDs defined on the ECUs"""
+        for header, dynamic in sorted(self._dynamic_dids.items()):
+            self.set_header(header)
+            self.query(dynamic.clear_request(), retry=False)
+        self._dynamic_dids = {}
+        self._dynamic_set = None
+
+    def read_dynamic(self, sensors):
+        """Reads sensors through the dynamic DIDs, defining them first if
+        the set of sensors changed. Returns {sensor id: value} for the
+        sensors read this way."""
+        if sorted(s.id for s in sensors) != self._dynamic_set:
+            self.define_dynamic(sensors)
+
+        values = {}
+        for header, dynamic in sorted(self._dynamic_dids.items()):
+            self.set_header(header)
+            res = self.query(dynamic.read_request() +
+                             (self._hints and not self._periodic and "1" or ""))
+            payload = res.find(obd_uds.POSITIVE)
+            data = payload is not None and dynamic.split(payload) or None
+            if data is None:
+                if obd_uds.negative(res) == obd_uds.RESPONSE_PENDING:
+                    continue  # the answer came after the hint cut it short
+                # The ECU lost the definition (reset, session timeout):
+                # define it again on the next read
+                self._dynamic_set = None
+                continue
+            for sensor in dynamic.sensors:
+                values[sensor.id] = sensor.value(memoryview(data[sensor.id]))
+        return values
+
+    def request_multiframe(self, payload):
+        """Sends a request longer than one frame, which the ELM327 won't
+        segment itself, as raw ISO-TP frames (CAN auto formatting off) to
+        the current header. Returns the Response to it."""
+        frames = obd_isotp.segment(payload)
+        if len(frames) == 1:
+            return self.query(bytes(payload).hex().upper(), retry=False)
+
+        def send(frame, responses=True):
+            cmd = bytes(frame).hex().upper()
+            if not responses:
+                return self.send_command(cmd)
+            self.send_command(cmd, wait_response=False)
+            return parse_response(self.recv_response())
+
+        headers = self._headers_enabled
+        if headers:
+            self.enable_headers(False)  # frames are parsed here
+        self.send_command("ATCAF0")
+        try:
+            # Flow control from the ECU, then the consecutive frames; the
+            # adapter only waits for an answer after the last of a block
+            fc = obd_isotp.Reassembler()
+            res = send(frames[0])
+            for ecu, frame in res.payloads:
+                fc.feed(frame)
+            if fc.flow_control is None or fc.flow_control[0] != obd_isotp.FC_CONTINUE:
+                return res
+
+            block_size = fc.flow_control[1]
+            self.send_command("ATR0")
+            try:
+                for i, frame in enumerate(frames[1:-1]):
+                    if block_size and (i + 1) % block_size == 0:
+                        self.send_command("ATR1")
+                        send(frame)
+                        self.send_command("ATR0")
+                    else:
+                        send(frame, False)
+            finally:
+                self.send_command("ATR1")
+            res = send(frames[-1])
+        finally:
+            self.send_command("ATCAF1")
+            if headers:
+                self.enable_headers(True)
+
+        # The answer came as raw frames, PCI bytes included
+        answer = obd_response.Response()
+        answer.status = res.status
+        answer.error = res.error
+        answer.prompt = res.prompt
+        for ecu, frame in res.payloads:
+            message = obd_isotp.Reassembler().feed(frame)
+            if message is not None:
+                answer.payloads.append((ecu, message))
+        return answer
+
+    def _read_did_batch(self, header, batch):
+        # No response count hint: the ECU may answer "response pending"
+        # (NRC 78) first, and the adapter would stop at that.
+        res = self.query(obd_uds.request([s.did for s in batch]))
+        payload = res.find(obd_uds.POSITIVE)
+        if payload is not None:
+            data = obd_uds.split(payload, batch)
+            values = {}
+            for sensor in batch:
+                if sensor.id in data:
+                    values[sensor.id] = sensor.value(memoryview(data[sensor.id]))
+                else:
+                    values[sensor.id] = "NORESPONSE"
+            return values
+
+        nrc = obd_uds.negative(res)
+        if len(batch) > 1:
+            # Retry one by one, which also finds the DID that failed the batch
+            if nrc in obd_uds.NO_BATCH:
+                self._did_batch[header] = 1
+            values = {}
+            for sensor in batch:
+                values.update(self._read_did_batch(header, [sensor]))
+            return values
+
+        if nrc == obd_uds.REQUEST_OUT_OF_RANGE:
+            self._did_unsupported.add(batch[0].id)
+            return {batch[0].id: "NODATA"}
+        return {batch[0].id: nrc is not None and obd_uds.describe(nrc) or res.describe()}
+
+    #______________________________________________________________________
+    # Periodic data (UDS 0x2A)
+
+    def start_periodic(self, sensor_indexes, rates=None):
+        """Asks the ECUs to send the given sensors by themselves, packed in
+        dynamic DIDs F2xx, at the transmission mode for each sensor's rate
+        (rates: {index: Hz}, fast for the others). Returns the indexes of
+        the sensors that will be sent; the rest have to be polled. The
+        values come from recv_periodic."""
+        self.stop_periodic()
+        rates = rates or {}
+        groups = {}  # header -> {transmission mode: [sensors]}
+        for index in sensor_indexes:
+            sensor = obd_sensors.get_sensor(index)
+            header = sensor is not None and self._sensor_header(sensor) or None
+            if header is None or header in self._periodic_refused or response_id(header) is None:
+                continue
+            mode = index in rates and obd_uds.periodic_mode(rates[index]) or obd_uds.PERIODIC_FAST
+            groups.setdefault(header, {}).setdefault(mode, []).append(sensor)
+
+        for header, modes in sorted(groups.items()):
+            self.set_header(header)
+            did = obd_uds.PERIODIC_DID
+            started = {}
+            nrc = None
+            for mode, group in sorted(modes.items()):
+                dids = obd_uds.pack_periodic(header, group, did)
+                did += len(dids)
+                for i in range(0, len(dids), obd_uds.MAX_PERIODIC):
+                    nrc = self._start_periodic(dids[i:i + obd_uds.MAX_PERIODIC], mode)
+                    if nrc is not None:
+                        break
+                    started.update((d.did & 0xFF, d) for d in dids[i:i + obd_uds.MAX_PERIODIC])
+                if nrc is not None:
+                    break
+
+            if nrc is not None:
+                # Keep what runs already, but don't ask this ECU again
+                self._periodic_refused.add(header)
+                debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                              "ECU %X: no periodic data (%s)", header, obd_uds.describe(nrc))
+            if started:
+                self._periodic[response_id(header)] = started
+
+        now = time.time()
+        self._tester_present = now
+        for ecu in self._periodic:
+            self._periodic_seen[ecu] = now
+        return self.periodic_sensors()
+
+    def _start_periodic(self, dids, mode):
+        """Defines the DIDs and asks for them. Returns None if the ECU
+        sends them now, else the negative response code (0 for no answer)."""
+        for dynamic in dids:
+            nrc = self._define(dynamic)
+            if nrc is not None:
+                break
+        else:
+            res = self.query(obd_uds.periodic_request(mode, [d.did for d in dids]))
+            if res.find(obd_uds.READ_PERIODIC + 0x40) is not None:
+                return None
+            nrc = obd_uds.negative(res, obd_uds.READ_PERIODIC) or 0
+
+        for dynamic in dids:
+            self.query(dynamic.clear_request(), retry=False)
+        return nrc
+
+    def periodic_sensors(self):
+        """Indexes of the sensors the ECUs send periodically"""
+        return set(sensor.id for dids in self._periodic.values()
+                   for dynamic in dids.values() for sensor in dynamic.sensors)
+
+    def stop_periodic(self, ecus=None):
+        """Stops the periodic messages of the given ECUs (response ids), of
+        all of them if None, and clears their DIDs"""
+        self.pause_periodic()
+        if ecus is None:
+            ecus = list(self._periodic)
+        for ecu in sorted(ecus):
+            dids = self._periodic.pop(ecu, None)
+            self._periodic_seen.pop(ecu, None)
+            if dids is None:
+                continue
+            self.set_header(physical_header(ecu))
+            self.query(obd_uds.periodic_request(obd_uds.PERIODIC_STOP, []), retry=False)
+            for did, dynamic in sorted(dids.items()):
+                self.query(dynamic.clear_request(), retry=False)
+
+    def pause_periodic(self):
+        """Stops listening for periodic messages, so that requests can be
+        sent. The ECUs keep sending; recv_periodic listens again."""
+        if self._monitor_mode:
+            self.enable_monitor(False)
+            self.send_command("ATCRA")  # receive filter off
+
+    def recv_periodic(self, timeout=None):
+        """Listens for periodic messages (adapter monitor mode, filtered to
+        the streaming ECUs) for up to timeout seconds. Returns a list of
+        (timestamp, sensor index, (name, value, unit)), the values as
+        sensor() returns them. ECUs that stopped sending are dropped, see
+        periodic_sensors."""
+        if not self._periodic:
+            return []
+
+        if time.time() - self._tester_present > TESTER_PRESENT_INTERVAL:
+            self.pause_periodic()
+            for ecu in sorted(self._periodic):
+                self.set_header(physical_header(ecu))
+                self.query("%.2X00" % obd_uds.TESTER_PRESENT, retry=False)
+            self._tester_present = time.time()
+        if not self._monitor_mode:
+            self.monitor_set_filter(id_filter(self._periodic))
+            self.enable_monitor(True)
+
+        samples = []
+        for t, ecu, frame in self.recv_frames(timeout):
+            dids = self._periodic.get(ecu)
+            message = dids is not None and obd_uds.periodic_message(frame) or None
+            dynamic = message is not None and dids.get(message[0]) or None
+            data = dynamic is not None and dynamic.unpack(message[1]) or None
+            if data is None:
+                continue
+            self._periodic_seen[ecu] = t
+            for sensor in dynamic.sensors:
+                value = sensor.value(memoryview(data[sensor.id]))
+                samples.append((t, sensor.id, (sensor.name, value, sensor.unit)))
+
+        now = time.time()
+        silent = [ecu for ecu, t in self._periodic_seen.items() if now - t > PERIODIC_TIMEOUT]
+        if silent:
+            if trace_enabled(DebugEvent.DISPLAY_DEBUG):
+                debug_display(self._notify_window, DebugEvent.DISPLAY_DEBUG,
+                              "No periodic data from %s", ", ".join("%X" % ecu for ecu in silent))
+            self._periodic_refused.update(physical_header(ecu) for ecu in silent)
+            self.stop_periodic(silent)
+        return samples
+
     def sensor_names(self):
         """Internal use only: not a public interface"""
         names = []
@@ -510,7 +1529,6 @@ class OBDPort:
     def get_dtc(self):
         """Returns a list of all pending DTC codes. Each element consists of
         a 2-tuple: (DTC code (string), Code description (string) )"""
-        dtcLetters = ["P", "C", "B", "U"]
         DTCCodes = []
 
         # Grab the DTC pseudo-sensor
@@ -519,6 +1537,9 @@ class OBDPort:
         mil = r[1]
 
         print(("Number of stored DTC: " + str(dtcNumber) + ", MIL " + (mil and "ACTIVE" or "inactive")))
+        # Modes 03 and 07 go to every ECU: PID 01 may have been routed to
+        # one, or a Mode 22 read left its header set
+        self.set_header(None)
         # get all DTC, 3 per mesg response
         for i in range(0, int((dtcNumber + 2) / 3)):
             res = self.send_command_binary(GET_DTC_COMMAND)
@@ -527,13 +1548,7 @@ class OBDPort:
                 if val == 0:  # skip fill of last packet
                     break
 
-                DTCStr = dtcLetters[(val & 0xC000) >> 14] + \
-                                str((val & 0x3000) >> 12) + \
-                                str((val & 0x0f00) >> 8) + \
-                                str((val & 0x00f0) >> 4) + \
-                                str(val & 0x000f)
-
-                DTCCodes.append(["Active", DTCStr])
+                DTCCodes.append(["Active", obd_sensors.dtc_code(val)])
 
         # TODO: The following code is broken.
         # Re-read the datasheets for FREEZE DTC, the ELM327 device is not returning
@@ -546,23 +1561,178 @@ class OBDPort:
                 # Bail, we have our codes.
                 return DTCCodes
 
-            print(("DTC pending result: " + res))
+            print("DTC pending result: %s" % res.hex())
             for i in range(0, 3):
                 val = (res[i + 1] << 8) | res[i + 2]
                 if val == 0:  # skip fill of last packet
                     break
 
-                DTCStr = dtcLetters[(val & 0xC000) >> 14] + \
-                                str((val & 0x3000) >> 12) + \
-                                str((val & 0x0f00) >> 8) + \
-                                str((val & 0x00f0) >> 4) + \
-                                str(val & 0x000f)
-                DTCCodes.append(["Passive", DTCStr])
+                DTCCodes.append(["Passive", obd_sensors.dtc_code(val)])
 
         return DTCCodes
 
+    def read_freeze_frame(self, frame=0, ecu=None):
+        """Reads one freeze frame (Mode 02) of an ECU (its CAN id, None to
+        ask functionally). Returns an obd_freeze.FreezeFrame, or None if
+        the ECU has not stored that frame."""
+        previous_header = self._header
+        self.set_header(ecu is not None and physical_header(ecu) or None)
+        hint = ecu is not None and self._hints and "1" or ""
+        try:
+            payload = self.query(obd_freeze.request([obd_freeze.DTC_PID], frame) + hint).find(
+                obd_freeze.RESPONSE, obd_freeze.DTC_PID)
+            if payload is None or len(payload) < 5:
+                return None
+            dtc = (payload[3] << 8) | payload[4]
+            if dtc == 0:
+                return None
+            ff = obd_freeze.FreezeFrame(ecu, frame, obd_sensors.dtc_code(dtc))
+
+            # Supported PIDs of the frame, 32 per bitmap
+            pids = []
+            base = 0x00
+            while base < 0xE0:
+                payload = self.query(obd_freeze.request([base], frame) + hint).find(
+                    obd_freeze.RESPONSE, base)
+                if payload is None or len(payload) < 7:
+                    break
+                flagged = obd_freeze.supported(payload[3:7], base)
+                pids.extend(pid for pid in flagged if pid % 0x20 and pid != obd_freeze.DTC_PID
+                            and obd_sensors.get_sensor(pid) is not None)
+                if base + 0x20 not in flagged:
+                    break
+                base += 0x20
+
+            values = {}
+            for batch in obd_freeze.batches(pids, self._can):
+                res = self.query(obd_freeze.request(batch, frame) + hint)
+                payload = res.find(obd_freeze.RESPONSE)
+                if payload is not None:
+                    values.update(obd_freeze.split(payload, batch, frame))
+
+            for pid in pids:
+                if pid in values:
+                    sensor = obd_sensors.get_sensor(pid)
+                    ff.values.append((pid, sensor.name, sensor.value(values[pid]), sensor.unit))
+            return ff
+        finally:
+            self.set_header(previous_header)
+
+    def ecus(self):
+        """ECUs to ask one by one: those found by discover_ecus, or [None]
+        (functional request) when they are not known"""
+        ecus = self._responders.get(0x00)
+        return ecus and list(ecus) or [None]
+
+    def get_freeze_frames(self, dtcs=None):
+        """Returns the freeze frames of all ECUs as a list of
+        obd_freeze.FreezeFrame. dtcs is the result of get_dtc (read if not
+        given); frames are only read again when that set of codes changes."""
+        if dtcs is None:
+            dtcs = self.get_dtc()
+        key = sorted(code for status, code in dtcs)
+        if self._freeze_frames is not None and key == self._freeze_dtcs:
+            return self._freeze_frames
+
+        frames = []
+        if dtcs:
+            for ecu in self.ecus():
+                for frame in range(obd_freeze.MAX_FRAMES):
+                    ff = self.read_freeze_frame(frame, ecu)
+                    if ff is None:
+                        break
+                    frames.append(ff)
+
+        self._freeze_frames = frames
+        self._freeze_dtcs = key
+        return frames
+
+    def get_freeze_frame(self, dtc, dtcs=None):
+        """Returns the freeze frames stored for one code (e.g. "P0133")"""
+        return [ff for ff in self.get_freeze_frames(dtcs) if ff.dtc == dtc]
+
+    def supported_mids(self, ecu=None):
+        """Returns the Mode 06 monitor ids (test ids on non-CAN protocols)
+        an ECU supports. On CAN all ranges are asked for in one request."""
+        self.set_header(ecu is not None and physical_header(ecu) or None)
+        hint = ecu is not None and self._hints and "1" or ""
+        mids = []
+        if self._can:
+            for i in range(0, len(obd_mode06.SUPPORTED), obd_mode06.MAX_SUPPORTED_BATCH):
+                ranges = obd_mode06.SUPPORTED[i:i + obd_mode06.MAX_SUPPORTED_BATCH]
+                if i and ranges[0] not in mids:
+                    break
+                payload = self.query(obd_mode06.request_supported(ranges) + hint).find(
+                    obd_mode06.RESPONSE)
+                if payload is None:
+                    break
+                mids.extend(obd_mode06.parse_supported(payload))
+        else:
+            for base in obd_mode06.SUPPORTED:
+                payload = self.query(obd_mode06.request_supported([base])).find(
+                    obd_mode06.RESPONSE, base)
+                if payload is None:
+                    break
+                mids.extend(obd_mode06.parse_supported(payload))
+                if base + 0x20 not in mids:
+                    break
+        return [mid for mid in mids if mid not in obd_mode06.SUPPORTED]
+
+    def same_ignition_cycle(self):
+        """False once the engine run time (PID 1F) went backwards, i.e. the
+        car was switched off and on since the last check. Checked at most
+        every IGNITION_CHECK_INTERVAL seconds; without PID 1F a connection
+        counts as one cycle."""
+        now = time.time()
+        if now - self._run_time_checked < IGNITION_CHECK_INTERVAL:
+            return True
+        self._run_time_checked = now
+
+        run_time = self.sensor(0x1F)[1]
+        if type(run_time) == str:
+            return True
+        same = self._run_time is None or run_time >= self._run_time
+        self._run_time = run_time
+        return same
+
+    def get_monitor_tests(self):
+        """Returns the on-board monitor test results (Mode 06) of all ECUs
+        as a list of obd_mode06.TestResult, read once per ignition cycle.
+
+        On CAN one request per monitor returns all its tests with scaled
+        values and limits; other protocols take one request per test."""
+        if self._monitor_tests is not None and self.same_ignition_cycle():
+            return self._monitor_tests
+
+        results = []
+        previous_header = self._header
+        try:
+            for ecu in self.ecus():
+                hint = ecu is not None and self._hints and "1" or ""
+                for mid in self.supported_mids(ecu):
+                    payload = self.query("%.2X%.2X" % (obd_mode06.MODE, mid) + hint).find(
+                        obd_mode06.RESPONSE)
+                    if payload is None:
+                        continue
+                    if self._can:
+                        results.extend(obd_mode06.parse_records(payload, ecu))
+                    else:
+                        result = obd_mode06.parse_legacy(payload, ecu)
+                        if result is not None:
+                            results.append(result)
+        finally:
+            self.set_header(previous_header)
+
+        self._monitor_tests = results
+        self._run_time_checked = 0
+        self.same_ignition_cycle()  # note the run time the results belong to
+        return results
+
     def clear_dtc(self):
         """Clears all DTCs and freeze frame data"""
+        self._freeze_frames = None
+        self._monitor_tests = None  # Mode 04 also resets the test results
+        self.set_header(None)  # clear every ECU, not the one addressed last
         return self.send_command_binary(CLEAR_DTC_COMMAND)
 
     def log(self, sensor_index, filename):
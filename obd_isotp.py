@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_isotp.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""ISO 15765-2 (ISO-TP) framing for classic 8 byte CAN frames."""
+
+PCI_SINGLE = 0
+PCI_FIRST = 1
+PCI_CONSECUTIVE = 2
+PCI_FLOW = 3
+
+FC_CONTINUE = 0
+FC_WAIT = 1
+FC_OVERFLOW = 2
+
+PAD_BYTE = 0x00
+MAX_LENGTH = 4095
+
+
+def pad(data, fill=PAD_BYTE):
+    """Pads a frame to 8 bytes"""
+    return bytes(data) + bytes([fill]) * (8 - len(data))
+
+
+def segment(payload, fill=PAD_BYTE):
+    """Splits a payload into ISO-TP frames.
+
+    Everything after the first frame must only be sent once the receiver
+    answered with a flow control frame."""
+    payload = bytes(payload)
+    n = len(payload)
+    if n <= 7:
+        return [pad(bytes([n]) + payload, fill)]
+    if n > MAX_LENGTH:
+        raise ValueError("ISO-TP payload too long (%d bytes)" % n)
+
+    frames = [bytes([0x10 | (n >> 8), n & 0xFF]) + payload[:6]]
+    seq = 1
+    for i in range(6, n, 7):
+        frames.append(pad(bytes([0x20 | (seq & 0xF)]) + payload[i:i + 7], fill))
+        seq += 1
+
+    return frames
+
+
+def flow_control(status=FC_CONTINUE, block_size=0, st_min=0, fill=PAD_BYTE):
+    return pad(bytes([0x30 | status, block_size, st_min]), fill)
+
+
+def st_min_seconds(st_min):
+    """Converts the STmin byte of a flow control frame to seconds"""
+    if st_min <= 0x7F:
+        return st_min / 1000.0
+    if 0xF1 <= st_min <= 0xF9:
+        return (st_min - 0xF0) / 10000.0
+
+    # Reserved values shall be treated as the maximum (127 ms)
+    return 0.127
+
+
+class Reassembler:
+    """ Reassembles the ISO-TP messages sent by one CAN id """
+
+    def __init__(self):
+        self.flow_control = None  # (status, block size, STmin) of last FC
+        self.need_flow_control = False
+        self.reset()
+
+    def reset(self):
+        self._buffer = None
+        self._length = 0
+        self._seq = 0
+        self.frames = []
+
+    def in_progress(self):
+        return self._buffer is not None
+
+    def feed(self, data):
+        """Feeds one frame. Returns the payload once a message is complete."""
+        if not data:
+            return None
+
+        pci = data[0] >> 4
+        if pci == PCI_SINGLE:
+            n = data[0] & 0xF
+            if n == 0 or n > len(data) - 1:
+                return None
+            self.reset()
+            self.frames = [bytes(data[:n + 1])]
+            return bytes(data[1:n + 1])
+
+        if pci == PCI_FIRST:
+            if len(data) < 8:
+                return None
+            self.reset()
+            self._length = ((data[0] & 0xF) << 8) | data[1]
+            self._buffer = bytearray(data[2:8])
+            self._seq = 1
+            self.frames = [bytes(data)]
+            self.need_flow_control = True
+            return None
+
+        if pci == PCI_CONSECUTIVE:
+            if self._buffer is None:
+                return None
+            if (data[0] & 0xF) != (self._seq & 0xF):
+                # Lost a frame: drop the message
+                self.reset()
+                return None
+
+            self._seq += 1
+            self._buffer.extend(data[1:1 + self._length - len(self._buffer)])
+            self.frames.append(bytes(data))
+            if len(self._buffer) >= self._length:
+                payload = bytes(self._buffer)
+                self._buffer = None
+                return payload
+            return None
+
+        if pci == PCI_FLOW and len(data) >= 3:
+            self.flow_control = (data[0] & 0xF, data[1], data[2])
+
+        return None
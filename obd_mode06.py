@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_mode06.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""On-board monitor test results (Mode 06).
+
+On CAN every answer is a list of 9 byte records:
+
+    OBDMID TID UASID value(2) min(2) max(2)
+
+where the unit and scaling id (UASID) says how to read the three values.
+The older protocols answer per test id instead ("46 TID CID value limit")
+with one limit, a minimum or a maximum depending on bit 7 of CID, and no
+standard scaling.
+"""
+
+MODE = 0x06
+RESPONSE = 0x46
+SUPPORTED = (0x00, 0x20, 0x40, 0x60, 0x80, 0xA0, 0xC0, 0xE0)  # supported MID ranges
+MAX_SUPPORTED_BATCH = 6  # supported MID ranges per CAN request
+RECORD = 9
+
+# UASID -> (scale, offset, unit); ids from 0x80 are the signed versions
+UNITS = {
+    0x01: (1, 0, ""),
+    0x02: (0.1, 0, ""),
+    0x03: (0.01, 0, ""),
+    0x04: (0.001, 0, ""),
+    0x05: (0.0000305, 0, ""),
+    0x06: (0.000305, 0, ""),
+    0x07: (0.25, 0, "rpm"),
+    0x08: (0.01, 0, "km/h"),
+    0x09: (1, 0, "km/h"),
+    0x0A: (0.122, 0, "mV"),
+    0x0B: (0.001, 0, "V"),
+    0x0C: (0.01, 0, "V"),
+    0x0D: (0.00390625, 0, "mA"),
+    0x0E: (0.001, 0, "A"),
+    0x0F: (0.01, 0, "A"),
+    0x10: (1, 0, "ms"),
+    0x11: (100, 0, "ms"),
+    0x12: (1, 0, "s"),
+    0x13: (1, 0, "mOhm"),
+    0x14: (1, 0, "Ohm"),
+    0x15: (1, 0, "kOhm"),
+    0x16: (0.1, -40, "C"),
+    0x17: (0.01, 0, "kPa"),
+    0x18: (0.0117, 0, "kPa"),
+    0x19: (0.079, 0, "kPa"),
+    0x1A: (1, 0, "kPa"),
+    0x1B: (10, 0, "kPa"),
+    0x1C: (0.01, 0, "deg"),
+    0x1D: (0.5, 0, "deg"),
+    0x1E: (0.0000305, 0, "lambda"),
+    0x1F: (0.05, 0, "A/F"),
+    0x20: (0.0039062, 0, ""),
+    0x21: (1, 0, "mHz"),
+    0x22: (1, 0, "Hz"),
+    0x23: (1, 0, "kHz"),
+    0x24: (1, 0, "counts"),
+    0x25: (1, 0, "km"),
+    0x26: (0.1, 0, "mV/ms"),
+    0x27: (0.01, 0, "g/s"),
+    0x28: (1, 0, "g/s"),
+    0x29: (0.25, 0, "Pa/s"),
+    0x2A: (0.001, 0, "kg/h"),
+    0x2B: (1, 0, "switches"),
+    0x2C: (0.01, 0, "g/cyl"),
+    0x2D: (0.01, 0, "mg/stroke"),
+    0x2E: (1, 0, ""),
+    0x2F: (0.01, 0, "%"),
+    0x30: (0.001526, 0, "%"),
+    0x31: (0.001, 0, "L"),
+    0x32: (0.0000305, 0, "in"),
+    0x33: (0.00024414, 0, ""),
+    0x34: (1, 0, "min"),
+    0x35: (10, 0, "ms"),
+    0x36: (0.01, 0, "g"),
+    0x37: (0.1, 0, "g"),
+    0x38: (1, 0, "g"),
+    0x39: (0.01, -327.68, "%"),
+    0x81: (1, 0, ""),
+    0x82: (0.1, 0, ""),
+    0x83: (0.01, 0, ""),
+    0x84: (0.001, 0, ""),
+    0x85: (0.0000305, 0, ""),
+    0x86: (0.000305, 0, ""),
+    0x8A: (0.122, 0, "mV"),
+    0x8B: (0.001, 0, "V"),
+    0x8C: (0.01, 0, "V"),
+    0x8D: (0.00390625, 0, "mA"),
+    0x8E: (0.001, 0, "A"),
+    0x90: (1, 0, "ms"),
+    0x96: (0.1, 0, "C"),
+    0x9C: (0.01, 0, "deg"),
+    0x9D: (0.5, 0, "deg"),
+    0xA8: (1, 0, "g/s"),
+    0xA9: (0.25, 0, "Pa/s"),
+    0xAD: (0.01, 0, "mg/stroke"),
+    0xAE: (0.1, 0, "mg/stroke"),
+    0xAF: (0.01, 0, "%"),
+    0xB0: (0.003052, 0, "%"),
+    0xB1: (2, 0, "mV/s"),
+    0xFC: (0.01, 0, "kPa"),
+    0xFD: (0.001, 0, "kPa"),
+    0xFE: (0.25, 0, "Pa"),
+}
+
+# OBDMID -> monitor name (J1979 appendix D)
+MONITORS = {
+    0x21: "Catalyst Bank 1",
+    0x22: "Catalyst Bank 2",
+    0x23: "Catalyst Bank 3",
+    0x24: "Catalyst Bank 4",
+    0x31: "EGR Bank 1",
+    0x32: "EGR Bank 2",
+    0x33: "EGR Bank 3",
+    0x34: "EGR Bank 4",
+    0x35: "VVT Bank 1",
+    0x36: "VVT Bank 2",
+    0x37: "VVT Bank 3",
+    0x38: "VVT Bank 4",
+    0x39: "EVAP (Cap Off / 0.150\")",
+    0x3A: "EVAP (0.090\")",
+    0x3B: "EVAP (0.040\")",
+    0x3C: "EVAP (0.020\")",
+    0x3D: "Purge Flow",
+    0x71: "Secondary Air 1",
+    0x72: "Secondary Air 2",
+    0x73: "Secondary Air 3",
+    0x74: "Secondary Air 4",
+    0x81: "Fuel System Bank 1",
+    0x82: "Fuel System Bank 2",
+    0x83: "Fuel System Bank 3",
+    0x84: "Fuel System Bank 4",
+    0x85: "Boost Pressure Bank 1",
+    0x86: "Boost Pressure Bank 2",
+    0x90: "NOx Adsorber Bank 1",
+    0x91: "NOx Adsorber Bank 2",
+    0x98: "NOx Catalyst Bank 1",
+    0x99: "NOx Catalyst Bank 2",
+    0xA0: "Misfire General",
+    0xB0: "PM Filter Bank 1",
+    0xB1: "PM Filter Bank 2",
+}
+for _i in range(16):
+    MONITORS[0x01 + _i] = "O2 Sensor B%dS%d" % (_i // 4 + 1, _i % 4 + 1)
+    MONITORS[0x41 + _i] = "O2 Sensor Heater B%dS%d" % (_i // 4 + 1, _i % 4 + 1)
+for _i in range(12):
+    MONITORS[0xA1 + _i] = "Misfire Cylinder %d" % (_i + 1)
+
+
+#__________________________________________________________________________
+
+
+class TestResult:
+    """ One monitor test: value and limits, scaled """
+
+    def __init__(self, ecu, mid, tid, value, minimum, maximum, unit):
+        self.ecu = ecu
+        self.mid = mid  # None for the non-CAN format
+        self.tid = tid
+        self.value = value
+        self.min = minimum  # None when the test has no lower limit
+        self.max = maximum
+        self.unit = unit
+
+    def name(self):
+        if self.mid is None:
+            return "Test %.2X" % self.tid
+        return "%s, test %.2X" % (MONITORS.get(self.mid, "Monitor %.2X" % self.mid), self.tid)
+
+    def passed(self):
+        return ((self.min is None or self.value >= self.min) and
+                (self.max is None or self.value <= self.max))
+
+    def row(self):
+        """(name, value, min, max, result) text, e.g. for a list view"""
+        def text(v):
+            return v is None and "" or "%g %s" % (round(v, 4), self.unit)
+        return (self.name(), text(self.value), text(self.min), text(self.max),
+                self.passed() and "Passed" or "FAILED")
+
+
+def scale(uasid, raw):
+    """Scales a 2 byte value. Returns (value, unit)."""
+    if uasid & 0x80 and raw & 0x8000:
+        raw -= 0x10000
+    factor, offset, unit = UNITS.get(uasid, (1, 0, "(UAS %.2X)" % uasid))
+    return raw * factor + offset, unit
+
+
+def request_supported(ranges):
+    """Request for supported MID bitmaps ("0600204060")"""
+    return "%.2X" % MODE + "".join("%.2X" % r for r in ranges)
+
+
+def parse_supported(payload):
+    """Returns the MIDs flagged in a supported MID answer
+    ("46 00 xx xx xx xx [20 xx xx xx xx ...]")"""
+    mids = []
+    i = 1
+    while i + 5 <= len(payload):
+        base = payload[i]
+        bits = int.from_bytes(payload[i + 1:i + 5], 'big')
+        mids.extend(base + n + 1 for n in range(32) if bits & (0x80000000 >> n))
+        i += 5
+    return mids
+
+
+def parse_records(payload, ecu=None):
+    """Splits a CAN Mode 06 answer into TestResults"""
+    results = []
+    for i in range(1, len(payload) - RECORD + 1, RECORD):
+        mid, tid, uasid = payload[i], payload[i + 1], payload[i + 2]
+        value, unit = scale(uasid, int.from_bytes(payload[i + 3:i + 5], 'big'))
+        minimum = scale(uasid, int.from_bytes(payload[i + 5:i + 7], 'big'))[0]
+        maximum = scale(uasid, int.from_bytes(payload[i + 7:i + 9], 'big'))[0]
+        results.append(TestResult(ecu, mid, tid, value, minimum, maximum, unit))
+    return results
+
+
+def parse_legacy(payload, ecu=None):
+    """Reads a non-CAN Mode 06 answer ("46 TID CID value limit"), unscaled"""
+    if len(payload) < 7:
+        return None
+    tid, cid = payload[1], payload[2]
+    value = int.from_bytes(payload[3:5], 'big')
+    limit = int.from_bytes(payload[5:7], 'big')
+    if cid & 0x80:
+        return TestResult(ecu, None, tid, value, limit, None, "")
+    return TestResult(ecu, None, tid, value, None, limit, "")
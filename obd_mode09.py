@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_mode09.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Vehicle information (Mode 09): VIN, calibration ids, calibration
+verification numbers and ECU names.
+
+On CAN an ECU sends each item as one (multi-frame) message, "49 PID count
+data...". The older protocols split it into messages of 4 data bytes with
+a sequence number, "49 PID seq data(4)"; both are joined by join().
+"""
+
+MODE = 0x09
+RESPONSE = 0x49
+VIN = 0x02
+CALID = 0x04  # calibration ids
+CVN = 0x06  # calibration verification numbers
+ECU_NAME = 0x0A
+
+VIN_LENGTH = 17
+CALID_LENGTH = 16
+CVN_LENGTH = 4
+ECU_NAME_LENGTH = 20
+
+
+#__________________________________________________________________________
+
+
+def join(payloads, pid):
+    """Joins the data of one ECU's answer for a Mode 09 PID, None if the
+    answer is missing"""
+    parts = [p for p in payloads if len(p) > 3 and p[0] == RESPONSE and p[1] == pid]
+    if not parts:
+        return None
+    parts.sort(key=lambda p: p[2])
+    return b''.join(bytes(p[3:]) for p in parts)
+
+
+def _text(data):
+    return data.replace(b'\x00', b'').decode('ascii', 'replace').strip()
+
+
+def vin(data):
+    """VIN text; the older protocols pad it to 20 bytes with leading zeros"""
+    return _text(data[-VIN_LENGTH:])
+
+
+def calibration_ids(data):
+    return [_text(data[i:i + CALID_LENGTH])
+            for i in range(0, len(data) - CALID_LENGTH + 1, CALID_LENGTH)]
+
+
+def cvns(data):
+    return [data[i:i + CVN_LENGTH].hex().upper()
+            for i in range(0, len(data) - CVN_LENGTH + 1, CVN_LENGTH)]
+
+
+def ecu_name(data):
+    """ECU name, e.g. "ECM-EngineControl" (acronym, '-', name)"""
+    return _text(data[:ECU_NAME_LENGTH])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_monitor.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+
+import threading
+
+
+class MonitorEntry:
+    """ Latest state of one CAN id seen in monitor mode """
+
+    RATE_SMOOTHING = 0.1
+
+    def __init__(self, t, id, data):
+        self.id = id
+        self.data = data
+        self.count = 1
+        self.first = t
+        self.last = t
+        self.period = 0.0
+        # Time each byte last changed
+        self.changed = [t] * len(data)
+
+    def update(self, t, data):
+        dt = t - self.last
+        if self.count == 1:
+            self.period = dt
+        else:
+            self.period += (dt - self.period) * self.RATE_SMOOTHING
+        self.count += 1
+        self.last = t
+
+        if data != self.data:
+            if len(data) != len(self.changed):
+                self.changed = [t] * len(data)
+            else:
+                old = self.data
+                for i in range(min(len(old), len(data))):
+                    if old[i] != data[i]:
+                        self.changed[i] = t
+            self.data = data
+
+    def rate(self):
+        """Frames per second (smoothed)"""
+        return self.period > 0 and 1.0 / self.period or 0.0
+
+
+class MonitorTable:
+    """ Per-id table of monitored frames.
+
+    Written by the monitoring thread, read by the UI at its own pace, so the
+    UI cost depends on how often it repaints, not on the bus load."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._rows = []  # ids in the order they were first seen
+        self.version = 0  # bumped on every update
+        self.frames = 0
+
+    def update(self, t, id, data):
+        with self._lock:
+            self._update(t, id, data)
+
+    def update_many(self, frames):
+        if not frames:
+            return
+
+        with self._lock:
+            for t, id, data in frames:
+                self._update(t, id, data)
+
+    def _update(self, t, id, data):
+        entry = self._entries.get(id)
+        if entry is None:
+            self._entries[id] = MonitorEntry(t, id, data)
+            self._rows.append(id)
+        else:
+            entry.update(t, data)
+        self.frames += 1
+        self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._rows = []
+            self.frames = 0
+            self.version += 1
+
+    def __len__(self):
+        return len(self._rows)
+
+    def row(self, index):
+        """Returns the MonitorEntry shown in a given row (or None)"""
+        with self._lock:
+            if index >= len(self._rows):
+                return None
+            return self._entries[self._rows[index]]
+
+    def entries(self):
+        with self._lock:
+            return [self._entries[id] for id in self._rows]
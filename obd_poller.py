@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_poller.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Background sensor polling for displays.
+
+The poller owns the OBDPort once started and keeps a ValueStore of the
+latest (name, value, unit) per sensor index, so a display only ever reads
+cached values and never waits on the adapter.
+
+With periodic set, the poller first asks the ECUs to send the visible
+sensors by themselves (UDS 0x2A, see OBDPort.start_periodic) and only
+polls the ones they don't send; the streamed values go to the same
+ValueStore. ECUs that refuse, or stop sending, are polled again. The
+sensors still polled are read together in one pause of the periodic
+messages. When those pauses would cost more adapter commands than the
+streamed values save (PAUSE_COMMANDS per pause, one per value), all the
+sensors are polled.
+"""
+
+import threading
+import time
+from collections import deque
+
+from obd_values import ValueStore
+
+DEFAULT_RATE = 1.0  # Hz, for sensors without a configured rate
+
+# Adjacent page sensors are refreshed this many times slower than the
+# visible ones, just enough to show a recent value after a page flip.
+PREFETCH_SLOWDOWN = 5.0
+
+# Longest wait for periodic messages, so page changes and requests are
+# not held up
+STREAM_WAIT = 0.05
+
+# Adapter commands to leave monitor mode for requests and enter it again
+PAUSE_COMMANDS = 9
+
+
+class SensorPoller(threading.Thread):
+    """ Polls the visible sensors at their own rates and prefetches the next ones """
+
+    def __init__(self, port, values=None, rates=None, default_rate=DEFAULT_RATE,
+                 periodic=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.values = values if values is not None else ValueStore()
+        self.rates = dict(rates or {})  # sensor index -> Hz
+        self.default_rate = default_rate
+        self.periodic = periodic
+
+        # Adapter statistics
+        self.polls = 0
+        self.pushed = 0  # values received as periodic messages
+        self.errors = 0
+        self.latency = 0.0  # smoothed time per sensor read (seconds)
+        self.started = None
+
+        self._lock = threading.Lock()
+        self._visible = []
+        self._prefetch = []
+        self._due = {}  # sensor index -> next poll time
+        self._streamed = set()  # sensor indexes the ECUs send periodically
+        self._restream = False  # visible sensors or rates changed
+        self._requests = deque()
+        self._wake = threading.Event()
+        self._quit = False
+
+    def set_rate(self, index, rate):
+        with self._lock:
+            self.rates[index] = rate
+            self._due[index] = 0.0
+            self._restream = self.periodic
+        self._wake.set()
+
+    def period(self, index, prefetch=False):
+        period = 1.0 / (self.rates.get(index) or self.default_rate)
+        if prefetch:
+            period *= PREFETCH_SLOWDOWN
+        return period
+
+    def set_pages(self, visible, prefetch=()):
+        """Sets the sensor indexes on screen and those to prefetch.
+
+        Visible sensors that have no cached value yet are read first."""
+        with self._lock:
+            self._visible = list(visible)
+            self._prefetch = [i for i in prefetch if i not in self._visible]
+            for i in self._visible:
+                if self.values.get(i) is None:
+                    self._due[i] = 0.0
+            self._restream = self.periodic
+        self._wake.set()
+
+    def request(self, key, function):
+        """Runs function() on the poller thread, which owns the port, and
+        stores its result in the value store under key."""
+        self._requests.append((key, function))
+        self._wake.set()
+
+    def rate(self):
+        """Sensor reads (polled or pushed) per second since the poller started"""
+        if not self.started or not (self.polls or self.pushed):
+            return 0.0
+        return (self.polls + self.pushed) / max(time.time() - self.started, 1e-3)
+
+    def stop(self):
+        self._quit = True
+        self._wake.set()
+
+    def _next(self):
+        """Returns (sensor index, due time, prefetch) of the next sensor to poll"""
+        with self._lock:
+            best = None
+            for prefetch, indexes in ((False, self._visible), (True, self._prefetch)):
+                for i in indexes:
+                    if i in self._streamed:
+                        continue
+                    due = self._due.get(i, 0.0)
+                    # visible sensors win ties against prefetched ones
+                    if best is None or due < best[1]:
+                        best = (i, due, prefetch)
+        return best
+
+    def _batch(self, now):
+        """Returns [(sensor index, prefetch)] of the polled sensors to read in
+        one pause of the periodic messages: those due, and those due within
+        half their period"""
+        with self._lock:
+            batch = []
+            for prefetch, indexes in ((False, self._visible), (True, self._prefetch)):
+                for i in indexes:
+                    if i not in self._streamed and \
+                            self._due.get(i, 0.0) - now <= self.period(i, prefetch) / 2:
+                        batch.append((i, prefetch))
+        return batch
+
+    def poll(self, index, prefetch=False):
+        if self._streamed:
+            self.port.pause_periodic()
+        start = time.time()
+        try:
+            result = self.port.sensor(index)
+        except IOError:
+            self.errors += 1
+            result = None
+
+        elapsed = time.time() - start
+        self.polls += 1
+        if self.polls == 1:
+            self.latency = elapsed
+        else:
+            self.latency += (elapsed - self.latency) * 0.1
+
+        with self._lock:
+            self._due[index] = time.time() + self.period(index, prefetch)
+
+        if result is not None:
+            self.values.set(index, result)
+        return result
+
+    def stream(self):
+        """Asks the ECUs to send the visible sensors periodically"""
+        with self._lock:
+            visible = list(self._visible)
+            rates = dict((i, self.rates.get(i) or self.default_rate) for i in visible)
+            polled = [1.0 / self.period(i, True) for i in self._prefetch]
+            self._restream = False
+        try:
+            streamed = self.port.start_periodic(visible, rates)
+            polled += [rates[i] for i in visible if i not in streamed]
+            # About one pause per period of the fastest polled sensor
+            if streamed and polled and \
+                    sum(rates[i] for i in streamed) < PAUSE_COMMANDS * max(polled):
+                self.port.stop_periodic()
+                streamed = set()
+        except IOError:
+            self.errors += 1
+            streamed = set()
+        with self._lock:
+            self._streamed = streamed
+
+    def receive(self, timeout):
+        """Stores the periodic messages that arrive within timeout"""
+        try:
+            samples = self.port.recv_periodic(timeout)
+        except IOError:
+            self.errors += 1
+            samples = []
+        for t, index, result in samples:
+            self.values.set(index, result)
+        self.pushed += len(samples)
+
+        streamed = self.port.periodic_sensors()
+        if streamed != self._streamed:
+            # ECUs that stopped sending: poll their sensors again
+            with self._lock:
+                for i in self._streamed - streamed:
+                    self._due[i] = 0.0
+                self._streamed = streamed
+
+    def run(self):
+        self.started = time.time()
+        while not self._quit:
+            if self._requests and self._streamed:
+                self.port.pause_periodic()
+            while self._requests:
+                key, function = self._requests.popleft()
+                try:
+                    self.values.set(key, function())
+                except IOError:
+                    self.errors += 1
+
+            if self._restream:
+                self.stream()
+
+            best = self._next()
+            if self._streamed:
+                # Listen until the next poll is due
+                delay = best is not None and best[1] - time.time() or STREAM_WAIT
+                self.receive(min(max(delay, 0), STREAM_WAIT))
+                if best is None or best[1] > time.time() or self._wake.is_set():
+                    self._wake.clear()
+                    continue
+                # One pause for all the sensors due
+                for index, prefetch in self._batch(time.time()):
+                    self.poll(index, prefetch)
+                continue
+            elif best is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            index, due, prefetch = best
+            delay = due - time.time()
+            if delay > 0:
+                # Page changes and rate updates wake us up early
+                if self._wake.wait(delay):
+                    self._wake.clear()
+                    continue
+
+            self.poll(index, prefetch)
+
+        if self._streamed:
+            try:
+                self.port.stop_periodic()
+            except IOError:
+                pass
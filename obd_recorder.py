@@ -45,11 +45,11 @@ class OBD_Recorder():
         return self.port
         
     def add_log_item(self, item):
-        for index, e in enumerate(obd_sensors.SENSORS):
-            if(item == e.shortname):
-                self.sensorlist.append(index)
-                print(("Logging item: "+e.name))
-                break
+        # Mode 01 PIDs or Mode 22 channels (see obd_uds)
+        e = obd_sensors.find_sensor(item)
+        if e is not None:
+            self.sensorlist.append(e.id)
+            print(("Logging item: "+e.name))
             
             
     def record_data(self):
@@ -63,10 +63,10 @@ class OBD_Recorder():
             current_time = str(localtime.hour)+":"+str(localtime.minute)+":"+str(localtime.second)+"."+str(localtime.microsecond)
             log_string = current_time
             results = {}
-            for index in self.sensorlist:
-                (name, value, unit) = self.port.sensor(index)
+            for index, (name, value, unit) in zip(self.sensorlist,
+                                                  self.port.sensors(self.sensorlist)):
                 log_string = log_string + ","+str(value)
-                results[obd_sensors.SENSORS[index].shortname] = value;
+                results[obd_sensors.get_sensor(index).shortname] = value;
 
             gear = self.calculate_gear(results["rpm"], results["speed"])
             log_string = log_string #+ "," + str(gear)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_replay.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Replays saved captures onto a SocketCAN interface.
+
+Frames are sent against absolute deadlines computed from the capture
+timestamps. The scheduler sleeps until shortly before a deadline and spins
+for the rest, and frames whose deadline has already passed go out back to
+back without sleeping, so timing holds at thousands of frames per second.
+"""
+
+import gc
+import time
+
+
+#__________________________________________________________________________
+
+
+class JitterStats:
+    """ Send lateness statistics (seconds behind the deadline) """
+
+    BUCKET = 10e-6  # histogram resolution
+    BUCKETS = 1000  # everything past 10 ms lands in the last bucket
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.first = None
+        self.last = None
+        self._hist = [0] * self.BUCKETS
+
+    def add(self, lateness, now):
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += 1
+        self.total += lateness
+        if lateness > self.max:
+            self.max = lateness
+        self._hist[min(int(lateness / self.BUCKET), self.BUCKETS - 1)] += 1
+
+    def mean(self):
+        return self.count and self.total / self.count or 0.0
+
+    def percentile(self, p):
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self._hist):
+            seen += n
+            if seen >= target and n:
+                return (i + 1) * self.BUCKET
+        return 0.0
+
+    def rate(self):
+        """Achieved frames per second"""
+        if self.count < 2 or self.last == self.first:
+            return 0.0
+        return (self.count - 1) / (self.last - self.first)
+
+    def summary(self):
+        return ("%d frames, %.0f frames/s, lateness mean %.1f us, "
+                "p99 %.1f us, max %.1f us" %
+                (self.count, self.rate(), self.mean() * 1e6,
+                 self.percentile(99) * 1e6, self.max * 1e6))
+
+
+class DeadlineScheduler:
+    """ Waits for absolute deadlines on the perf_counter clock.
+
+    time.sleep overshoots by tens to hundreds of microseconds, so it is only
+    used to get within spin_threshold of the deadline; the remainder is a
+    busy wait."""
+
+    def __init__(self, spin_threshold=0.002):
+        self.spin_threshold = spin_threshold
+        self.stats = JitterStats()
+
+    def wait_until(self, deadline):
+        """Waits for the deadline. Returns the time (perf_counter) waited until."""
+        now = time.perf_counter()
+        remaining = deadline - now
+        if remaining > self.spin_threshold:
+            time.sleep(remaining - self.spin_threshold)
+            now = time.perf_counter()
+
+        while now < deadline:
+            now = time.perf_counter()
+
+        return now
+
+    def record(self, deadline, now=None):
+        if now is None:
+            now = time.perf_counter()
+        self.stats.add(max(now - deadline, 0.0), now)
+
+
+#__________________________________________________________________________
+
+
+def parse_id_list(text):
+    """Parses "7E8,100-1FF" into a set of ids"""
+    ids = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            ids.update(range(int(lo, 16), int(hi, 16) + 1))
+        else:
+            ids.add(int(part, 16))
+    return ids
+
+
+class Replayer:
+    """ Replays frames at original timing, scaled speed or maximum speed """
+
+    def __init__(self, send, speed=1.0, include=None, exclude=None):
+        """send is called as send(id, data). speed 1.0 is the original timing,
+        2.0 twice as fast, 0 (or None) as fast as possible."""
+        self.send = send
+        self.speed = speed
+        self.include = include
+        self.exclude = exclude
+        self.scheduler = DeadlineScheduler()
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+
+    def wanted(self, id):
+        """False if the id is filtered out (include/exclude)"""
+        if self.include is not None and id not in self.include:
+            return False
+        if self.exclude is not None and id in self.exclude:
+            return False
+        return True
+
+    def replay(self, frames):
+        """Replays an iterable of (timestamp, id, data). Returns the JitterStats."""
+        scheduler = self.scheduler
+        send = self.send
+        wanted = self.wanted
+        scale = self.speed and 1.0 / self.speed or 0.0
+
+        # A collection pause in the middle of a burst shows up as jitter
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            t0 = None
+            start = None
+            for t, id, data in frames:
+                if self._stop:
+                    break
+                if not wanted(id):
+                    continue
+
+                if t0 is None:
+                    t0 = t
+                    start = time.perf_counter()
+
+                now = time.perf_counter()
+                if not scale:
+                    deadline = now
+                else:
+                    deadline = start + (t - t0) * scale
+                if now < deadline:
+                    now = scheduler.wait_until(deadline)
+
+                send(id, data)
+                scheduler.record(deadline, now)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        return scheduler.stats
+
+
+def replay_capture(filename, iface, speed=1.0, include=None, exclude=None, loops=1):
+    """Replays a capture file onto a SocketCAN interface"""
+    # Not at module level: obd_canlog brings in numpy, and obd_io only
+    # needs the scheduler
+    import obd_canlog
+    from obd_transport import CANSocket
+
+    sock = CANSocket(iface)
+    try:
+        replayer = Replayer(sock.send, speed, include, exclude)
+        for i in range(loops):
+            stats = replayer.replay(obd_canlog.read_capture(filename))
+    finally:
+        sock.close()
+
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a CAN capture onto SocketCAN")
+    parser.add_argument("capture")
+    parser.add_argument("iface", help="SocketCAN interface, e.g. vcan0")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="timing scale (2 = twice as fast, 0 = as fast as possible)")
+    parser.add_argument("--include", help="ids to replay, e.g. 7E8,100-1FF")
+    parser.add_argument("--exclude", help="ids to skip")
+    parser.add_argument("--loops", type=int, default=1)
+    args = parser.parse_args()
+
+    stats = replay_capture(args.capture, args.iface, args.speed,
+                           args.include and parse_id_list(args.include),
+                           args.exclude and parse_id_list(args.exclude),
+                           args.loops)
+    print(stats.summary())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_response.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Parses ELM327 responses straight from the receive buffer.
+
+One pass over the lines of the buffer turns the adapter's hex text into
+payload bytes per ECU (multi-frame messages reassembled), and picks out
+NO DATA, error messages and the prompt, without converting the buffer to
+str first.
+"""
+
+from binascii import unhexlify, Error as HexError
+
+import obd_isotp
+
+# Response status
+OK = 0
+NO_DATA = 1
+ERROR = 2
+NO_RESPONSE = 3  # nothing but the prompt (or nothing at all)
+
+# Adapter messages that mean the request failed. Messages are compared
+# with spaces removed: with spaces off (ATS0) the adapter prints "NODATA".
+NODATA = b'NODATA'
+ERRORS = (b'?', b'CANERROR', b'BUSERROR', b'BUSBUSY', b'DATAERROR',
+          b'FBERROR', b'UNABLETOCONNECT', b'BUFFERFULL', b'STOPPED',
+          b'ACTALERT', b'LVRESET', b'LPALERT', b'ERR')
+
+# Progress messages that are not part of the answer
+IGNORED = (b'SEARCHING', b'BUSINIT', b'OK')
+
+
+#__________________________________________________________________________
+
+
+class Response:
+    """ Result of one request.
+
+    payloads is a list of (ecu, bytes) in the order the messages completed;
+    ecu is the CAN id when headers are on, None otherwise."""
+
+    __slots__ = ('status', 'payloads', 'error', 'prompt')
+
+    def __init__(self):
+        self.status = NO_RESPONSE
+        self.payloads = []
+        self.error = None
+        self.prompt = False
+
+    def ok(self):
+        return self.status == OK
+
+    def by_ecu(self):
+        """Returns a dict of ecu -> list of payloads"""
+        result = {}
+        for ecu, payload in self.payloads:
+            result.setdefault(ecu, []).append(payload)
+        return result
+
+    def find(self, *prefix):
+        """Returns the first payload starting with the given bytes (e.g.
+        the mode + 0x40 and PID of the request), or None."""
+        prefix = bytes(prefix)
+        for ecu, payload in self.payloads:
+            if payload.startswith(prefix):
+                return payload
+        return None
+
+    def describe(self):
+        """Short text for the status, as the old string interface returned it"""
+        if self.status == NO_DATA:
+            return "NODATA"
+        if self.status == ERROR:
+            return self.error
+        if self.status == NO_RESPONSE:
+            return "NORESPONSE"
+        return "OK"
+
+
+def _hex(digits):
+    """Converts "410C1AF8" to bytes, None if it isn't hex"""
+    try:
+        return unhexlify(digits)
+    except (HexError, ValueError):
+        return None
+
+
+def _can_frame(digits):
+    """Splits a headered CAN line (spaces removed) into (id, data).
+
+    The data is whole bytes, so an odd number of digits means a 3 digit
+    11 bit id ("7E8 03 41 0D 00"); otherwise the id is 4 bytes (29 bit)."""
+    n = len(digits) & 1 and 3 or 8
+    if len(digits) <= n:
+        return None
+    data = _hex(digits[n:])
+    if data is None:
+        return None
+    try:
+        return int(digits[:n], 16), data
+    except ValueError:
+        return None
+
+
+def parse_response(buf, headers=False):
+    """Parses the text the adapter sent for one request (up to the prompt).
+
+    buf may be bytes, bytearray or memoryview, with or without spaces
+    between the bytes (ATS) and linefeeds (ATL). With headers on, CAN
+    responses are split per ECU id and ISO-TP frames are reassembled;
+    without, the ELM's own multi-frame format ("014", "0: ...") is
+    reassembled."""
+    res = Response()
+    if isinstance(buf, memoryview):
+        buf = buf.tobytes()
+
+    end = buf.find(b'>')
+    if end >= 0:
+        res.prompt = True
+        buf = buf[:end]
+
+    multi_length = None  # headerless multi-frame message in progress
+    multi = None
+    reassemblers = None
+
+    for line in buf.split(b'\r'):
+        line = line.strip()
+        if not line:
+            continue
+
+        # Adapter messages mostly start with a letter after F; only try
+        # the hex conversion on the others
+        if line[0] < 0x47:
+            digits = line.replace(b' ', b'')
+            if headers:
+                frame = _can_frame(digits)
+                if frame is not None:
+                    if reassemblers is None:
+                        reassemblers = {}
+                    _feed_can(res, reassemblers, frame[0], frame[1])
+                    continue
+            else:
+                data = _hex(digits)
+                if data is not None:
+                    res.payloads.append((None, data))
+                    res.status = OK
+                    continue
+                if len(digits) == 3:
+                    # "014": length of a multi-frame message
+                    length = _hex(b'0' + digits)
+                    if length is not None:
+                        multi_length = (length[0] << 8) | length[1]
+                        multi = bytearray()
+                        continue
+                elif multi is not None and digits[1:2] == b':':
+                    # "0: 49 02 01 ..."
+                    part = _hex(digits[2:])
+                    if part is not None:
+                        multi.extend(part)
+                        continue
+
+        text = line.replace(b' ', b'')
+        if text.startswith(NODATA):
+            res.status = NO_DATA
+        elif text.startswith(ERRORS) or b'ERROR' in text:
+            res.status = ERROR
+            res.error = line.decode('ascii', 'replace')
+        elif text.startswith(IGNORED):
+            continue
+        elif res.status == NO_RESPONSE:
+            res.status = ERROR
+            res.error = line.decode('ascii', 'replace')
+
+    if multi is not None:
+        res.payloads.append((None, bytes(multi[:multi_length])))
+        res.status = OK
+
+    return res
+
+
+def is_bus_error(res):
+    """True for CAN ERROR (the adapter lost the bus)"""
+    return res.error is not None and res.error.replace(' ', '') == 'CANERROR'
+
+
+def _feed_can(res, reassemblers, id, frame):
+    reassembler = reassemblers.get(id)
+    if reassembler is None:
+        reassembler = reassemblers[id] = obd_isotp.Reassembler()
+    payload = reassembler.feed(frame)
+    if payload is not None:
+        res.payloads.append((id, payload))
+        res.status = OK
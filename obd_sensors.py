@@ -22,58 +22,91 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 ###########################################################################
 
+import ast
+import os
+
 def hex_to_int(str):
     return int(str, 16)
 
-def maf(code):
-    code = hex_to_int(code)
-    return code * 0.00132276
-
-def throttle_pos(code):
-    code = hex_to_int(code)
-    return code * 100.0 / 255.0
-
-def intake_m_pres(code): # in kPa
-    code = hex_to_int(code)
-    return code / 0.14504
-  
-def rpm(code):
-    code = hex_to_int(code)
-    return code / 4
-
-def speed(code):
-    code = hex_to_int(code)
-    return code / 1.609
-
-def percent_scale(code):
-    code = hex_to_int(code)
-    return code * 100.0 / 255.0
-
-def timing_advance(code):
-    code = hex_to_int(code)
-    return (code - 128) / 2.0
-
-def sec_to_min(code):
-    code = hex_to_int(code)
-    return code / 60
-
-def temp(code):
-    code = hex_to_int(code)
-    c = code - 40 
-    return 32 + (9 * c / 5) 
-
-def cpass(code):
+#___________________________________________________________
+# Decoders take the data bytes of a response (after mode and PID) as
+# bytes, bytearray or memoryview.
+
+_FORMULA_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant,
+                  ast.Name, ast.Load,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+                  ast.Pow, ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift,
+                  ast.RShift, ast.USub, ast.UAdd, ast.Invert)
+
+class _ByteNames(ast.NodeTransformer):
+    """Rewrites the byte names A, B, C... of a formula as d[0], d[1], d[2]..."""
+
+    def visit_Name(self, node):
+        if len(node.id) != 1 or not 'A' <= node.id <= 'Z':
+            raise ValueError("Unknown name in formula: %s" % node.id)
+        index = ord(node.id) - ord('A')
+        return ast.copy_location(ast.Subscript(
+            value=ast.Name(id='d', ctx=ast.Load()),
+            slice=ast.Constant(value=index), ctx=ast.Load()), node)
+
+def _parse_formula(expr):
+    tree = ast.parse(expr.strip(), mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _FORMULA_NODES):
+            raise ValueError("Unsupported syntax in formula: %s" % expr)
+    return _ByteNames().visit(tree).body
+
+def _compile(body, expr):
+    func = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='d')], vararg=None,
+                           kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]),
+        body=body))
+    ast.fix_missing_locations(func)
+    decoder = eval(compile(func, '<formula %s>' % expr, 'eval'), {'__builtins__': {}})
+    decoder.formula = expr
+    return decoder
+
+def formula(expr):
+    """Compiles a J1979 style formula over the data bytes (A, B, C, ...),
+    e.g. "(256*A+B)/4", into a decoder."""
+    return _compile(_parse_formula(expr), expr)
+
+def fields(spec):
+    """Compiles "name=formula;name=formula" into a decoder returning a dict"""
+    keys = []
+    values = []
+    for part in spec.split(';'):
+        name, expr = part.split('=', 1)
+        keys.append(ast.Constant(value=name.strip()))
+        values.append(_parse_formula(expr))
+    return _compile(ast.Dict(keys=keys, values=values), spec)
+
+def linear(nbytes, scale=1, offset=0, signed=False):
+    """Decoder for an unsigned (or signed) big endian value times scale plus offset"""
+    if nbytes == 1 and not signed:
+        return lambda d: d[0] * scale + offset
+    if nbytes == 2 and not signed:
+        return lambda d: ((d[0] << 8) | d[1]) * scale + offset
+    return lambda d: int.from_bytes(d[:nbytes], 'big', signed=signed) * scale + offset
+
+maf             = linear(2, 0.00132276)     # lb/min
+throttle_pos    = linear(1, 100.0 / 255.0)
+intake_m_pres   = linear(1, 1 / 0.14504)    # in kPa
+rpm             = linear(2, 0.25)
+speed           = linear(1, 1 / 1.609)
+percent_scale   = linear(1, 100.0 / 255.0)
+timing_advance  = formula("(A - 128) / 2.0")
+sec_to_min      = linear(2, 1 / 60.0)
+temp            = formula("32 + 9 * (A - 40) / 5")
+fuel_trim_percent = formula("(A - 128) * 100 / 128")
+
+def cpass(data):
     #fixme
-    return code
+    return bytes(data).hex().upper()
 
-def fuel_trim_percent(code):
-    code = hex_to_int(code)
-    #return (code - 128.0) * 100.0 / 128
-    return (code - 128) * 100 / 128
-
-def dtc_decrypt(code):
-    #first byte is byte after PID and without spaces
-    num = hex_to_int(code[:2]) #A byte
+def dtc_decrypt(data):
+    #first byte is byte after PID
+    num = data[0] #A byte
     res = []
 
     if num & 0x80: # is mil light on
@@ -87,13 +120,13 @@ def dtc_decrypt(code):
     res.append(num)
     res.append(mil)
     
-    numB = hex_to_int(code[2:4]) #B byte
+    numB = data[1] #B byte
       
     for i in range(0,3):
         res.append(((numB>>i)&0x01)+((numB>>(3+i))&0x02))
     
-    numC = hex_to_int(code[4:6]) #C byte
-    numD = hex_to_int(code[6:8]) #D byte
+    numC = data[2] #C byte
+    numD = data[3] #D byte
        
     for i in range(0,7):
         res.append(((numC>>i)&0x01)+(((numD>>i)&0x01)<<1))
@@ -102,94 +135,107 @@ def dtc_decrypt(code):
     
     return res
 
-def hex_to_bitstring(str):
-    bitstring = ''
-    for i in str:
-        # silly type safety, we don't want to eval random stuff
-        if type(i) == type('') or type(i) == type(''): 
-            v = eval("0x%s" % i)
-            if v & 8 :
-                bitstring += '1'
-            else:
-                bitstring += '0'
-            if v & 4:
-                bitstring += '1'
-            else:
-                bitstring += '0'
-            if v & 2:
-                bitstring += '1'
-            else:
-                bitstring += '0'
-            if v & 1:
-                bitstring += '1'
-            else:
-                bitstring += '0'                
-    return bitstring
+DTC_LETTERS = "PCBU"
+
+def dtc_code(value):
+    """Returns the 5 character code ("P0133") of a 2 byte encoded DTC"""
+    return "%s%X%X%X%X" % (DTC_LETTERS[value >> 14], (value >> 12) & 3,
+                            (value >> 8) & 0xF, (value >> 4) & 0xF, value & 0xF)
+
+def bitstring(data):
+    """Bits of the data as a string of '0' and '1', MSB of the first byte first"""
+    return format(int.from_bytes(data, 'big'), '0%db' % (len(data) * 8))
+
+# Decoders that can't be written as formulas, referenced as @name in the
+# PID catalogue
+DECODERS = {
+    'bitstring': bitstring,
+    'dtc_status': dtc_decrypt,
+    'raw': cpass,
+}
+
+PID_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "obd_mode01.txt")
 
 class Sensor:
-    def __init__(self, shortName, sensorName, id, bytesReturned, sensorValueFunction, u):
+    def __init__(self, shortName, sensorName, id, bytesReturned, sensorValueFunction, u,
+                 minimum=None, maximum=None):
         self.shortname = shortName
         self.name   = sensorName
         self.id     = id
         self.length = bytesReturned
         self.value  = sensorValueFunction
         self.unit   = u
+        self.min    = minimum
+        self.max    = maximum
+
+def _number(text):
+    """Min/max column: a number, None if empty (0 is a valid limit)"""
+    return float(text) if text.strip() else None
+
+def decoder(expr):
+    """Compiles the formula column of a catalogue line"""
+    if expr.startswith('@'):
+        return DECODERS[expr[1:]]
+    if '=' in expr:
+        return fields(expr)
+    return formula(expr)
+
+def load_sensors(filename=PID_FILE):
+    """Reads and compiles the PID catalogue. Returns a list of Sensors."""
+    sensors = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            pid, length, shortname, name, expr, unit, minimum, maximum = line.split('|')
+            sensors.append(Sensor(shortname, name, int(pid, 16), int(length), decoder(expr),
+                                  unit, _number(minimum), _number(maximum)))
+    return sensors
+
+# SENSORS (the Mode 01 catalogue), ENHANCED (the Mode 22 channels of
+# obd_uds) and SENSOR_TABLE (sensor index -> Sensor, both kinds) are loaded
+# on first use, see __getattr__
+def _load():
+    global SENSORS, ENHANCED, SENSOR_TABLE
+    import obd_uds
+    sensors = load_sensors()
+    enhanced = obd_uds.load_definitions()
+    SENSOR_TABLE = dict((sensor.id, sensor) for sensor in sensors + enhanced)
+    SENSORS = sensors
+    ENHANCED = enhanced
+
+def __getattr__(name):
+    if name in ('SENSORS', 'ENHANCED', 'SENSOR_TABLE'):
+        _load()
+        return globals()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-SENSORS = [
-    Sensor("pids_00"               , "Supported PIDs [1-32]"    	, 0x00, 4, hex_to_bitstring ,""       ),
-    Sensor("dtc_status"            , "S-S DTC Cleared"				, 0x01, 4, dtc_decrypt      ,""       ),
-    Sensor("dtc_ff"                , "DTC C-F-F"					, 0x02, 2, cpass            ,""       ),
-    Sensor("fuel_status"           , "Fuel System Stat"				, 0x03, 2, cpass            ,""       ),
-    Sensor("load"                  , "Calc Load Value"				, 0x04, 1, percent_scale    ,""       ),
-    Sensor("temp"                  , "Coolant Temp"					, 0x05, 1, temp             ,"F"      ),
-    Sensor("short_term_fuel_trim_1", "S-T Fuel Trim"				, 0x06, 1, fuel_trim_percent,"%"      ),
-    Sensor("long_term_fuel_trim_1" , "L-T Fuel Trim"				, 0x07, 1, fuel_trim_percent,"%"      ),
-    Sensor("short_term_fuel_trim_2", "S-T Fuel Trim"				, 0x08, 1, fuel_trim_percent,"%"      ),
-    Sensor("long_term_fuel_trim_2" , "L-T Fuel Trim"				, 0x09, 1, fuel_trim_percent,"%"      ),
-    Sensor("fuel_pressure"         , "FuelRail Pressure"			, 0x0A, 1, cpass            ,""       ),
-    Sensor("manifold_pressure"     , "Intk Manifold"				, 0x0B, 1, intake_m_pres    ,"psi"    ),
-    Sensor("rpm"                   , "Engine RPM"					, 0x0C, 2, rpm              ,""       ),
-    Sensor("speed"                 , "Vehicle Speed"				, 0x0D, 1, speed            ,"MPH"    ),
-    Sensor("timing_advance"        , "Timing Advance"				, 0x0E, 1, timing_advance   ,"degrees"),
-    Sensor("intake_air_temp"       , "Intake Air Temp"				, 0x0F, 1, temp             ,"F"      ),
-    Sensor("maf"                   , "AirFlow Rate(MAF)"			, 0x10, 2, maf              ,"lb/min" ),
-    Sensor("throttle_pos"          , "Throttle Position"			, 0x11, 1, throttle_pos     ,"%"      ),
-    Sensor("secondary_air_status"  , "2nd Air Status"				, 0x12, 1, cpass            ,""       ),
-    Sensor("o2_sensor_positions"   , "Loc of O2 sensors"			, 0x13, 1, cpass            ,""       ),
-    Sensor("o211"                  , "O2 Sensor: 1 - 1"				, 0x14, 2, fuel_trim_percent,"%"      ),
-    Sensor("o212"                  , "O2 Sensor: 1 - 2"				, 0x15, 2, fuel_trim_percent,"%"      ),
-    Sensor("o213"                  , "O2 Sensor: 1 - 3"				, 0x16, 2, fuel_trim_percent,"%"      ),
-    Sensor("o214"                  , "O2 Sensor: 1 - 4"				, 0x17, 2, fuel_trim_percent,"%"      ),
-    Sensor("o221"                  , "O2 Sensor: 2 - 1"				, 0x18, 2, fuel_trim_percent,"%"      ),
-    Sensor("o222"                  , "O2 Sensor: 2 - 2"				, 0x19, 2, fuel_trim_percent,"%"      ),
-    Sensor("o223"                  , "O2 Sensor: 2 - 3"				, 0x1A, 2, fuel_trim_percent,"%"      ),
-    Sensor("o224"                  , "O2 Sensor: 2 - 4"				, 0x1B, 2, fuel_trim_percent,"%"      ),
-    Sensor("obd_standard"          , "OBD Designation"				, 0x1C, 1, cpass            ,""       ),
-    Sensor("o2_sensor_position_b"  , "Loc of O2 sensor" 			, 0x1D, 1, cpass            ,""       ),
-    Sensor("aux_input"             , "Aux input status"				, 0x1E, 1, cpass            ,""       ),
-    Sensor("engine_time"           , "Engine Start MIN"				, 0x1F, 2, sec_to_min       ,"min"    ),
-    # 0x20 = PIDs supported [0x21 - 0x40]
-    Sensor("pids_20"               , "Supported PIDs [33-64]"    	, 0x20, 4, hex_to_bitstring ,""       ),
-    # Sensor("mil_distance"          , "Distance traveled with MIL"   , 0x21, 2, None             ,"km"     ),
-    Sensor("fuel_level"            , "Fuel tank level input"		, 0x2F, 1, percent_scale    ,"%"      ),
-    Sensor("pids_40"               , "Supported PIDs [65-96]"    	, 0x40, 4, hex_to_bitstring ,""       ),
-    Sensor("engine_mil_time"       , "Engine Run MIL"				, 0x4D, 2, sec_to_min       ,"min"    ),
-    Sensor("pids_60"               , "Supported PIDs [97-128]"    	, 0x60, 4, hex_to_bitstring ,""       ),
-    Sensor("pids_80"               , "Supported PIDs [129-160]"    	, 0x80, 4, hex_to_bitstring ,""       ),
-    ]
-     
 def get_sensor(id):
-    for sensor in SENSORS:
-        if sensor.id == id:
+    try:
+        return SENSOR_TABLE.get(id)
+    except NameError:
+        _load()
+        return SENSOR_TABLE.get(id)
+
+def find_sensor(shortname):
+    """Returns the sensor (Mode 01 or Mode 22) with the given short name"""
+    try:
+        sensors = SENSOR_TABLE.values()
+    except NameError:
+        _load()
+        sensors = SENSOR_TABLE.values()
+    for sensor in sensors:
+        if sensor.shortname == shortname:
             return sensor
-    
     return None
     
 #___________________________________________________________
 
 def test():
-    for i in SENSORS:
-        print((i.name, i.value("F")))
+    for i in __getattr__('SENSORS'):
+        print((i.name, i.value(b"\xff" * i.length)))
 
 if __name__ == "__main__":
     test()
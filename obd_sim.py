@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_sim.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""A simulated car behind the ELM327 emulator, for trying things out and
+for testing without a vehicle.
+
+SimulatedTransport answers the CAN frames of ELMEmulatorTransport from a
+few SimulatedECUs (Mode 01 PIDs, the VIN, Mode 22 DIDs, dynamically
+defined DIDs and their periodic messages), with a reply latency like a
+real ECU. OBDPort uses it for the port name "sim":
+
+    python obd_didscan.py --port sim
+"""
+
+import heapq
+import time
+
+import obd_isotp
+from obd_transport import ELMEmulatorTransport
+
+FUNCTIONAL = 0x7DF
+LATENCY = 0.003  # s from request to answer
+S3 = 5.0  # s without requests before an ECU falls back to the default session
+PERIODS = {0x01: 1.0, 0x02: 0.3, 0x03: 0.025}  # 0x2A transmission mode -> s
+
+# Negative response codes (see obd_uds)
+SERVICE_NOT_SUPPORTED = 0x11
+INCORRECT_LENGTH = 0x13
+REQUEST_OUT_OF_RANGE = 0x31
+SECURITY_ACCESS_DENIED = 0x33
+NOT_IN_SESSION = 0x7F
+
+OBD_DID = 0xF400  # Mode 01 PID nn as a DID
+DYNAMIC_DIDS = range(0xF200, 0xF400)
+PERIODIC_DID = 0xF200
+
+
+#__________________________________________________________________________
+
+
+class SimulatedECU:
+    """ One ECU: answers requests to id - 8 and functional ones """
+
+    def __init__(self, id, pids=None, dids=None, vin=None, protected=(), max_dids=1,
+                 latency=LATENCY, dynamic=False):
+        self.id = id  # response id, e.g. 0x7E8
+        self.pids = pids or {}  # Mode 01 PID -> data
+        self.dids = dids or {}  # Mode 22 DID -> data
+        self.vin = vin
+        self.protected = set(protected)  # DIDs that need security access
+        self.max_dids = max_dids  # DIDs per Mode 22 request
+        self.latency = latency
+        self.dynamic = dynamic  # 0x2C and 0x2A, in the extended session
+        self.session = 0x01
+        self.defined = {}  # dynamic DID -> [(source DID, position, size)]
+        self.periodic = {}  # DID low byte -> [period, next due]
+        self.requests = 0
+        self._last_request = 0.0
+
+    def answer(self, payload, functional):
+        """Returns the response payload, or None to stay silent"""
+        self.requests += 1
+        self._check_session(time.time())
+        self._last_request = time.time()
+        mode = payload[0]
+        if mode == 0x01 and len(payload) >= 2:
+            pid = payload[1]
+            if pid % 0x20 == 0:
+                bits = 0
+                for p in self.pids:
+                    if pid < p <= pid + 0x20:
+                        bits |= 0x80000000 >> (p - pid - 1)
+                    elif p > pid + 0x20:
+                        bits |= 1  # next range supported
+                return bits and bytes([0x41, pid]) + bits.to_bytes(4, 'big') or None
+            if pid in self.pids:
+                return bytes([0x41, pid]) + self.pids[pid]
+            return None
+        if mode == 0x09 and payload[1:2] == b'\x02' and self.vin:
+            return b'\x49\x02\x01' + self.vin.encode('ascii')
+        if mode == 0x22 and not functional:
+            return self._read_dids(payload)
+        if mode == 0x10 and len(payload) == 2 and not functional:
+            self.session = payload[1]
+            return bytes([0x50, payload[1], 0x00, 0x32, 0x01, 0xF4])
+        if mode == 0x2C and self.dynamic and not functional:
+            return self._define(payload)
+        if mode == 0x2A and self.dynamic and not functional:
+            return self._read_periodic(payload)
+        if mode == 0x3E and len(payload) == 2:
+            return payload[1] == 0x00 and b'\x7E\x00' or None
+        if functional:
+            return None
+        return bytes([0x7F, mode, SERVICE_NOT_SUPPORTED])
+
+    def _data(self, did):
+        if did in self.dids:
+            return self.dids[did]
+        if did & 0xFF00 == OBD_DID and did & 0xFF in self.pids:
+            return self.pids[did & 0xFF]
+        if did in self.defined:
+            data = bytearray()
+            for source, position, size in self.defined[did]:
+                value = self._data(source) or b''
+                data += value[position - 1:position - 1 + size]
+            return bytes(data)
+        return None
+
+    def _define(self, payload):
+        if self.session != 0x03:
+            return bytes([0x7F, 0x2C, NOT_IN_SESSION])
+        if len(payload) < 4:
+            return bytes([0x7F, 0x2C, INCORRECT_LENGTH])
+        did = (payload[2] << 8) | payload[3]
+        if did not in DYNAMIC_DIDS:
+            return bytes([0x7F, 0x2C, REQUEST_OUT_OF_RANGE])
+        if payload[1] == 0x03:
+            self.defined.pop(did, None)
+            return bytes([0x6C, 0x03]) + payload[2:4]
+        if payload[1] != 0x01 or (len(payload) - 4) % 4:
+            return bytes([0x7F, 0x2C, INCORRECT_LENGTH])
+        sources = []
+        for i in range(4, len(payload), 4):
+            source = (payload[i] << 8) | payload[i + 1]
+            if self._data(source) is None:
+                return bytes([0x7F, 0x2C, REQUEST_OUT_OF_RANGE])
+            sources.append((source, payload[i + 2], payload[i + 3]))
+        self.defined.setdefault(did, []).extend(sources)
+        return bytes([0x6C, 0x01]) + payload[2:4]
+
+    def _check_session(self, now):
+        if self.session != 0x01 and now - self._last_request > S3:
+            # Back in the default session: dynamic DIDs and periodic data end
+            self.session = 0x01
+            self.defined = {}
+            self.periodic = {}
+
+    def _read_periodic(self, payload):
+        if self.session != 0x03:
+            return bytes([0x7F, 0x2A, NOT_IN_SESSION])
+        if len(payload) < 2:
+            return bytes([0x7F, 0x2A, INCORRECT_LENGTH])
+        if payload[1] == 0x04:
+            for did in payload[2:] or list(self.periodic):
+                self.periodic.pop(did, None)
+            return b'\x6A'
+        period = PERIODS.get(payload[1])
+        if period is None or len(payload) < 3:
+            return bytes([0x7F, 0x2A, REQUEST_OUT_OF_RANGE])
+        for did in payload[2:]:
+            data = self._data(PERIODIC_DID | did)
+            if data is None or len(data) > 6:
+                return bytes([0x7F, 0x2A, REQUEST_OUT_OF_RANGE])
+        for did in payload[2:]:
+            self.periodic[did] = [period, time.time() + self.latency]
+        return b'\x6A'
+
+    def next_periodic(self):
+        """When the next periodic message is due, None if none"""
+        return self.periodic and min(due for period, due in self.periodic.values()) or None
+
+    def periodic_frames(self, now):
+        """Returns the periodic messages due by now as (due, frame)"""
+        self._check_session(now)
+        frames = []
+        for did, schedule in sorted(self.periodic.items()):
+            period, due = schedule
+            if due > now:
+                continue
+            data = self._data(PERIODIC_DID | did) or b''
+            frames.append((due, bytes([1 + len(data), did]) + data))
+            due += period
+            if due <= now:
+                due = now + period  # missed ones are not sent late
+            schedule[1] = due
+        return frames
+
+    def _read_dids(self, payload):
+        dids = [(payload[i] << 8) | payload[i + 1] for i in range(1, len(payload) - 1, 2)]
+        if not dids or len(payload) % 2 == 0 or len(dids) > self.max_dids:
+            return bytes([0x7F, 0x22, INCORRECT_LENGTH])
+        out = bytearray([0x62])
+        for did in dids:
+            data = self._data(did)
+            if data is not None:
+                out += did.to_bytes(2, 'big') + data
+        if len(out) > 1:
+            return bytes(out)
+        if any(did in self.protected for did in dids):
+            return bytes([0x7F, 0x22, SECURITY_ACCESS_DENIED])
+        return bytes([0x7F, 0x22, REQUEST_OUT_OF_RANGE])
+
+
+def default_ecus():
+    """An engine and a transmission ECU with some Mode 22 data"""
+    vin = "1FTFW1E50NFA00001"
+    engine = SimulatedECU(0x7E8, {
+        0x04: b'\x40', 0x05: b'\x7B', 0x0C: b'\x1A\xF8', 0x0D: b'\x32',
+        0x10: b'\x01\x90', 0x1F: b'\x01\x2C', 0x2F: b'\x80',
+    }, {
+        0xF190: vin.encode('ascii'),
+        0xF187: b'NZ6A-12A650-AB',
+        0xF18C: b'\x00\x12\x34\x56',
+        0x1E1C: b'\x05\x00',
+        0xF40D: b'\x32',
+        0x0579: b'\x01\x2C',
+        0x4AB0: b'\x11\x22',
+    }, vin, protected=(0x4AC0,), max_dids=8, dynamic=True)
+    transmission = SimulatedECU(0x7E9, {
+        0x0D: b'\x32',
+    }, {
+        0xF190: vin.encode('ascii'),
+        0x1E1C: b'\x05\x00',
+        0x1E12: b'\x03',
+    }, max_dids=1, latency=LATENCY * 2)
+    return [engine, transmission]
+
+
+class SimulatedTransport(ELMEmulatorTransport):
+    """ ELM327 emulator in front of simulated ECUs (11 bit CAN) """
+
+    def __init__(self, ecus=None):
+        super(SimulatedTransport, self).__init__()
+        self.ecus = ecus is not None and ecus or default_ecus()
+        self._queue = []  # (due time, seq, id, data)
+        self._seq = 0
+        self._rx = {}  # (tx id, ecu id) -> Reassembler of multi-frame requests
+
+    def Connect(self, address, **kwargs):
+        self._OnConnected()
+        return True
+
+    def Close(self):
+        self._OnDisconnected()
+
+    def Describe(self):
+        return "ELM327 simulator"
+
+    def _Push(self, delay, id, data):
+        self._seq += 1
+        heapq.heappush(self._queue, (time.time() + delay, self._seq, id, data))
+
+    def _SendFrame(self, id, data):
+        for ecu in self.ecus:
+            if id != FUNCTIONAL and id != ecu.id - 8:
+                continue
+            r = self._rx.setdefault((id, ecu.id), obd_isotp.Reassembler())
+            payload = r.feed(data)
+            if r.need_flow_control:
+                r.need_flow_control = False
+                self._Push(0, ecu.id, obd_isotp.flow_control())
+            if payload is None:
+                continue
+
+            answer = ecu.answer(payload, id == FUNCTIONAL)
+            if answer is None:
+                continue
+            # The tester's flow control is not waited for
+            for i, frame in enumerate(obd_isotp.segment(answer)):
+                self._Push(ecu.latency + i * 0.0005, ecu.id, frame)
+
+    def _Periodic(self, now):
+        """Queues the periodic messages of the ECUs due by now"""
+        for ecu in self.ecus:
+            for due, frame in ecu.periodic_frames(now):
+                self._seq += 1
+                heapq.heappush(self._queue, (due, self._seq, ecu.id, frame))
+
+    def _NextDue(self):
+        dues = [ecu.next_periodic() for ecu in self.ecus]
+        if self._queue:
+            dues.append(self._queue[0][0])
+        dues = [due for due in dues if due is not None]
+        return dues and min(dues) or None
+
+    def _RecvFrame(self, timeout):
+        deadline = time.time() + max(timeout, 0)
+        while True:
+            now = time.time()
+            self._Periodic(now)
+            if self._queue and self._queue[0][0] <= now:
+                due, seq, id, data = heapq.heappop(self._queue)
+                return (due, id, data)
+            due = self._NextDue()
+            wait = deadline - now
+            if due is not None:
+                wait = min(wait, due - now)
+            if wait <= 0 and (due is None or due > deadline):
+                return None
+            time.sleep(max(wait, 0))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_term.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Terminal dashboard for headless units (no wx, no display server).
+
+Sensors are read by a background SensorPoller; the screen only shows
+cached values and rewrites the lines whose text changed.
+
+    ./obd_term.py [port]
+
+Keys: left/right (or p/n) change page, d toggles the trouble codes,
+r re-reads them, q quits.
+"""
+
+import curses
+import sys
+import threading
+import time
+
+from obd_capture import OBD_Capture
+from obd_poller import SensorPoller
+from obd2_codes import pcodes
+
+TICK = 200  # ms between screen updates when no key is pressed
+DTC_KEY = 'dtc'
+
+
+#__________________________________________________________________________
+
+
+def format_value(result):
+    if result is None:
+        return "--", ""
+    name, value, unit = result
+    if type(value) == float:
+        value = "%.2f" % round(value, 3)
+    return str(value), unit
+
+
+class TerminalDashboard:
+    """ Curses dashboard: one line per sensor, paginated """
+
+    def __init__(self, port_name=None, compact=False, tune_timeouts=False, periodic=False):
+        self.port_name = port_name
+        self.compact = compact
+        self.tune_timeouts = tune_timeouts
+        self.periodic = periodic
+        self.capture = OBD_Capture()
+        self.poller = None
+        self.sensors = []
+        self.status = "Connecting..."
+        self.page = 0
+        self.show_dtc = False
+        self._lines = {}  # screen row -> text last drawn
+        self._size = 1  # sensor lines per page
+        self._quit = False
+
+    #______________________________________________________________________
+    # Connection (background thread)
+
+    def connect(self):
+        while not self._quit:
+            ports = self.port_name and [self.port_name] or self.capture.scan_ports()
+            if not ports:
+                self.status = "No ports found, retrying..."
+            else:
+                self.status = "Connecting to %s..." % ports[0]
+                if self.capture.connect(ports[0], self.compact, self.tune_timeouts):
+                    break
+                self.status = "Could not connect to %s, retrying..." % ports[0]
+            time.sleep(1)
+
+        if self._quit:
+            return
+
+        port = self.capture.is_connected()
+        self.status = "Reading supported sensors..."
+        self.sensors = self.capture.read_supported_sensors()
+        self.poller = SensorPoller(port, periodic=self.periodic)
+        self.poller.start()
+        self.select_page(0)
+        self.read_dtc()
+        self.status = "Connected"
+
+    def read_dtc(self):
+        if self.poller:
+            self.poller.request(DTC_KEY, self.capture.is_connected().get_dtc)
+
+    #______________________________________________________________________
+    # Paging
+
+    def page_size(self, height):
+        # title, separator, separator, stats, help
+        return max(height - 5, 1)
+
+    def pages(self, size):
+        return max((len(self.sensors) + size - 1) // size, 1)
+
+    def select_page(self, page, size=None):
+        if size is None:
+            size = self._size
+        self.page = min(max(page, 0), self.pages(size) - 1)
+        if self.poller:
+            start = self.page * size
+            visible = [i for i, s in self.sensors[start:start + size]]
+            adjacent = [i for i, s in self.sensors[start + size:start + 2 * size]]
+            self.poller.set_pages(visible, adjacent)
+
+    #______________________________________________________________________
+    # Drawing
+
+    def put(self, screen, row, text, attr=0):
+        """Writes a whole line, but only if its text changed"""
+        height, width = screen.getmaxyx()
+        if row >= height:
+            return
+        text = text[:width - 1].ljust(width - 1)
+        if self._lines.get(row) == (text, attr):
+            return
+        self._lines[row] = (text, attr)
+        screen.addstr(row, 0, text, attr)
+
+    def body_lines(self, size):
+        lines = []
+        values = self.poller and self.poller.values
+        if self.show_dtc:
+            codes = values and values.get(DTC_KEY)
+            if codes is None:
+                lines.append("  Reading trouble codes...")
+            elif not codes:
+                lines.append("  No trouble codes")
+            for status, code in codes or []:
+                lines.append("  %-6s %-8s %s" % (code, status, pcodes.get(code, "Unknown")))
+            return lines[:size]
+
+        start = self.page * size
+        for index, sensor in self.sensors[start:start + size]:
+            value, unit = format_value(values and values.get(index))
+            lines.append("  %-32s %14s %s" % (sensor.name, value, unit or sensor.unit))
+        return lines
+
+    def stats_line(self):
+        poller = self.poller
+        if poller is None:
+            return " " + self.status
+        codes = poller.values.get(DTC_KEY)
+        return (" %d reads, %d pushed (%.1f/s)  latency %.0f ms  errors %d  DTCs %s" %
+                (poller.polls, poller.pushed, poller.rate(), poller.latency * 1000,
+                 poller.errors, codes is None and "?" or len(codes)))
+
+    def draw(self, screen):
+        height, width = screen.getmaxyx()
+        size = self.page_size(height)
+        if size != self._size:
+            self._size = size
+            self.select_page(self.page, size)
+
+        port = self.capture.is_connected()
+        title = " pyOBD  %s  %s" % (port and port.PortName or "-", port and port.ELMver or "")
+        if self.show_dtc:
+            title += "   [trouble codes]"
+        else:
+            title += "   page %d/%d" % (self.page + 1, self.pages(size))
+        self.put(screen, 0, title, curses.A_REVERSE)
+        self.put(screen, 1, "-" * width)
+
+        lines = self.body_lines(size)
+        for i in range(size):
+            self.put(screen, 2 + i, i < len(lines) and lines[i] or "")
+
+        self.put(screen, 2 + size, "-" * width)
+        self.put(screen, 3 + size, self.stats_line())
+        self.put(screen, 4 + size, " [<-/->] page  [d] trouble codes  [r] re-read codes  [q] quit",
+                 curses.A_DIM)
+        screen.refresh()
+
+    #______________________________________________________________________
+
+    def run(self, screen):
+        curses.curs_set(0)
+        screen.timeout(TICK)
+        self._size = self.page_size(screen.getmaxyx()[0])
+
+        threading.Thread(target=self.connect, daemon=True).start()
+
+        while True:
+            self.draw(screen)
+            key = screen.getch()
+            if key in (ord('q'), ord('Q')):
+                break
+            elif key in (curses.KEY_RIGHT, ord('n'), ord(' ')):
+                self.select_page(self.page + 1)
+            elif key in (curses.KEY_LEFT, ord('p')):
+                self.select_page(self.page - 1)
+            elif key in (ord('d'), ord('D')):
+                self.show_dtc = not self.show_dtc
+            elif key in (ord('r'), ord('R')):
+                self.read_dtc()
+            elif key == curses.KEY_RESIZE:
+                self._lines = {}
+                screen.clear()
+
+        self._quit = True
+        if self.poller:
+            self.poller.stop()
+            self.poller.join(2)
+        port = self.capture.is_connected()
+        if port:
+            port.close()  # also saves tuned timeouts
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Terminal OBD-II dashboard")
+    parser.add_argument("port", nargs='?', help="serial port, bluetooth MAC or SocketCAN interface")
+    parser.add_argument("--compact", action="store_true",
+                        help="responses without spaces/linefeeds (fewer bytes per read)")
+    parser.add_argument("--tune", action="store_true",
+                        help="tune the adapter timeout per request (kept per vehicle)")
+    parser.add_argument("--periodic", action="store_true",
+                        help="let the ECUs send the sensors shown (UDS 0x2A) where they can")
+    parser.add_argument("--log", default=os.devnull,
+                        help="file for the adapter debug output (default: discarded)")
+    args = parser.parse_args()
+
+    # OBDPort prints its debug output; keep it off the screen
+    stdout = sys.stdout
+    sys.stdout = open(args.log, 'a')
+    try:
+        curses.wrapper(TerminalDashboard(args.port, args.compact, args.tune,
+                                          args.periodic).run)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_timing.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Per vehicle tuning of the ELM327 response timeout (ATST).
+
+After the last ECU reply the adapter waits the whole timeout before it
+prints the prompt; on a fast CAN ECU that wait is most of every request.
+TimeoutTuner learns how long each request really takes (per PID and
+addressed ECU), and suggests an ATST value with a safety margin. NO DATA
+from a request that has answered before is treated as a missed response:
+the timeout for that request is backed off, and the caller retries.
+"""
+
+import json
+import math
+import os
+from collections import deque
+
+TIMING_FILE = os.path.join(os.path.expanduser('~'), '.pyobd_timing.json')
+
+ST_UNIT = 0.004          # ATST counts in 4 ms units
+DEFAULT_ST = 0x32        # adapter default (200 ms)
+MAX_ST = 0xFF
+MIN_SAMPLES = 3          # answers needed before a request is tuned
+WINDOW = 16              # recent answers kept per request
+MARGIN = 2.0             # timeout = slowest recent answer * MARGIN + PAD
+PAD = 0.008
+MAX_BACKOFF = 8.0
+BACKOFF_DECAY = 0.95     # per answer, back towards 1.0
+
+# Timeouts are rounded up to one of these (4 ms units), so requests with
+# similar timing share a value and ATST is not re-sent for every PID
+LADDER = (2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, MAX_ST)
+
+
+#__________________________________________________________________________
+
+
+def request_key(header, cmd):
+    """Key of a request: the addressed ECU and the request itself"""
+    return "%s|%s" % (header is None and "default" or "%X" % header, cmd)
+
+
+class TimeoutTuner:
+    """ Learned response times of one vehicle """
+
+    def __init__(self, vehicle, path=TIMING_FILE):
+        self.vehicle = vehicle
+        self.path = path
+        self._samples = {}  # key -> deque of response times (s)
+        self._backoff = {}  # key -> timeout multiplier after misses
+        self.misses = 0
+        self.dirty = False
+
+    def record(self, key, elapsed):
+        """Records the time an answered request took (send to last reply)"""
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=WINDOW)
+        samples.append(elapsed)
+        backoff = self._backoff.get(key)
+        if backoff is not None:
+            backoff *= BACKOFF_DECAY
+            if backoff <= 1.0:
+                del self._backoff[key]
+            else:
+                self._backoff[key] = backoff
+        self.dirty = True
+
+    def missed(self, key):
+        """Reports NO DATA. Returns True if the request has answered before,
+        i.e. the timeout was probably too short and it is worth a retry."""
+        if key not in self._samples:
+            return False
+        self._backoff[key] = min(self._backoff.get(key, 1.0) * 2, MAX_BACKOFF)
+        self.misses += 1
+        self.dirty = True
+        return True
+
+    def timeout(self, key):
+        """Returns the ATST value (4 ms units) for a request, or None while
+        it is still being learned (use the adapter's adaptive timing)"""
+        samples = self._samples.get(key)
+        if samples is None or len(samples) < MIN_SAMPLES:
+            return None
+
+        t = (max(samples) * MARGIN + PAD) * self._backoff.get(key, 1.0)
+        units = int(math.ceil(t / ST_UNIT))
+        for step in LADDER:
+            if units <= step:
+                return step
+        return MAX_ST
+
+    def summary(self):
+        tuned = [self.timeout(key) for key in self._samples]
+        tuned = [t for t in tuned if t is not None]
+        return ("%d requests tuned, ATST %s, %d misses" %
+                (len(tuned), tuned and "%d-%d ms" % (min(tuned) * 4, max(tuned) * 4) or "-",
+                 self.misses))
+
+    #______________________________________________________________________
+    # Persistence: {vehicle: {key: [slowest response (s), backoff]}}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f).get(self.vehicle, {})
+        except (IOError, OSError, ValueError):
+            return False
+
+        for key, (elapsed, backoff) in stored.items():
+            self._samples[key] = deque([elapsed] * MIN_SAMPLES, maxlen=WINDOW)
+            if backoff > 1.0:
+                self._backoff[key] = backoff
+        self.dirty = False
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            stored = {}
+
+        stored[self.vehicle] = dict(
+            (key, [max(samples), self._backoff.get(key, 1.0)])
+            for key, samples in self._samples.items() if len(samples) >= MIN_SAMPLES)
+        with open(self.path, 'w') as f:
+            json.dump(stored, f, indent=1, sort_keys=True)
+        self.dirty = False
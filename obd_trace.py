@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_trace.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Bounded trace log of the adapter traffic and program messages.
+
+Messages go into a ring buffer of fixed size, so a session of any length
+keeps the same memory. They are stored as the format string and its
+arguments and only formatted when shown or exported; messages below the
+log level are dropped before anything is formatted.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+TRACE_SIZE = 5000  # messages kept
+
+DEBUG = 1
+WARNING = 2
+ERROR = 3
+LEVEL_NAMES = {DEBUG: "Debug", WARNING: "Warning", ERROR: "Error"}
+
+
+#__________________________________________________________________________
+
+
+class TraceLog:
+    """ Ring buffer of (time, level, format, args).
+
+    Written by any thread, read by the UI at its own pace (see
+    MonitorTable), oldest messages first."""
+
+    def __init__(self, size=TRACE_SIZE, level=DEBUG):
+        self.level = level  # lowest level kept
+        self._lock = threading.Lock()
+        self._ring = [None] * size
+        self._start = 0  # index of the oldest message
+        self._count = 0
+        self.version = 0  # bumped on every message
+        self.dropped = 0  # messages pushed out of the ring
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def add(self, level, message, args=()):
+        """Stores a message ("format", args). Returns False if its level is
+        disabled."""
+        if level < self.level:
+            return False
+
+        entry = (time.time(), level, message, args)
+        with self._lock:
+            size = len(self._ring)
+            if self._count < size:
+                self._ring[(self._start + self._count) % size] = entry
+                self._count += 1
+            else:
+                self._ring[self._start] = entry
+                self._start = (self._start + 1) % size
+                self.dropped += 1
+            self.version += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._ring = [None] * len(self._ring)
+            self._start = 0
+            self._count = 0
+            self.version += 1
+
+    def __len__(self):
+        return self._count
+
+    def row(self, index):
+        """Returns (time, level name, message) of a row, oldest first, or None"""
+        with self._lock:
+            if index >= self._count:
+                return None
+            entry = self._ring[(self._start + index) % len(self._ring)]
+        return format_entry(entry)
+
+    def entries(self):
+        with self._lock:
+            size = len(self._ring)
+            return [self._ring[(self._start + i) % size] for i in range(self._count)]
+
+    def export(self, f):
+        """Writes the messages to an open text file, one per line"""
+        for entry in self.entries():
+            f.write("%s\t%s\t%s\n" % format_entry(entry))
+
+
+class AdapterText:
+    """ Adapter text (bytes or str) for a message argument, escaped only
+    when the message is formatted """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = isinstance(text, bytearray) and bytes(text) or text
+
+    def __str__(self):
+        text = self.text
+        if isinstance(text, bytes):
+            text = text.decode('ascii', 'replace')
+        return text.replace('\n', '').replace('\r', '\\r')
+
+
+def format_message(message, args):
+    if not args:
+        return message
+    try:
+        return message % args
+    except (TypeError, ValueError):
+        return "%s %r" % (message, args)
+
+
+def format_entry(entry):
+    t, level, message, args = entry
+    return (datetime.fromtimestamp(t).strftime("%H:%M:%S.%f"),
+            LEVEL_NAMES.get(level, str(level)), format_message(message, args))
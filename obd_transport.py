@@ -25,9 +25,15 @@
 
 from enum import Enum
 import re
+import select
+import socket
+import struct
+import time
 
 import serial
 
+import obd_isotp
+
 HAS_PYBLUEZ = True
 try:
     import bluetooth as bt
@@ -42,9 +48,19 @@ def is_mac_address(str):
     return re.match("[0-9a-f]{2}([:])[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$", str.lower())
 
 
+def is_socketcan_interface(str):
+    return re.match("^(v|sl)?can[0-9]+$", str)
+
+
+def is_simulator(str):
+    return str == "sim"
+
+
 class TransportType(Enum):
     SERIAL = 0
     BLUETOOTH = 1
+    SOCKETCAN = 2
+    SIMULATOR = 3
 
 
 class OBDTransport:
@@ -81,6 +97,13 @@ class OBDTransport:
     def Send(self, data):
         raise NotImplementedError()
 
+    def HasRawFrames(self):
+        """True if RecvFrames can be used instead of parsing monitor text"""
+        return False
+
+    def RecvFrames(self, timeout=None):
+        raise NotImplementedError()
+
 
 class BluetoothTransport(OBDTransport):
     def __init__(self):
@@ -123,23 +146,539 @@ class BluetoothTransport(OBDTransport):
 
         return self._socket.send(data)
 
+    def Close(self):
+        if self._connected:
+            self._socket.close()
+        self._OnDisconnected()
+
 
 class SerialTransport(OBDTransport):
     def Connect(self, address, **kwargs):
         try:
-            self._port = serial.Serial(address, kwargs['baud'], kwargs['parity'],
-                                    kwargs['stopbits'], kwargs['bytesize'],
-                                    kwargs['timeout'])
+            self._port = serial.Serial(address, kwargs.get('baud', 38400),
+                                    kwargs.get('bytesize', serial.EIGHTBITS),
+                                    kwargs.get('parity', serial.PARITY_NONE),
+                                    kwargs.get('stopbits', serial.STOPBITS_ONE),
+                                    kwargs.get('timeout', 2))
+            self._OnConnected()
         except serial.SerialException as e:
+            self._error = str(e)
             return False
         
         return True
 
+    def Close(self):
+        if self._connected:
+            self._port.close()
+        self._OnDisconnected()
+
+    def Recv(self, len):
+        if not self._connected:
+            raise IOError("Not connected")
+
+        # Block (up to the timeout) for the first byte, then take whatever
+        # else is already buffered, like a socket recv would.
+        data = self._port.read(1)
+        if data:
+            data += self._port.read(min(self._port.in_waiting, len - 1))
+        return data
+
+    def Send(self, data):
+        if not self._connected:
+            raise IOError("Not connected")
+
+        return self._port.write(data)
+
+
+class CANSocket:
+    """ Thin wrapper around a raw SocketCAN socket """
+
+    FRAME = struct.Struct("=IB3x8s")
+
+    def __init__(self, iface):
+        self.iface = iface
+        self._socket = socket.socket(socket.PF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        self._socket.bind((iface,))
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def set_filters(self, filters):
+        """Sets kernel receive filters as a list of (id, mask) pairs"""
+        packed = b''.join(struct.pack("=II", id, mask) for id, mask in filters)
+        self._socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, packed)
+
+    def send(self, id, data):
+        if id > 0x7FF:
+            id |= socket.CAN_EFF_FLAG
+        self._socket.send(self.FRAME.pack(id, len(data), bytes(data).ljust(8, b'\x00')))
+
+    def recv(self, timeout=None):
+        """Returns the next frame as (timestamp, id, data) or None on timeout"""
+        if timeout is not None:
+            r, w, x = select.select([self._socket], [], [], max(timeout, 0))
+            if not r:
+                return None
+
+        frame = self._socket.recv(self.FRAME.size)
+        id, dlc, data = self.FRAME.unpack(frame)
+        if id & socket.CAN_EFF_FLAG:
+            id &= socket.CAN_EFF_MASK
+        else:
+            id &= socket.CAN_SFF_MASK
+        return (time.time(), id, data[:dlc])
+
+    def close(self):
+        self._socket.close()
+
+
+class ELMEmulatorTransport(OBDTransport):
+    """ Speaks the ELM327 text protocol on top of raw CAN frame access.
+
+    OBDPort drives this exactly like a real adapter, while the ISO-TP framing
+    and response collection are done here. Subclasses provide _SendFrame and
+    _RecvFrame."""
+
+    VERSION = "ELM327 v1.5"
+    CAN_PROTOCOLS = {
+        6: "ISO 15765-4 (CAN 11/500)",
+        7: "ISO 15765-4 (CAN 29/500)",
+        8: "ISO 15765-4 (CAN 11/250)",
+        9: "ISO 15765-4 (CAN 29/250)",
+    }
+    DEFAULT_PROTOCOL = 6
+    DEFAULT_TIMEOUT = 0x32  # in units of 4 ms, as ATST
+    RESPONSE_PENDING_TIMEOUT = 5.0  # P2* after a 0x78 negative response
+    MIN_ADAPTIVE_WAIT = 0.005
+
+    def __init__(self):
+        super(ELMEmulatorTransport, self).__init__()
+        self._in = bytearray()
+        self._out = bytearray()
+        self._ResetState()
+
+    def _ResetState(self):
+        self._echo = True
+        self._headers = False
+        self._spaces = True
+        self._linefeeds = False
+        self._caf = True
+        self._responses = True
+        self._header = None
+        self._priority = 0x18
+        self._protocol = 0
+        self._timeout = self.DEFAULT_TIMEOUT
+        self._adaptive = 1
+        self._filter = None
+        self._monitoring = False
+        self._last_cmd = ''
+
+    def _SendFrame(self, id, data):
+        raise NotImplementedError()
+
+    def _RecvFrame(self, timeout):
+        raise NotImplementedError()
+
+    #
+    # OBDTransport interface
+    #
+
+    def Send(self, data):
+        if not self._connected:
+            raise IOError("Not connected")
+
+        if self._monitoring:
+            # Any character stops the monitor
+            self._monitoring = False
+            self._Reply(["STOPPED"])
+            return len(data)
+
+        self._in.extend(data)
+        while b'\r' in self._in:
+            end = self._in.find(b'\r')
+            line = self._in[:end].decode('ascii', 'replace')
+            del self._in[:end + 1]
+            self._Execute(line.replace('\n', ''))
+
+        return len(data)
+
+    def Recv(self, len):
+        if not self._connected:
+            raise IOError("Not connected")
+
+        while not self._out and self._monitoring:
+            self._out.extend(self._FormatMonitor(self._RecvFrames(0.1)))
+
+        data = bytes(self._out[:len])
+        del self._out[:len]
+        return data
+
+    def HasRawFrames(self):
+        return True
+
+    def RecvFrames(self, timeout=None):
+        """Returns frames seen in monitor mode as (timestamp, id, data)"""
+        if not self._monitoring:
+            raise IOError("Not monitoring")
+
+        return self._RecvFrames(timeout)
+
+    #
+    # ELM327 command interpreter
+    #
+
+    def _Reply(self, lines, prompt=True):
+        eol = self._linefeeds and '\r\n' or '\r'
+        text = ''.join(line + eol for line in lines)
+        if prompt:
+            text += eol + '>'
+        self._out.extend(text.encode('ascii'))
+
+    def _Hex(self, data):
+        if self._spaces:
+            return ''.join('%02X ' % b for b in data)
+        return ''.join('%02X' % b for b in data)
+
+    def _HeaderText(self, id):
+        if self._Is29Bit():
+            return self._Hex(struct.pack('>I', id))
+        return self._spaces and '%.3X ' % id or '%.3X' % id
+
+    def _Is29Bit(self):
+        return self._Protocol() in (7, 9)
+
+    def _Protocol(self):
+        return self._protocol or self.DEFAULT_PROTOCOL
+
+    def _TxId(self):
+        if self._header is not None:
+            return self._header
+        return self._Is29Bit() and 0x18DB33F1 or 0x7DF
+
+    def _IsResponse(self, id, tx):
+        if self._filter is not None:
+            return self._MatchesFilter(id)
+        if self._Is29Bit():
+            return (id & 0xFFFFFF00) == 0x18DAF100
+        if tx == 0x7DF:
+            return 0x7E8 <= id <= 0x7EF
+        return id == tx + 8
+
+    def _FlowControlId(self, id):
+        if self._Is29Bit():
+            return 0x18DA00F1 | ((id & 0xFF) << 8)
+        if 0x7E8 <= id <= 0x7EF or self._header is None:
+            return id - 8
+        return self._header
+
+    def _MatchesFilter(self, id):
+        text = self._Is29Bit() and '%.8X' % id or '%.3X' % id
+        if len(text) != len(self._filter):
+            return False
+        for c, f in zip(text, self._filter):
+            if f != 'X' and c != f:
+                return False
+        return True
+
+    def _Execute(self, line):
+        cmd = line.replace(' ', '').upper()
+        if cmd == '':
+            cmd = self._last_cmd
+        self._last_cmd = cmd
+
+        if self._echo:
+            self._out.extend((line + '\r').encode('ascii'))
+
+        if cmd.startswith('AT'):
+            self._ExecuteAT(cmd[2:])
+        elif cmd:
+            self._ExecuteRequest(cmd)
+        else:
+            self._Reply(["?"])
+
+    def _ExecuteAT(self, cmd):
+        flags = {'E': '_echo', 'H': '_headers', 'S': '_spaces',
+                 'L': '_linefeeds', 'R': '_responses'}
+
+        if cmd in ('Z', 'WS', 'D'):
+            self._ResetState()
+            if cmd == 'D':
+                self._Reply(["OK"])
+            else:
+                self._Reply(["", self.VERSION])
+        elif cmd == 'I':
+            self._Reply([self.VERSION])
+        elif cmd == '@1':
+            self._Reply([self.Describe()])
+        elif len(cmd) == 2 and cmd[0] in flags and cmd[1] in '01':
+            setattr(self, flags[cmd[0]], cmd[1] == '1')
+            self._Reply(["OK"])
+        elif cmd in ('CAF0', 'CAF1'):
+            self._caf = cmd == 'CAF1'
+            self._Reply(["OK"])
+        elif cmd in ('AT0', 'AT1', 'AT2'):
+            self._adaptive = int(cmd[2])
+            self._Reply(["OK"])
+        elif cmd.startswith('ST') and len(cmd) == 4:
+            self._timeout = int(cmd[2:], 16) or self.DEFAULT_TIMEOUT
+            self._Reply(["OK"])
+        elif cmd.startswith('SH'):
+            self._header = int(cmd[2:], 16)
+            if len(cmd) == 8:
+                # 3 byte form: priority byte set with ATCP
+                self._header |= self._priority << 24
+            self._Reply(["OK"])
+        elif cmd.startswith('CP') and len(cmd) == 4:
+            self._priority = int(cmd[2:], 16) & 0x1F
+            self._Reply(["OK"])
+        elif cmd.startswith('SP') or cmd.startswith('TP'):
+            self._protocol = int(cmd[-1], 16)
+            self._Reply(["OK"])
+        elif cmd.startswith('CRA'):
+            self._filter = cmd[3:] or None
+            self._Reply(["OK"])
+        elif cmd == 'DP':
+            self._Reply([(self._protocol == 0 and "AUTO, " or "") +
+                         self.CAN_PROTOCOLS.get(self._Protocol(), "?")])
+        elif cmd == 'DPN':
+            self._Reply([(self._protocol == 0 and "A" or "") + "%X" % self._Protocol()])
+        elif cmd == 'MA':
+            self._monitoring = True
+        elif cmd in ('AL', 'NL', 'PC', 'M0', 'M1', 'CSM0', 'CSM1') or \
+                cmd.startswith('CF') or cmd.startswith('CM') or cmd.startswith('IB'):
+            self._Reply(["OK"])
+        else:
+            self._Reply(["?"])
+
+    def _ExecuteRequest(self, cmd):
+        if self._Protocol() not in self.CAN_PROTOCOLS:
+            self._Reply(["UNABLE TO CONNECT"])
+            return
+
+        # An odd digit count means a trailing response count hint (e.g. 010C1)
+        count = None
+        if len(cmd) % 2:
+            count = int(cmd[-1], 16)
+            cmd = cmd[:-1]
+
+        try:
+            payload = bytes.fromhex(cmd)
+        except ValueError:
+            self._Reply(["?"])
+            return
+
+        if not self._caf:
+            # Raw mode: the bytes are the frame data
+            self._SendFrame(self._TxId(), payload)
+            if not self._responses:
+                self._Reply([])
+                return
+            results = self._CollectRaw()
+        else:
+            if not payload or len(payload) > obd_isotp.MAX_LENGTH:
+                self._Reply(["?"])
+                return
+            results = self._Exchange(payload, count)
+
+        if not results:
+            self._Reply(["NO DATA"])
+        else:
+            self._Reply(self._FormatResponses(results))
+
+    #
+    # CAN side
+    #
+
+    def _RecvFrames(self, timeout):
+        frames = []
+        frame = self._RecvFrame(timeout)
+        while frame is not None:
+            if self._filter is None or self._MatchesFilter(frame[1]):
+                frames.append(frame)
+            if len(frames) >= 256:
+                break
+            frame = self._RecvFrame(0)
+        return frames
+
+    def _Exchange(self, payload, count=None):
+        """Sends an ISO-TP request and collects the responses.
+
+        Returns a list of (id, payload, frames)."""
+        tx = self._TxId()
+        frames = obd_isotp.segment(payload)
+        self._SendFrame(tx, frames[0])
+        if len(frames) > 1 and not self._SendConsecutive(tx, frames[1:]):
+            return []
+
+        timeout = self._timeout * 0.004
+        start = time.time()
+        deadline = start + timeout
+        reassemblers = {}
+        results = []
+        while True:
+            frame = self._RecvFrame(deadline - time.time())
+            if frame is None:
+                break
+
+            t, id, data = frame
+            if not self._IsResponse(id, tx):
+                continue
+
+            r = reassemblers.setdefault(id, obd_isotp.Reassembler())
+            msg = r.feed(data)
+            if r.need_flow_control:
+                r.need_flow_control = False
+                self._SendFrame(self._FlowControlId(id), obd_isotp.flow_control())
+                deadline = time.time() + timeout
+                continue
+
+            if msg is None:
+                if r.in_progress():
+                    deadline = time.time() + timeout
+                continue
+
+            if len(msg) >= 3 and msg[0] == 0x7F and msg[2] == 0x78:
+                # Response pending: the ECU needs more time
+                deadline = time.time() + self.RESPONSE_PENDING_TIMEOUT
+                continue
+
+            results.append((id, msg, r.frames))
+            if count and len(results) >= count:
+                break
+
+            now = time.time()
+            if self._adaptive:
+                # Other ECUs answer about as fast as the first one did
+                wait = max(2 * (now - start), self.MIN_ADAPTIVE_WAIT)
+                deadline = min(now + timeout, now + wait)
+            else:
+                deadline = now + timeout
+
+        return results
+
+    def _SendConsecutive(self, tx, frames):
+        """Waits for flow control and sends the rest of a multi-frame request"""
+        r = obd_isotp.Reassembler()
+        i = 0
+        while i < len(frames):
+            deadline = time.time() + self._timeout * 0.004
+            r.flow_control = None
+            while r.flow_control is None:
+                frame = self._RecvFrame(deadline - time.time())
+                if frame is None:
+                    return False
+                if self._IsResponse(frame[1], tx):
+                    r.feed(frame[2])
+
+            status, block_size, st_min = r.flow_control
+            if status == obd_isotp.FC_OVERFLOW:
+                return False
+            if status == obd_isotp.FC_WAIT:
+                continue
+
+            end = block_size and i + block_size or len(frames)
+            for frame in frames[i:end]:
+                self._SendFrame(tx, frame)
+                time.sleep(obd_isotp.st_min_seconds(st_min))
+            i = end
+
+        return True
+
+    def _CollectRaw(self):
+        tx = self._TxId()
+        timeout = self._timeout * 0.004
+        deadline = time.time() + timeout
+        results = []
+        while True:
+            frame = self._RecvFrame(deadline - time.time())
+            if frame is None:
+                break
+            if self._IsResponse(frame[1], tx):
+                results.append((frame[1], frame[2], [frame[2]]))
+                deadline = time.time() + timeout
+        return results
+
+    def _FormatResponses(self, results):
+        lines = []
+        for id, payload, frames in results:
+            if self._headers or not self._caf:
+                for frame in frames:
+                    line = self._Hex(frame)
+                    if self._headers:
+                        line = self._HeaderText(id) + line
+                    lines.append(line)
+            elif len(payload) <= 7:
+                lines.append(self._Hex(payload))
+            else:
+                lines.append("%.3X" % len(payload))
+                lines.append("0: " + self._Hex(payload[:6]))
+                seq = 1
+                for i in range(6, len(payload), 7):
+                    lines.append("%X: " % (seq & 0xF) + self._Hex(payload[i:i + 7]))
+                    seq += 1
+
+        return lines
+
+    def _FormatMonitor(self, frames):
+        eol = self._linefeeds and '\r\n' or '\r'
+        text = ''
+        for t, id, data in frames:
+            if self._caf and data and (data[0] >> 4) == obd_isotp.PCI_SINGLE:
+                data = data[1:1 + (data[0] & 0xF)]
+            line = self._Hex(data)
+            if self._headers:
+                line = self._HeaderText(id) + line
+            text += line + eol
+        return text.encode('ascii')
+
+    def Describe(self):
+        return "ELM327 emulator"
+
+
+class SocketCANTransport(ELMEmulatorTransport):
+    """ Talks to a Linux SocketCAN interface (can0, vcan0, ...) directly.
+
+    The bitrate is configured on the interface itself (ip link set can0 type
+    can bitrate 500000), not through the protocol selection."""
+
+    def Connect(self, address, **kwargs):
+        if not is_socketcan_interface(address):
+            raise ValueError("SocketCAN interface name required")
+
+        try:
+            self._socket = CANSocket(address)
+        except (OSError, AttributeError) as e:
+            self._error = str(e)
+            return False
+
+        self._iface = address
+        self._OnConnected()
+        return True
+
+    def Close(self):
+        if self._connected:
+            self._socket.close()
+        self._OnDisconnected()
+
+    def Describe(self):
+        return "SocketCAN %s" % self._iface
+
+    def _SendFrame(self, id, data):
+        self._socket.send(id, data)
+
+    def _RecvFrame(self, timeout):
+        return self._socket.recv(timeout)
+
 
 def CreateTransport(typ):
     if typ == TransportType.BLUETOOTH and HAS_PYBLUEZ:
         return BluetoothTransport()
     elif typ == TransportType.SERIAL:
         return SerialTransport()
+    elif typ == TransportType.SOCKETCAN:
+        return SocketCANTransport()
+    elif typ == TransportType.SIMULATOR:
+        from obd_sim import SimulatedTransport
+        return SimulatedTransport()
 
     return None
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_uds.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Manufacturer specific data (Mode 22, UDS ReadDataByIdentifier).
+
+Enhanced PIDs are 2 byte data identifiers (DIDs) read from one ECU with
+a physical request. They are defined per make or ECU in the text files of
+obd_mode22/, in the columns of obd_mode01.txt, with directives for the
+file:
+
+    !make Ford              shown with the channels
+    !wmi 1FA 1FT            VIN prefixes the file applies to (all if none)
+    !header 7E0             request header of the following lines
+    !batch 3                DIDs the ECU accepts in one request
+
+The channels become Sensors with an index of their own (sensor_id), so
+OBDPort.sensor() and the recorders read them like Mode 01 PIDs.
+
+An ECU that supports DynamicallyDefineDataIdentifier (0x2C) can also pack
+the values of many channels, Mode 01 PIDs included (as DIDs F4xx), into
+one dynamic DID, read with a single request (DynamicDID).
+
+With ReadDataByPeriodicIdentifier (0x2A) the ECU sends dynamic DIDs
+F2xx by itself, at a slow, medium or fast rate, until told to stop. Each
+periodic message is one single frame on the ECU's response id: the low
+byte of the DID, then up to PERIODIC_DATA bytes of data.
+"""
+
+import os
+
+import obd_sensors
+
+READ_DID = 0x22
+POSITIVE = 0x62
+NEGATIVE = 0x7F
+SESSION = 0x10
+EXTENDED_SESSION = 0x03
+DYNAMIC_DEFINE = 0x2C
+DEFINE_BY_ID = 0x01
+CLEAR_DYNAMIC = 0x03
+READ_PERIODIC = 0x2A
+TESTER_PRESENT = 0x3E
+
+# Transmission modes of 0x2A; the rates are up to the ECU, typically
+# about 1 s, 300 ms and 25 ms
+PERIODIC_SLOW = 0x01
+PERIODIC_MEDIUM = 0x02
+PERIODIC_FAST = 0x03
+PERIODIC_STOP = 0x04
+
+DYNAMIC_DID = 0xF300  # first of the dynamically defined DIDs
+PERIODIC_DID = 0xF200  # first of the DIDs 0x2A can send
+OBD_DID = 0xF400  # Mode 01 PID nn is DID F4nn on UDS ECUs
+
+# Negative response codes
+SERVICE_NOT_SUPPORTED = 0x11
+INCORRECT_LENGTH = 0x13  # usually: only one DID per request
+RESPONSE_TOO_LONG = 0x14
+CONDITIONS_NOT_CORRECT = 0x22
+REQUEST_OUT_OF_RANGE = 0x31  # DID not supported
+RESPONSE_PENDING = 0x78
+NOT_IN_SESSION = 0x7F  # service not supported in the active session
+
+# The ELM327 only sends single frame requests (7 bytes): 3 DIDs after the
+# service byte
+MAX_DIDS = 3
+MAX_PERIODIC = 5  # periodic DIDs per 0x2A request
+PERIODIC_DATA = 6  # data bytes in a periodic message (single frame)
+
+NRC_NAMES = {
+    0x10: "GENERALREJECT",
+    SERVICE_NOT_SUPPORTED: "SERVICENOTSUPPORTED",
+    0x12: "SUBFUNCTIONNOTSUPPORTED",
+    INCORRECT_LENGTH: "INCORRECTLENGTH",
+    RESPONSE_TOO_LONG: "RESPONSETOOLONG",
+    CONDITIONS_NOT_CORRECT: "CONDITIONSNOTCORRECT",
+    REQUEST_OUT_OF_RANGE: "OUTOFRANGE",
+    0x33: "SECURITYACCESSDENIED",
+    RESPONSE_PENDING: "PENDING",
+    NOT_IN_SESSION: "SERVICENOTSUPPORTEDINSESSION",
+}
+
+# A 0x2C request refused with one of these may work in the extended session
+SESSION_NRCS = (CONDITIONS_NOT_CORRECT, NOT_IN_SESSION)
+
+# A batch rejected with one of these is retried one DID at a time, and
+# the ECU is not sent batches again
+NO_BATCH = (0x12, INCORRECT_LENGTH, RESPONSE_TOO_LONG)
+
+DEFINITIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "obd_mode22")
+
+
+#__________________________________________________________________________
+
+
+def sensor_id(header, did):
+    """Sensor index of a DID of one ECU, clear of the Mode 01 PIDs"""
+    return (READ_DID << 48) | (header << 16) | did
+
+
+class EnhancedSensor(obd_sensors.Sensor):
+    """ A Mode 22 channel: a DID read from the ECU at header """
+
+    def __init__(self, shortName, sensorName, header, did, bytesReturned,
+                 sensorValueFunction, u, minimum=None, maximum=None,
+                 make=None, wmis=(), batch=1):
+        obd_sensors.Sensor.__init__(self, shortName, sensorName, sensor_id(header, did),
+                                    bytesReturned, sensorValueFunction, u, minimum, maximum)
+        self.header = header
+        self.did = did
+        self.make = make
+        self.wmis = wmis
+        self.batch = batch  # DIDs per request the ECU accepts
+
+    def applies_to(self, vin):
+        """True if the definition is for the car with this VIN (or for
+        any car). Without a VIN every definition applies."""
+        return not self.wmis or not vin or vin[:3].upper() in self.wmis
+
+
+def load_definitions(directory=DEFINITIONS_DIR):
+    """Reads all definition files. Returns a list of EnhancedSensors."""
+    sensors = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return sensors
+
+    for filename in names:
+        if filename.endswith('.txt'):
+            sensors.extend(load_file(os.path.join(directory, filename)))
+    return sensors
+
+
+def load_file(filename):
+    sensors = []
+    make = os.path.splitext(os.path.basename(filename))[0]
+    wmis = ()
+    header = 0x7E0
+    batch = 1
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if line.startswith('!'):
+                words = line[1:].split()
+                if words[0] == 'make':
+                    make = " ".join(words[1:])
+                elif words[0] == 'wmi':
+                    wmis = tuple(w.upper() for w in words[1:])
+                elif words[0] == 'header':
+                    header = int(words[1], 16)
+                elif words[0] == 'batch':
+                    batch = min(int(words[1]), MAX_DIDS)
+                else:
+                    raise ValueError("%s: unknown directive %s" % (filename, line))
+                continue
+
+            did, length, shortname, name, expr, unit, minimum, maximum = line.split('|')
+            sensors.append(EnhancedSensor(
+                shortname, name, header, int(did, 16), int(length),
+                obd_sensors.decoder(expr), unit,
+                obd_sensors._number(minimum), obd_sensors._number(maximum),
+                make, wmis, batch))
+    return sensors
+
+
+def by_header(sensors):
+    """Groups sensors by ECU header, in header order, so polling them
+    changes the adapter header (ATSH) once per ECU. Returns a list of
+    (header, [sensors])."""
+    groups = {}
+    for sensor in sensors:
+        groups.setdefault(sensor.header, []).append(sensor)
+    return sorted(groups.items())
+
+
+def request(dids):
+    """Request for several DIDs ("22F40D1E1C")"""
+    return "%.2X" % READ_DID + "".join("%.4X" % did for did in dids)
+
+
+def split(payload, sensors):
+    """Splits a positive answer ("62 DID data DID data ...") into
+    {sensor id: data}, by the lengths of the sensors' definitions"""
+    by_did = dict((sensor.did, sensor) for sensor in sensors)
+    values = {}
+    i = 1
+    while i + 2 <= len(payload):
+        sensor = by_did.get((payload[i] << 8) | payload[i + 1])
+        if sensor is None or i + 2 + sensor.length > len(payload):
+            break
+        values[sensor.id] = payload[i + 2:i + 2 + sensor.length]
+        i += 2 + sensor.length
+    return values
+
+
+def negative(res, service=READ_DID):
+    """Returns the negative response code of an answer, None if there is
+    no negative response for the service"""
+    payload = res.find(NEGATIVE, service)
+    if payload is None or len(payload) < 3:
+        return None
+    return payload[2]
+
+
+def source_did(sensor):
+    """DID a sensor's value is read from: its own for Mode 22 sensors,
+    F4xx for Mode 01 PIDs"""
+    if isinstance(sensor, EnhancedSensor):
+        return sensor.did
+    return OBD_DID | (sensor.id & 0xFF)
+
+
+class DynamicDID:
+    """ A dynamically defined DID (0x2C) packing whole source DIDs, one
+    after the other, so the sensors of one ECU are read in one request """
+
+    def __init__(self, header, did, sensors):
+        self.header = header
+        self.did = did
+        self.sensors = list(sensors)
+
+    def define_request(self):
+        """defineByIdentifier: source DID, position (from 1), size each"""
+        request = bytearray([DYNAMIC_DEFINE, DEFINE_BY_ID]) + self.did.to_bytes(2, 'big')
+        for sensor in self.sensors:
+            request += source_did(sensor).to_bytes(2, 'big') + bytes([1, sensor.length])
+        return bytes(request)
+
+    def clear_request(self):
+        return "%.2X%.2X%.4X" % (DYNAMIC_DEFINE, CLEAR_DYNAMIC, self.did)
+
+    def read_request(self):
+        return request([self.did])
+
+    def split(self, payload):
+        """Splits the answer ("62 F300 data...") into {sensor id: data}.
+        None if it is not the answer for this DID or too short."""
+        if len(payload) < 3 or (payload[1] << 8) | payload[2] != self.did:
+            return None
+        return self.unpack(payload[3:])
+
+    def unpack(self, data):
+        """Splits the data of the DID into {sensor id: data}, None if too short"""
+        values = {}
+        i = 0
+        for sensor in self.sensors:
+            if i + sensor.length > len(data):
+                return None
+            values[sensor.id] = data[i:i + sensor.length]
+            i += sensor.length
+        return values
+
+    def size(self):
+        return sum(sensor.length for sensor in self.sensors)
+
+
+def periodic_mode(rate):
+    """Transmission mode for a wanted rate (Hz)"""
+    if rate >= 10:
+        return PERIODIC_FAST
+    if rate >= 2:
+        return PERIODIC_MEDIUM
+    return PERIODIC_SLOW
+
+
+def pack_periodic(header, sensors, did=PERIODIC_DID):
+    """Packs sensors into DynamicDIDs from did on, each small enough for a
+    periodic message. Sensors longer than that are left out."""
+    dids = []
+    group = []
+    for sensor in sensors:
+        if sensor.length > PERIODIC_DATA:
+            continue
+        if sum(s.length for s in group) + sensor.length > PERIODIC_DATA:
+            dids.append(DynamicDID(header, did + len(dids), group))
+            group = []
+        group.append(sensor)
+    if group:
+        dids.append(DynamicDID(header, did + len(dids), group))
+    return dids
+
+
+def periodic_request(mode, dids):
+    """0x2A request for up to MAX_PERIODIC DIDs F2xx ("2A03F0F1")"""
+    return "%.2X%.2X" % (READ_PERIODIC, mode) + "".join("%.2X" % (did & 0xFF) for did in dids)
+
+
+def periodic_message(frame):
+    """Splits a raw periodic frame (PCI byte included) into (DID low byte,
+    data), None if it isn't a single frame"""
+    length = frame[0] & 0x0F
+    if frame[0] >> 4 or not 1 < length < len(frame):
+        return None
+    return frame[1], frame[2:1 + length]
+
+
+def describe(nrc):
+    return NRC_NAMES.get(nrc, "NRC%.2X" % nrc)
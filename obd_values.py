@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_values.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Latest-value store shared by acquisition threads and the UI.
+
+Producers overwrite values as fast as they like; the UI drains the set of
+changed keys at its own refresh rate. A key written many times between two
+refreshes is applied once, so UI work depends on the number of cells that
+changed, not on the number of samples taken.
+"""
+
+from collections import deque
+
+
+class ValueStore:
+    """ Map of key -> latest value with change tracking.
+
+    Writers don't take a lock: the value is stored first and the key is then
+    queued on a deque (both atomic operations), so a reader that sees the key
+    also sees a value at least as new as the one that queued it."""
+
+    def __init__(self):
+        self._values = {}
+        self._dirty = deque()
+
+    def set(self, key, value):
+        if self._values.get(key, self) == value:
+            return
+        self._values[key] = value
+        self._dirty.append(key)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def changed(self):
+        """Returns [(key, value)] for every key written since the last call"""
+        dirty = self._dirty
+        keys = set()
+        try:
+            while True:
+                keys.add(dirty.popleft())
+        except IndexError:
+            pass
+
+        values = self._values
+        return [(key, values[key]) for key in keys if key in values]
+
+    def clear(self):
+        self._values.clear()
+        self._dirty.clear()
+
+    def snapshot(self):
+        return dict(self._values)
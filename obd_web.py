@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+###########################################################################
+# obd_web.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Local web dashboard: gauges in any browser on the LAN, no wx needed.
+
+One SensorPoller reads the poll set. A hub versions every value, and each
+connected browser gets a Server-Sent Events stream carrying, once per
+client tick, only the values that changed since its previous batch. Extra
+clients therefore cost one small JSON write per tick, not extra adapter
+traffic. Everything (including the page) is served locally.
+
+    ./obd_web.py [port] [--listen 0.0.0.0] [--http-port 8080] [--pids 0C,0D]
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from obd_capture import OBD_Capture
+from obd_poller import SensorPoller
+
+CLIENT_TICK = 0.25  # seconds between batches sent to one client
+KEEPALIVE = 15.0    # seconds between SSE comments on an idle stream
+PUMP_INTERVAL = 0.05
+
+
+#__________________________________________________________________________
+
+
+class ValueHub:
+    """ Versioned copy of the latest values, shared by all clients.
+
+    A single pump drains the poller's ValueStore; clients remember the last
+    version they sent and ask for everything newer."""
+
+    def __init__(self, poller):
+        self.poller = poller
+        self.version = 0
+        self._latest = {}  # key -> (version, value)
+        self._cond = threading.Condition()
+        self._quit = False
+
+    def pump(self):
+        while not self._quit:
+            changed = self.poller.values.changed()
+            if changed:
+                with self._cond:
+                    self.version += 1
+                    for key, value in changed:
+                        self._latest[key] = (self.version, value)
+                    self._cond.notify_all()
+            time.sleep(PUMP_INTERVAL)
+
+    def start(self):
+        threading.Thread(target=self.pump, daemon=True).start()
+
+    def stop(self):
+        self._quit = True
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout):
+        """Waits until there is something newer than version seen"""
+        with self._cond:
+            if self.version <= seen and not self._quit:
+                self._cond.wait(timeout)
+            return self.version
+
+    def since(self, seen):
+        """Returns (version, {key: value}) of the values changed after seen"""
+        with self._cond:
+            return self.version, dict((key, value) for key, (version, value)
+                                      in self._latest.items() if version > seen)
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, hub, sensors, tick=CLIENT_TICK):
+        ThreadingHTTPServer.__init__(self, address, DashboardHandler)
+        self.hub = hub
+        self.sensors = sensors  # [[index, Sensor]]
+        self.tick = tick
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/':
+            self.send_body(PAGE, "text/html; charset=utf-8")
+        elif path == '/sensors':
+            self.send_body(json.dumps([
+                {"index": index, "name": sensor.name, "unit": sensor.unit}
+                for index, sensor in self.server.sensors]), "application/json")
+        elif path == '/events':
+            self.stream()
+        else:
+            self.send_error(404)
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        hub = self.server.hub
+        poller = hub.poller
+        seen = 0
+        try:
+            while True:
+                version = hub.wait(seen, KEEPALIVE)
+                if version <= seen:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+
+                seen, changed = hub.since(seen)
+                batch = {
+                    "values": dict((str(key), result[1]) for key, result in changed.items()),
+                    "stats": {"reads": poller.polls, "rate": round(poller.rate(), 1),
+                              "latency": round(poller.latency * 1000), "errors": poller.errors},
+                }
+                data = json.dumps(batch, default=str)
+                self.wfile.write(("data: %s\n\n" % data).encode('utf-8'))
+                self.wfile.flush()
+
+                # Everything that changes before the next tick goes out in one batch
+                time.sleep(self.server.tick)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>pyOBD</title>
+<style>
+body { background: #000; color: #fff; font-family: monospace; margin: 0; }
+#gauges { display: flex; flex-wrap: wrap; }
+.gauge { flex: 1 1 14em; margin: 0.5em; padding: 0.8em; border: 2px solid #5a5a5a;
+         border-radius: 8px; text-align: center; }
+.value { font-size: 2.4em; }
+.name { font-weight: bold; color: #ccc; }
+#stats { color: #888; padding: 0.5em; }
+</style></head>
+<body>
+<div id="gauges"></div>
+<div id="stats">connecting...</div>
+<script>
+var cells = {};
+function fmt(v) {
+  return (typeof v === "number" && !Number.isInteger(v)) ? v.toFixed(2) : String(v);
+}
+fetch("/sensors").then(function (r) { return r.json(); }).then(function (sensors) {
+  var root = document.getElementById("gauges");
+  sensors.forEach(function (s) {
+    var g = document.createElement("div");
+    g.className = "gauge";
+    g.innerHTML = '<div class="value">--</div><div class="name"></div>';
+    g.lastChild.textContent = s.unit + " " + s.name;
+    root.appendChild(g);
+    cells[s.index] = g.firstChild;
+  });
+  var events = new EventSource("/events");
+  events.onmessage = function (e) {
+    var batch = JSON.parse(e.data);
+    for (var key in batch.values) {
+      if (cells[key]) cells[key].textContent = fmt(batch.values[key]);
+    }
+    var s = batch.stats;
+    document.getElementById("stats").textContent = s.reads + " reads (" + s.rate +
+      "/s)  latency " + s.latency + " ms  errors " + s.errors;
+  };
+  events.onerror = function () {
+    document.getElementById("stats").textContent = "disconnected, retrying...";
+  };
+});
+</script>
+</body></html>
+"""
+
+
+def serve(port_name=None, listen='127.0.0.1', http_port=8080, pids=None, tick=CLIENT_TICK,
+          compact=False, tune_timeouts=False):
+    capture = OBD_Capture()
+    while True:
+        ports = port_name and [port_name] or capture.scan_ports()
+        if ports and capture.connect(ports[0], compact, tune_timeouts):
+            break
+        print("Could not connect, retrying...")
+        time.sleep(1)
+
+    sensors = capture.read_supported_sensors()
+    if pids:
+        sensors = [s for s in sensors if s[0] in pids]
+
+    poller = SensorPoller(capture.is_connected())
+    poller.set_pages([index for index, sensor in sensors])
+    poller.start()
+    hub = ValueHub(poller)
+    hub.start()
+
+    server = DashboardServer((listen, http_port), hub, sensors, tick)
+    print("Dashboard on http://%s:%d/" % (listen, http_port))
+    try:
+        server.serve_forever()
+    finally:
+        hub.stop()
+        poller.stop()
+        server.server_close()
+        poller.join(2)
+        capture.is_connected().close()  # also saves tuned timeouts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local web dashboard (Server-Sent Events)")
+    parser.add_argument("port", nargs='?', help="serial port, bluetooth MAC or SocketCAN interface")
+    parser.add_argument("--listen", default='127.0.0.1',
+                        help="address to listen on (0.0.0.0 for the LAN)")
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--pids", help="poll set as hex PIDs, e.g. 0C,0D,05 (default: all supported)")
+    parser.add_argument("--tick", type=float, default=CLIENT_TICK,
+                        help="seconds between updates sent to each client")
+    parser.add_argument("--compact", action="store_true",
+                        help="responses without spaces/linefeeds (fewer bytes per read)")
+    parser.add_argument("--tune", action="store_true",
+                        help="tune the adapter timeout per request (kept per vehicle)")
+    args = parser.parse_args()
+
+    pids = args.pids and set(int(p, 16) for p in args.pids.split(','))
+    serve(args.port, args.listen, args.http_port, pids, args.tick, args.compact, args.tune)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+###########################################################################
+# test_didscan.py
+#
+# This file is part of pyOBD.
+#
+# pyOBD is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# pyOBD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyOBD; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+###########################################################################
+"""Tests of obd_didscan against the simulated car (obd_sim):
+
+    python -m pytest -q test_didscan.py
+"""
+
+import pytest
+
+import obd_didscan
+import obd_io
+import obd_sim
+
+VIN = "1FTFW1E50NFA00001"
+CONDITIONS_NOT_CORRECT = 0x22
+
+
+class ScanECU(obd_sim.SimulatedECU):
+    """ Simulated ECU that records the DIDs asked for, refuses some with
+    "conditions not correct" and can stop answering after some requests """
+
+    def __init__(self, id, dids, busy=(), silent_after=None, **kwargs):
+        dids = dict(dids)
+        dids[obd_didscan.PROBE_DID] = VIN.encode('ascii')
+        obd_sim.SimulatedECU.__init__(self, id, {0x0D: b'\x32'}, dids, VIN, **kwargs)
+        self.busy = set(busy)
+        self.silent_after = silent_after  # Mode 22 requests before going silent
+        self.asked = []  # DIDs of the Mode 22 requests answered
+
+    def answer(self, payload, functional):
+        if payload[0] == 0x22 and self.silent_after is not None:
+            if self.silent_after <= 0:
+                return None
+            self.silent_after -= 1
+        return obd_sim.SimulatedECU.answer(self, payload, functional)
+
+    def _read_dids(self, payload):
+        dids = [(payload[i] << 8) | payload[i + 1] for i in range(1, len(payload) - 1, 2)]
+        self.asked.extend(dids)
+        res = obd_sim.SimulatedECU._read_dids(self, payload)
+        if res[0] == 0x7F and res[2] == obd_sim.REQUEST_OUT_OF_RANGE and self.busy & set(dids):
+            return bytes([0x7F, 0x22, CONDITIONS_NOT_CORRECT])
+        return res
+
+
+def connect(*ecus):
+    port = obd_io.OBDPort("sim", None, 2, 2, cache_path=None)
+    assert port.State == 1, port.Error
+    if ecus:
+        port._transport.ecus = list(ecus)
+    return port
+
+
+@pytest.fixture
+def scan_file(tmp_path):
+    return str(tmp_path / "didscan.json")
+
+
+#__________________________________________________________________________
+
+
+def test_found_and_refused(scan_file):
+    ecu = ScanECU(0x7E8, {0x4AB0: b'\x11\x22', 0x4AB5: b'\x33'}, busy=(0x4AB7,),
+                  protected=(0x4AC0,), max_dids=8)
+    port = connect(ecu)
+    scanner = obd_didscan.DIDScanner(port, [0x7E0], 0x4AA0, 0x4ACF, path=scan_file)
+    scanner.run()
+    port.close()
+
+    scan = scanner.scans[0]
+    assert scan.done and scan.stopped is None
+    assert scan.batch == obd_didscan.MAX_BATCH
+    assert scan.found == {0x4AB0: b'\x11\x22', 0x4AB5: b'\x33'}
+    assert scan.denied == {0x4AB7: CONDITIONS_NOT_CORRECT, 0x4AC0: obd_sim.SECURITY_ACCESS_DENIED}
+
+
+def test_batch_falls_back_to_one_did(scan_file):
+    ecu = ScanECU(0x7E9, {0x1E12: b'\x03', 0x1E1C: b'\x05\x00'}, max_dids=1)
+    port = connect(ecu)
+    scanner = obd_didscan.DIDScanner(port, [0x7E1], 0x1E00, 0x1E1F, path=scan_file)
+    scanner.run()
+    port.close()
+
+    scan = scanner.scans[0]
+    assert scan.done
+    assert scan.batch == 1
+    assert scan.found == {0x1E12: b'\x03', 0x1E1C: b'\x05\x00'}
+    # every DID of the range asked for once, one per request
+    assert sorted(did for did in ecu.asked if 0x1E00 <= did <= 0x1E1F) == list(range(0x1E00, 0x1E20))
+
+
+def test_reserved_ranges_skipped(scan_file):
+    ecu = ScanECU(0x7E8, {0xA5F8: b'\x01', 0xA700: b'\x02', 0xA802: b'\x03'}, max_dids=8)
+    port = connect(ecu)
+    scanner = obd_didscan.DIDScanner(port, [0x7E0], 0xA5F0, 0xA80F, path=scan_file)
+    scanner.run()
+    port.close()
+
+    scan = scanner.scans[0]
+    assert scan.done
+    assert scan.found == {0xA5F8: b'\x01', 0xA802: b'\x03'}
+    assert not [did for did in ecu.asked if 0xA600 <= did <= 0xA7FF]
+
+    port = connect(ecu)
+    scanner = obd_didscan.DIDScanner(port, [0x7E0], 0xA6F0, 0xA70F, skip=(), path=scan_file)
+    scanner.run()
+    port.close()
+    assert scanner.scans[0].found == {0xA700: b'\x02'}
+
+
+def test_resume_after_ecu_offline(scan_file):
+    dids = {0x2005: b'\x01', 0x2040: b'\x02', 0x20F0: b'\x03'}
+    ecu = ScanECU(0x7E8, dids, max_dids=8, silent_after=20)
+    port = connect(ecu)
+    port.set_timeout(5)  # 20 ms for the unanswered requests
+    scanner = obd_didscan.DIDScanner(port, [0x7E0], 0x2000, 0x20FF, path=scan_file)
+    scanner.run()
+    port.close()
+
+    scan = scanner.scans[0]
+    assert scan.offline and not scan.done
+    stopped_at = scan.next
+    assert 0x2000 < stopped_at <= 0x20FF
+
+    # Ignition on again: the next run continues where the first one stopped
+    ecu = ScanECU(0x7E8, dids, max_dids=8)
+    port = connect(ecu)
+    scanner = obd_didscan.DIDScanner(port, [0x7E0], 0x2000, 0x20FF, path=scan_file)
+    assert scanner.load() == 1
+    scan = scanner.scans[0]
+    assert scan.next == stopped_at and not scan.offline
+    scanner.run()
+    port.close()
+
+    assert scan.done
+    assert scan.found == dids
+    assert min(did for did in ecu.asked if did != obd_didscan.PROBE_DID) == stopped_at